@@ -29,23 +29,18 @@ It performs the following steps:
  Parameters have to be set by the user in the S1Processor.cfg file
 """
 
-import os, sys, glob, shutil, subprocess, datetime, argparse, configparser
+import os, sys, shutil, datetime, argparse, configparser, traceback
 import numpy as np
-from PIL import Image
-from subprocess import Popen
-from s1tiling import S1FileManager, S1FilteringProcessor, Utils
-from osgeo import gdal
-from zipfile import ZipFile
-
-def execute(cmd):
-    try:
-        print (cmd)
-        subprocess.check_call(cmd, shell = True)
-    except subprocess.CalledProcessError as e:
-        print ('WARNING : Erreur dans la commande : ')
-        print (e.returncode)
-        print (e.cmd)
-        print (e.output)
+from s1tiling import S1FileManager, S1FilteringProcessor, S1BorderMask, Utils
+from s1tiling.S1JobScheduler import S1JobScheduler, S1Job, print_trace_summary
+from s1tiling.S1ProcessingState import S1ProcessingState
+from s1tiling.S1ProductCache import S1ProductCache
+from s1tiling.S1ProductStore import S1ProductStore
+from s1tiling.S1DEMCache import S1DEMCache
+from s1tiling.S1WorkQueue import S1WorkQueue
+from s1tiling.S1AutoTuning import S1AutoTuning
+from s1tiling.S1Downloader import DOWNLOADED, FAILED
+from osgeo import gdal, gdal_array
 
 class Configuration():
     """This class handles the parameters from the cfg file"""
@@ -60,12 +55,39 @@ class Configuration():
         if os.path.exists(self.tmpdir) == False:
             print ("ERROR: "+self.tmpdir+" is a wrong path")
             exit(1)
+        # Persistent cache of the SRTM tiles, shared by the runs
+        self.dem_cache=os.path.join(self.tmpdir, "dem_cache")
+        if config.has_option('Paths','DEMCache'):
+            self.dem_cache=config.get('Paths','DEMCache')
         self.GeoidFile=config.get('Paths','GeoidFile')
+        # Profiling records of the jobs (JSON lines)
+        self.trace_file=os.path.join(self.output_preprocess, "s1tiling_trace.jsonl")
+        if config.has_option('Paths','TraceFile'):
+            self.trace_file=config.get('Paths','TraceFile')
+        # Database of the completed processing steps
+        self.state_database=os.path.join(self.output_preprocess, "s1tiling_state.sqlite")
+        if config.has_option('Paths','StateDatabase'):
+            self.state_database=config.get('Paths','StateDatabase')
         self.pepsdownload=config.getboolean('PEPS','Download')
         self.ROI_by_tiles=config.get('PEPS','ROI_by_tiles')
         self.first_date=config.get('PEPS','first_date')
         self.last_date=config.get('PEPS','last_date')
         self.polarisation=config.get('PEPS','Polarisation')
+        # Server the products are downloaded from, and number of concurrent transfers
+        self.peps_url="https://peps.cnes.fr/resto"
+        if config.has_option('PEPS','URL'):
+            self.peps_url=config.get('PEPS','URL')
+        self.nb_downloads=4
+        if config.has_option('PEPS','NbParallelDownloads'):
+            self.nb_downloads=config.getint('PEPS','NbParallelDownloads')
+        # Lifetime of the cached catalog searches, in seconds (0: no cache)
+        self.catalog_ttl=3600
+        if config.has_option('PEPS','CatalogCacheTTL'):
+            self.catalog_ttl=config.getint('PEPS','CatalogCacheTTL')
+        # If True, the products of a tile are processed while the others are downloaded
+        self.pipeline=False
+        if config.has_option('PEPS','Pipeline'):
+            self.pipeline=config.getboolean('PEPS','Pipeline')
         self.type_image="GRD"
         self.mask_cond=config.getboolean('Mask','Generate_border_mask')
         self.calibration_type=config.get('Processing','Calibration')
@@ -94,10 +116,65 @@ class Configuration():
            self.tiles_list = [s.strip() for s in tiles.split(", ")]
         
         self.TileToProductOverlapRatio=config.getfloat('Processing','TileToProductOverlapRatio')
+        # Disk quota (MB) of the cut rasters kept for the next tiles (0: no limit)
+        self.product_cache_quota=0
+        if config.has_option('Processing','ProductCacheQuota'):
+            self.product_cache_quota=config.getint('Processing','ProductCacheQuota')
+        # tile: the tiles are processed one after the other
+        # product: each product is ortho-rectified onto all its tiles at once
+        self.processing_order="tile"
+        if config.has_option('Processing','ProcessingOrder'):
+            self.processing_order=config.get('Processing','ProcessingOrder').strip().lower()
+        if self.processing_order not in ("tile", "product"):
+            print ("ERROR: ProcessingOrder must be tile or product")
+            exit(1)
+        # Disk quota (MB) of the S1 products in S1Images (0: no limit)
+        self.product_store_quota=0
+        if config.has_option('Processing','ProductStoreQuota'):
+            self.product_store_quota=config.getint('Processing','ProductStoreQuota')
+        # Disk quota (MB) of the SRTM tiles cache (0: no limit)
+        self.dem_cache_quota=0
+        if config.has_option('Processing','DEMCacheQuota'):
+            self.dem_cache_quota=config.getint('Processing','DEMCacheQuota')
         self.Mode=config.get('Processing','Mode')
-        self.nb_procs=config.getint('Processing','NbParallelProcesses')
-        self.ram_per_process=config.getint('Processing','RAMPerProcess')
-        self.OTBThreads=config.getint('Processing','OTBNbThreads')
+        # cli: one otbcli_* command per step, intermediate images on disk
+        # python: steps chained in memory through the OTB python API
+        self.engine="cli"
+        if config.has_option('Processing','Engine'):
+            self.engine=config.get('Processing','Engine').strip().lower()
+        if self.engine not in ("cli", "python"):
+            print ("ERROR: Engine must be cli or python")
+            exit(1)
+        if self.engine == "python":
+            try:
+                import otbApplication
+            except ImportError:
+                print ("ERROR: Engine python requires the OTB python bindings (otbApplication)")
+                exit(1)
+        # "auto" (0) means tuned from the host and from the previous runs
+        def get_auto_int(option):
+            if config.get('Processing',option).strip().lower() == "auto":
+                return 0
+            return config.getint('Processing',option)
+        self.nb_procs=get_auto_int('NbParallelProcesses')
+        self.ram_per_process=get_auto_int('RAMPerProcess')
+        self.OTBThreads=get_auto_int('OTBNbThreads')
+        # Host budgets used to admit jobs (0 means detected from the host)
+        self.cpu_budget=0
+        self.ram_budget=0
+        if config.has_option('Processing','CPUBudget'):
+            self.cpu_budget=config.getint('Processing','CPUBudget')
+        if config.has_option('Processing','RAMBudget'):
+            self.ram_budget=config.getint('Processing','RAMBudget')
+        # Number of archives extracted at once (bounded by the disk bandwidth)
+        self.nb_extractions=4
+        if config.has_option('Processing','NbParallelExtractions'):
+            self.nb_extractions=config.getint('Processing','NbParallelExtractions')
+        # Threads and RAM of the jobs of each stage
+        self.tuning=S1AutoTuning(self)
+        if self.nb_procs <= 0:
+            # The number of jobs is then bounded by the budgets only
+            self.nb_procs=self.tuning.nb_cpus
         self.filtering_activated=config.getboolean('Filtering','Filtering_activated')
         self.Reset_outcore=config.getboolean('Filtering','Reset_outcore')
         self.Window_radius=config.getint('Filtering','Window_radius')
@@ -112,6 +189,13 @@ class Configuration():
             self.stderrfile = None  
         
         self.cluster=config.getboolean('HPC-Cluster','Parallelize_tiles')
+        # Shared queue the tiles are pulled from by several workers (optional)
+        self.work_queue=None
+        if config.has_option('HPC-Cluster','WorkQueue'):
+            self.work_queue=config.get('HPC-Cluster','WorkQueue')
+        self.lease_duration=600
+        if config.has_option('HPC-Cluster','LeaseDuration'):
+            self.lease_duration=config.getint('HPC-Cluster','LeaseDuration')
 
         def check_date (self):
             import datetime
@@ -136,345 +220,939 @@ class Sentinel1PreProcess():
             os.remove("S1ProcessorOut.log")
         except os.error:
             pass
-        self.cfg=cfg      
-        
-    def generate_border_mask(self, all_ortho):
-                """
-                This method generate the border mask files from the
-                orthorectified images.
-
-                Args:
-                  all_ortho: A list of ortho-rectified S1 images
-                  """
-                cmd_bandmath = []
-                cmd_morpho = []
-                files_to_remove = []
-                print ("Generate Mask ...")
-                for current_ortho in all_ortho:
-                    if "vv" not in current_ortho:
-                        continue
-                    working_directory = os.path.split(current_ortho)[0]
-                    name_border_mask = os.path.split(current_ortho)[1]\
-                                              .replace(".tif", "_BorderMask.tif")
-                    name_border_mask_tmp = os.path.split(current_ortho)[1]\
-                                                .replace(".tif", "_BorderMask_TMP.tif")
-                    files_to_remove.append(os.path.join(working_directory,\
-                                                        name_border_mask_tmp))
-                    cmd_bandmath.append('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+'otbcli_BandMath -ram '\
-                                        +str(self.cfg.ram_per_process)\
-                                        +' -il '+current_ortho\
-                                        +' -out '+os.path.join(working_directory,\
-                                                               name_border_mask_tmp)\
-                                        +' uint8 -exp "im1b1==0?0:1"')
-
-                    #due to threshold approximation
-
-                    cmd_morpho.append('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+"otbcli_BinaryMorphologicalOperation -ram "\
-                                      +str(self.cfg.ram_per_process)+" -progress false -in "\
-                                      +os.path.join(working_directory,\
-                                                    name_border_mask_tmp)\
-                                      +" -out "\
-                                      +os.path.join(working_directory,\
-                                                    name_border_mask)\
-                                      +" uint8 -structype ball"\
-                                      +" -structype.ball.xradius 5"\
-                                      +" -structype.ball.yradius 5 -filter opening")
-
-                self.run_processing(cmd_bandmath, title="   Mask building")
-                self.run_processing(cmd_morpho, title="   Mask smoothing")
-                for file_it in files_to_remove:
-                    if os.path.exists(file_it) == True:
-                        os.remove(file_it)
-                print ("Generate Mask done")
-
-    def cut_image_cmd(self, raw_raster):
-        """
-        This method remove pixels on the image borders.
+        self.cfg=cfg
+        self.scheduler=S1JobScheduler(cfg)
+        self.state=S1ProcessingState(cfg)
+        self.cache=S1ProductCache(cfg, self.state)
+        self.store=S1ProductStore(cfg)
+
+    def register_consumers(self, tile_name, raster_list):
+        """
+        Declare the S1 images a pending tile needs, so that the products
+        and their cut rasters are kept until the tile is processed.
+
         Args:
-          raw_raster: list of raw S1 raster file to calibrate
-        """
-        def needToBeCrop(image_name, thr):
-            imgpil = Image.open(image_name)
-            ima = np.asarray(imgpil)
-            nbNan = len(np.argwhere(ima==0))
-            return nbNan>thr
-
-        print ("Cutting ",len(raw_raster))
-        for i in range(len(raw_raster)):
-            for image in raw_raster[i][0].get_images_list():
-
-                image = image.replace(".tiff","_calOk.tiff")
-                image_ok = image.replace("_calOk.tiff", "_OrthoReady.tiff")
-                image_mask=image.replace("_calOk.tiff","_mask.tiff")
-                im1_name = image.replace(".tiff","test_nord.tiff")
-                im2_name = image.replace(".tiff","test_sud.tiff")
-
-                raster = gdal.Open(image)
-                xsize = raster.RasterXSize
-                ysize = raster.RasterYSize
-                npmask= np.ones((ysize,xsize), dtype=bool)
-
-                cut_overlap_range = 1000 # Nombre de pixel a couper sur les cotes. ici 500 = 5km
-                cut_overlap_azimuth = 1600 # Nombre de pixels a couper sur le haut ou le bas
-                thr_nan_for_cropping = cut_overlap_range*2 #Quand on fait les tests, on a pas encore couper les nan sur le cote, d'ou l'utilisatoin de ce thr
-
-                execute('gdal_translate -srcwin 0 100 '+str(xsize)+' 1 '+image+' '+im1_name)
-                execute('gdal_translate -srcwin 0 '+str(ysize-100)+' '+str(xsize)+' 1 '+image+' '+im2_name)
-
-                crop1 = needToBeCrop(im1_name, thr_nan_for_cropping)
-                crop2 = needToBeCrop(im2_name, thr_nan_for_cropping)
-
-                npmask[:,0:cut_overlap_range]=0 # Coupe W
-                npmask[:,(xsize-cut_overlap_range):]=0 # Coupe E
-                if crop1 : npmask[0:cut_overlap_azimuth,:]=0 # Coupe N
-                if crop2 : npmask[ysize-cut_overlap_azimuth:,:]=0 # Coupe S
-
-                driver = gdal.GetDriverByName("GTiff")
-                outdata = driver.Create(image_mask, xsize, ysize, 1, gdal.GDT_Byte)
-                outdata.SetGeoTransform(raster.GetGeoTransform())##sets same geotransform as input
-                outdata.SetProjection(raster.GetProjection())##sets same projection as input
-                outdata.GetRasterBand(1).WriteArray(npmask)
-                outdata.SetGCPs(raster.GetGCPs(),raster.GetGCPProjection())
-                outdata.FlushCache() ##saves to disk!!
-                outdata = None
-
-                execute('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+'otbcli_BandMath ' \
-                               +"-ram "+str(self.cfg.ram_per_process)\
-                               +" -progress false " \
-                               +'-il {} {} -out {} -exp "im1b1*im2b1"'.format(image,image_mask,image_ok))
-
-                if os.path.exists(image_mask) == True: os.remove(image_mask)
-                if os.path.exists(image) == True: os.remove(image)
-                if os.path.exists(im1_name) == True: os.remove(im1_name)
-                if os.path.exists(im2_name) == True: os.remove(im2_name)
-        print ("Cutting done ")
-
-    def do_calibration_cmd(self, raw_raster):
-        """
-        This method performs radiometric calibration of raw S1 images.
+          tile_name: the MGRS tile
+          raster_list: list of (S1 product, tile corners) intersecting the tile
+        """
+        self.cache.set_consumers(tile_name, [image for raster, _ in raster_list\
+                                             for image in raster.get_images_list()])
+        self.store.set_consumers(tile_name, raster_list)
+
+    def release_consumers(self, tile_name):
+        """
+        Declare that a tile does not need its S1 images anymore (it has
+        been processed by another worker of the work queue).
 
         Args:
-          raw_raster: list of raw S1 raster file to calibrate
+          tile_name: the MGRS tile
         """
-        all_cmd = []
-        print ("Calibration ",len(raw_raster))
-        
-        for i in range(len(raw_raster)):
+        self.cache.release(tile_name)
+        self.store.release(tile_name)
 
-            for image in raw_raster[i][0].get_images_list():
-                image_ok = image.replace(".tiff", "_calOk.tiff")
-                if os.path.exists(image_ok) == True:
-                    continue
+    def migrate_outputs(self, tile_name):
+        """
+        Record the images of a tile produced before the processing steps
+        were recorded (ortho-rectified images, concatenations and their
+        border masks), so that they are not produced again. This is done
+        once per tile directory.
+
+        Args:
+          tile_name: the MGRS tile
+        """
+        tile_directory = os.path.join(self.cfg.output_preprocess, tile_name)
+        if not os.path.exists(tile_directory) or self.state.is_migrated(tile_directory):
+            return
+        outputs = []
+        for name in os.listdir(tile_directory):
+            fields = name.split("_")
+            if not name.endswith(".tif") or len(fields) < 6:
+                continue
+            if name.endswith("_BorderMask.tif"):
+                stage = "concatenation" if "xxxxxx" in name else "mask"
+            elif len(name) == 40:
+                stage = "concatenation" if "xxxxxx" in name else "ortho"
+            else:
+                continue
+            outputs.append((name, fields[2], fields[1], stage,\
+                            os.path.join(tile_directory, name)))
+        self.state.migrate(tile_directory, outputs)
+
+    def is_step_done(self, image, tile, stage):
+        """
+        Tells whether a processing step of a raw S1 image has been completed.
 
-                all_cmd.append('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+"otbcli_SARCalibration"\
-                               +" -ram "+str(self.cfg.ram_per_process)\
-                               +" -progress false -in "+image\
-                               +" -out "+image_ok+' -lut '+self.cfg.calibration_type \
-                               +" -noise "+str(self.cfg.removethermalnoise).lower())
+        Args:
+          image: raw S1 raster file
+          tile: the MGRS tile ("" for steps that do not depend on a tile)
+          stage: the processing stage
+        """
+        return self.state.is_done(Utils.get_product_from_s1_raster(image),\
+                                  Utils.get_polar_from_s1_raster(image),\
+                                  tile, stage)
 
-        self.run_processing(all_cmd, title="   Calibration "+self.cfg.calibration_type)
+    def record_step(self, image, tile, stage, output, inputs=()):
+        """
+        Record that a processing step of a raw S1 image has been completed.
 
-        for i in range(len(raw_raster)):
-            for image in raw_raster[i][0].get_images_list():
-                if os.path.exists(image.replace(".tiff", "_calOk.tiff")) == True:
-                   #if os.path.exists(image_ok.replace(".tiff", ".geom")) == True:
-                       #os.remove(image_ok.replace(".tiff", ".geom"))
+        Args:
+          image: raw S1 raster file
+          tile: the MGRS tile ("" for steps that do not depend on a tile)
+          stage: the processing stage
+          output: the file produced by the step
+          inputs: the files the step read
+        """
+        self.state.record(Utils.get_product_from_s1_raster(image),\
+                          Utils.get_polar_from_s1_raster(image),\
+                          tile, stage, output, inputs)
 
-                   #UNCOMMENT TO DELETE RAW DATA
-                   if os.path.exists(image) == True:
-                       #os.remove(image)
-                       pass
+    def record_ortho(self, image, tile_name, ortho_image, inputs):
+        """
+        Write the metadata of a new ortho-rectified image and record that
+        its ortho-rectification step has been completed.
 
-        print ("Calibration done")
+        Args:
+          image: raw S1 raster file
+          tile_name: the MGRS tile
+          ortho_image: the ortho-rectified image
+          inputs: the files the ortho-rectification read
+        """
+        self.write_ortho_metadata(ortho_image)
+        self.record_step(image, tile_name, "ortho", ortho_image, inputs)
 
-        
-    def do_ortho_by_tile(self, raster_list, tile_name, tmp_srtm_dir):
+    def record_output(self, stage, output, inputs=()):
         """
-        This method performs ortho-rectification of a list of
-        s1 images on given tile.
+        Write the metadata of a new image of a tile (named like the
+        ortho-rectified images) and record that the processing step
+        producing it has been completed.
 
         Args:
-          raster_list: list of raw S1 raster file to orthorectify
-          tile_name: Name of the MGRS tile to generate
+          stage: the processing stage
+          output: the file produced by the step
+          inputs: the files the step read
         """
-        all_cmd = []
-        output_files_list = []
-        print ("Start orthorectification :",tile_name)
-        for i in range(len(raster_list)):
-            raster, tile_origin = raster_list[i]
-            manifest = raster.get_manifest()
+        self.write_ortho_metadata(output)
+        name = os.path.basename(output).split("_")
+        self.state.record(os.path.basename(output), name[2], name[1],\
+                          stage, output, inputs)
 
-            for image in raster.get_images_list():
-                image_ok = image.replace(".tiff", "_OrthoReady.tiff")
-                current_date = Utils.get_date_from_s1_raster(image)
-                current_polar = Utils.get_polar_from_s1_raster(image)
-                current_platform = Utils.get_platform_from_s1_raster(image)
-                current_orbit_direction = Utils.get_orbit_direction(manifest)
-                current_relative_orbit = Utils.get_relative_orbit(manifest)
-                out_utm_zone = tile_name[0:2]
-                out_utm_northern = (tile_name[2] >= 'N')
-                working_directory = os.path.join(self.cfg.output_preprocess,\
-                                                 tile_name)
-                if os.path.exists(working_directory) == False:
-                    os.makedirs(working_directory)
-
-                in_epsg = 4326
-                out_epsg = 32600+int(out_utm_zone)
-                if not out_utm_northern:
-                    out_epsg = out_epsg+100
-
-                conv_result = Utils.convert_coord([tile_origin[0]], in_epsg, out_epsg)
-                (x_coord, y_coord,dummy) = conv_result[0]
-                conv_result = Utils.convert_coord([tile_origin[2]], in_epsg, out_epsg)
-                (lrx, lry,dummy) = conv_result[0]
- 
-                if not out_utm_northern and y_coord < 0:
-                    y_coord = y_coord+10000000.
-                    lry = lry+10000000.
-
-                ortho_image_name = current_platform\
-                                   +"_"+tile_name\
-                                   +"_"+current_polar\
-                                   +"_"+current_orbit_direction\
-                                   +'_{:0>3d}'.format(current_relative_orbit)\
-                                   +"_"+current_date\
-                                   +".tif"
-
-                if not os.path.exists(os.path.join(working_directory,ortho_image_name)) and not os.path.exists(os.path.join(working_directory,ortho_image_name[:-11]+"txxxxxx.tif")):                    
-                    cmd = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+"otbcli_OrthoRectification -opt.ram "\
-                      +str(self.cfg.ram_per_process)\
-                      +" -progress false -io.in "+image_ok\
-                      +" -io.out \""+os.path.join(working_directory,\
-                                                  ortho_image_name)\
-                      +"?&writegeom=false\" -interpolator nn -outputs.spacingx "\
-                      +str(self.cfg.out_spatial_res)\
-                      +" -outputs.spacingy -"+str(self.cfg.out_spatial_res)\
-                      +" -outputs.sizex "\
-                      +str(int(round(abs(lrx-x_coord)/self.cfg.out_spatial_res)))\
-                      +" -outputs.sizey "\
-                      +str(int(round(abs(lry-y_coord)/self.cfg.out_spatial_res)))\
-                      +" -opt.gridspacing "+str(self.cfg.grid_spacing)\
-                      +" -map utm -map.utm.zone "+str(out_utm_zone)\
-                      +" -map.utm.northhem "+str(out_utm_northern).lower()\
-                      +" -outputs.ulx "+str(x_coord)\
-                      +" -outputs.uly "+str(y_coord)\
-                      +" -elev.dem "+tmp_srtm_dir+" -elev.geoid "+self.cfg.GeoidFile
-
-                    all_cmd.append(cmd)
-                    output_files_list.append(os.path.join(working_directory,\
-                                                      ortho_image_name))
-
-        self.run_processing(all_cmd, title="Orthorectification")
-
-        # Writing the metadata
-        for f in os.listdir(working_directory):
-            fullpath = os.path.join(working_directory, f)
-            if os.path.isfile(fullpath) and f.startswith('s1') and f.endswith('.tif'):
-                dst = gdal.Open(fullpath, gdal.GA_Update)
-                oin = f.split('_')
-
-                dst.SetMetadataItem('S2_TILE_CORRESPONDING_CODE', tile_name)
-                dst.SetMetadataItem('PROCESSED_DATETIME', str(datetime.datetime.now().strftime('%Y:%m:%d')))
-                dst.SetMetadataItem('ORTHORECTIFIED', 'true')
-                dst.SetMetadataItem('CALIBRATION', str(self.cfg.calibration_type))
-                dst.SetMetadataItem('SPATIAL_RESOLUTION', str(self.cfg.out_spatial_res))
-                dst.SetMetadataItem('IMAGE_TYPE', 'GRD')
-                dst.SetMetadataItem('FLYING_UNIT_CODE', oin[0])
-                dst.SetMetadataItem('POLARIZATION', oin[2])
-                dst.SetMetadataItem('ORBIT', oin[4])
-                dst.SetMetadataItem('ORBIT_DIRECTION', oin[3])
-                if oin[5][9] == 'x':
-                    date = oin[5][0:4]+':'+oin[5][4:6]+':'+oin[5][6:8]+' 00:00:00'
-                else:
-                    date = oin[5][0:4]+':'+oin[5][4:6]+':'+oin[5][6:8]+' '+oin[5][9:11]+':'+oin[5][11:13]+':'+oin[5][13:15]
-                dst.SetMetadataItem('ACQUISITION_DATETIME', date)
+    def border_mask_jobs(self, current_ortho, dependencies=None):
+        """
+        This method builds the job that generates the border mask file
+        of one orthorectified image (see S1BorderMask).
 
-        return output_files_list
+        Args:
+          current_ortho: the ortho-rectified S1 image
+          dependencies: jobs that produce current_ortho
+
+        Returns:
+          The list of jobs
+        """
+        border_mask = current_ortho.replace(".tif", "_BorderMask.tif")
+        _, ram = self.cfg.tuning.get("Mask building")
+        return [S1Job(func=lambda: S1BorderMask.generate_border_mask(current_ortho,\
+                          border_mask, ram),\
+                      stage="Mask building", nb_threads=1, ram=ram,\
+                      dependencies=dependencies, fork=True,\
+                      on_success=lambda: self.record_output("mask", border_mask, [current_ortho]),\
+                      tile=os.path.basename(current_ortho).split("_")[1],\
+                      product=os.path.basename(current_ortho))]
+
+    def cut_image(self, image):
+        """
+        This method remove pixels on the borders of one calibrated image.
+        The decision to cut the north and south borders only reads two
+        lines, and the cut image is written block by block, so that the
+        memory used is bounded by a block instead of by the image size.
+        Args:
+          image: raw S1 raster file whose calibrated image is cut
+        """
+        image = image.replace(".tiff","_calOk.tiff")
+        image_ok = image.replace("_calOk.tiff", "_OrthoReady.tiff")
+
+        xsize, ysize, cut_north, cut_south = Utils.get_border_cut(image)
+        first_line = Utils.CUT_OVERLAP_AZIMUTH if cut_north else 0 # Coupe N
+        last_line = ysize-Utils.CUT_OVERLAP_AZIMUTH if cut_south else ysize # Coupe S
+
+        raster = gdal.Open(image)
+        in_band = raster.GetRasterBand(1)
+        driver = gdal.GetDriverByName("GTiff")
+        outdata = driver.Create(image_ok, xsize, ysize, 1, in_band.DataType,\
+                                ["BIGTIFF=IF_SAFER"])
+        outdata.SetGeoTransform(raster.GetGeoTransform())##sets same geotransform as input
+        outdata.SetProjection(raster.GetProjection())##sets same projection as input
+        outdata.SetGCPs(raster.GetGCPs(),raster.GetGCPProjection())
+        outdata.SetMetadata(raster.GetMetadata())
+        out_band = outdata.GetRasterBand(1)
+
+        # Number of lines per block, so that a block uses about the RAM of the stage
+        item_size = gdal.GetDataTypeSize(in_band.DataType)//8
+        _, ram = self.cfg.tuning.get("Cutting")
+        block_lines = max(1, ram*1024*1024//(2*xsize*item_size))
+
+        for y_start in range(0, ysize, block_lines):
+            y_end = min(ysize, y_start+block_lines)
+            if y_end <= first_line or y_start >= last_line:
+                # The whole block is cut, no need to read it
+                block = np.zeros((y_end-y_start, xsize), dtype=gdal_array.GDALTypeCodeToNumericTypeCode(in_band.DataType))
+            else:
+                block = in_band.ReadAsArray(0, y_start, xsize, y_end-y_start)
+                block[:max(0, first_line-y_start),:] = 0
+                block[max(0, last_line-y_start):,:] = 0
+            block[:,0:Utils.CUT_OVERLAP_RANGE] = 0 # Coupe W
+            block[:,(xsize-Utils.CUT_OVERLAP_RANGE):] = 0 # Coupe E
+            out_band.WriteArray(block, 0, y_start)
+
+        outdata.FlushCache() ##saves to disk!!
+        outdata = None
+        raster = None
+
+        # The sensor model of the calibrated image goes with the cut image
+        if os.path.exists(image.replace(".tiff", ".geom")) == True:
+            shutil.copyfile(image.replace(".tiff", ".geom"),\
+                            image_ok.replace(".tiff", ".geom"))
+        if os.path.exists(image) == True: os.remove(image)
+
+    def cut_job(self, image, dependencies=None):
+        """
+        This method builds the job that removes pixels on the borders
+        of one calibrated image.
+        Args:
+          image: raw S1 raster file whose calibrated image is cut
+          dependencies: jobs that produce the calibrated image
 
-    def concatenate_images(self,tile):
+        Returns:
+          a S1Job instance
+        """
+        image_ok = image.replace(".tiff", "_OrthoReady.tiff")
+
+        def record_cut():
+            self.record_step(image, "", "cut", image_ok, [image])
+            self.cache.add(image)
+
+        return S1Job(func=lambda: self.cut_image(image), stage="Cutting",\
+                     nb_threads=1, ram=self.cfg.tuning.get("Cutting")[1],\
+                     dependencies=dependencies, fork=True,\
+                     on_success=record_cut,\
+                     product=Utils.get_product_from_s1_raster(image))
+
+    def extraction_job(self, raster, image, job):
+        """
+        This method builds the job that extracts an image (and the metadata
+        of its product) from the product archive, for the OTB application
+        which needs real files. The extracted image is removed once that
+        application has succeeded.
+
+        Args:
+          raster: the S1 product, as instance of S1DateAcquisition
+          image: raw S1 raster file to extract
+          job: the job reading the image, which then depends on the extraction
+
+        Returns:
+          a S1Job instance, or None if the image is already on disk
+        """
+        if not raster.needs_extraction(image):
+            return None
+        extraction = S1Job(func=lambda: raster.extract(image), stage="Extraction",\
+                           nb_threads=1, ram=self.cfg.tuning.get("Extraction")[1], fork=True,\
+                           product=Utils.get_product_from_s1_raster(image))
+        job.dependencies.append(extraction)
+        record = job.on_success
+
+        def remove_extracted():
+            if record is not None:
+                record()
+            raster.remove_extracted(image)
+
+        job.on_success = remove_extracted
+        return extraction
+
+    def calibration_job(self, image, dependencies=None):
+        """
+        This method builds the radiometric calibration job of a raw S1 image.
+
+        Args:
+          image: raw S1 raster file to calibrate
+          dependencies: jobs that must succeed before the calibration
+
+        Returns:
+          a S1Job instance, or None if the image is already calibrated
+        """
+        image_ok = image.replace(".tiff", "_calOk.tiff")
+        if self.is_step_done(image, "", "calibration"):
+            return None
+
+        threads, ram = self.cfg.tuning.get("Calibration")
+        job = self.scheduler.new_job('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(threads)+"otbcli_SARCalibration"\
+                       +" -ram "+str(ram)\
+                       +" -progress false -in "+image\
+                       +" -out "+image_ok+' -lut '+self.cfg.calibration_type \
+                       +" -noise "+str(self.cfg.removethermalnoise).lower(),\
+                       "Calibration", dependencies,\
+                       product=Utils.get_product_from_s1_raster(image))
+        job.on_success = lambda: self.record_step(image, "", "calibration", image_ok, [image])
+        return job
+
+    def get_ortho_filename(self, raster, image, tile_name):
+        """
+        This method returns the path of the ortho-rectified image
+        of a S1 image on a given tile.
+
+        Args:
+          raster: the S1 product, as instance of S1DateAcquisition
+          image: raw S1 raster file
+          tile_name: Name of the MGRS tile
+
+        Returns:
+          the path of the ortho-rectified image
+        """
+        manifest = raster.get_manifest()
+        current_date = Utils.get_date_from_s1_raster(image)
+        current_polar = Utils.get_polar_from_s1_raster(image)
+        current_platform = Utils.get_platform_from_s1_raster(image)
+        current_orbit_direction = Utils.get_orbit_direction(manifest)
+        current_relative_orbit = Utils.get_relative_orbit(manifest)
+        working_directory = os.path.join(self.cfg.output_preprocess,\
+                                         tile_name)
+        ortho_image_name = current_platform\
+                           +"_"+tile_name\
+                           +"_"+current_polar\
+                           +"_"+current_orbit_direction\
+                           +'_{:0>3d}'.format(current_relative_orbit)\
+                           +"_"+current_date\
+                           +".tif"
+        return os.path.join(working_directory, ortho_image_name)
+
+    def ortho_exists(self, ortho_image):
+        """
+        Tells whether an ortho-rectified image has already been produced,
+        either as is or concatenated with other slices.
+        """
+        return self.state.is_output_done(ortho_image)\
+            or self.state.is_output_done(ortho_image[:-11]+"txxxxxx.tif")
+
+    def get_ortho_parameters(self, tile_origin, ortho_image):
+        """
+        This method computes the output grid of the ortho-rectification
+        on a MGRS tile.
+
+        Args:
+          tile_origin: the corners of the MGRS tile
+          ortho_image: path of the output image (see get_ortho_filename)
+
+        Returns:
+          a dict with the upper left corner (ulx, uly), the size in
+          pixels (sizex, sizey) and the UTM zone (zone, northern)
+        """
+        tile_name = os.path.basename(ortho_image).split("_")[1]
+        out_utm_zone = tile_name[0:2]
+        out_utm_northern = (tile_name[2] >= 'N')
+        working_directory = os.path.dirname(ortho_image)
+        if os.path.exists(working_directory) == False:
+            os.makedirs(working_directory)
+
+        in_epsg = 4326
+        out_epsg = 32600+int(out_utm_zone)
+        if not out_utm_northern:
+            out_epsg = out_epsg+100
+
+        conv_result = Utils.convert_coord([tile_origin[0]], in_epsg, out_epsg)
+        (x_coord, y_coord,dummy) = conv_result[0]
+        conv_result = Utils.convert_coord([tile_origin[2]], in_epsg, out_epsg)
+        (lrx, lry,dummy) = conv_result[0]
+
+        if not out_utm_northern and y_coord < 0:
+            y_coord = y_coord+10000000.
+            lry = lry+10000000.
+
+        return {"ulx": x_coord, "uly": y_coord,\
+                "sizex": int(round(abs(lrx-x_coord)/self.cfg.out_spatial_res)),\
+                "sizey": int(round(abs(lry-y_coord)/self.cfg.out_spatial_res)),\
+                "zone": out_utm_zone, "northern": out_utm_northern}
+
+    def pipeline_job(self, image, targets, tmp_srtm_dir):
+        """
+        This method builds the job that calibrates, cuts and
+        ortho-rectifies a S1 image in memory with the OTB python API
+        (see S1OTBPipeline): no intermediate image is written to disk.
+        The image is ortho-rectified onto all the given tiles by the same
+        process, which shares the sensor model and the DEM between tiles.
+
+        Args:
+          image: raw S1 raster file to process
+          targets: list of (tile corners, path of the output image)
+          tmp_srtm_dir: directory holding the SRTM tiles
+
+        Returns:
+          a S1Job instance
+        """
+        threads, ram = self.cfg.tuning.get("In-memory orthorectification")
+        cmd = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(threads)\
+          +'export PYTHONPATH={}:$PYTHONPATH;'.format(os.path.dirname(os.path.abspath(__file__)))\
+          +sys.executable+" -m s1tiling.S1OTBPipeline"\
+          +" --in "+image\
+          +" --lut "+self.cfg.calibration_type\
+          +(" --noise" if self.cfg.removethermalnoise else "")\
+          +" --spacing "+str(self.cfg.out_spatial_res)\
+          +" --gridspacing "+str(self.cfg.grid_spacing)\
+          +" --dem "+tmp_srtm_dir+" --geoid "+self.cfg.GeoidFile\
+          +" --ram "+str(ram)
+        for tile_origin, ortho_image in targets:
+            params = self.get_ortho_parameters(tile_origin, ortho_image)
+            cmd += " --ortho "+ortho_image\
+              +" "+str(params["ulx"])+" "+str(params["uly"])\
+              +" "+str(params["sizex"])+" "+str(params["sizey"])\
+              +" "+str(params["zone"])+" "+str(params["northern"]).lower()
+
+        def record_orthos():
+            for _, ortho_image in targets:
+                tile_name = os.path.basename(ortho_image).split("_")[1]
+                self.record_ortho(image, tile_name, ortho_image, [image])
+
+        job = self.scheduler.new_job(cmd, "In-memory orthorectification",\
+                                     tile=",".join(os.path.basename(ortho_image).split("_")[1]\
+                                                   for _, ortho_image in targets),\
+                                     product=Utils.get_product_from_s1_raster(image))
+        job.on_success = record_orthos
+        return job
+
+    def ortho_job(self, image, targets, tmp_srtm_dir, dependencies=None):
+        """
+        This method builds the ortho-rectification job of a S1 image
+        on one or several tiles. The tiles are ortho-rectified one after
+        the other by the same job, so that the image ready for ortho is
+        read while it is still in the page cache.
+
+        Args:
+          image: raw S1 raster file to orthorectify
+          targets: list of (tile corners, path of the output image, see
+            get_ortho_filename)
+          tmp_srtm_dir: directory holding the SRTM tiles
+          dependencies: jobs that produce the image ready for ortho
+
+        Returns:
+          a S1Job instance
+        """
+        threads, ram = self.cfg.tuning.get("Orthorectification")
+        cmd = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(threads)\
+          +" && ".join(self.get_ortho_cmd(image, tile_origin, ortho_image, tmp_srtm_dir, ram)\
+                       for tile_origin, ortho_image in targets)
+
+        def record_orthos():
+            for _, ortho_image in targets:
+                tile_name = os.path.basename(ortho_image).split("_")[1]
+                self.record_ortho(image, tile_name, ortho_image,\
+                                  [image.replace(".tiff", "_OrthoReady.tiff")])
+
+        job = self.scheduler.new_job(cmd, "Orthorectification", dependencies,\
+                                     tile=",".join(os.path.basename(ortho_image).split("_")[1]\
+                                                   for _, ortho_image in targets),\
+                                     product=Utils.get_product_from_s1_raster(image))
+        job.on_success = record_orthos
+        return job
+
+    def get_ortho_cmd(self, image, tile_origin, ortho_image, tmp_srtm_dir, ram):
+        """
+        This method returns the command that ortho-rectifies the cut
+        image of a S1 image on a given tile.
+
+        Args:
+          image: raw S1 raster file to orthorectify
+          tile_origin: the corners of the MGRS tile
+          ortho_image: path of the output image (see get_ortho_filename)
+          tmp_srtm_dir: directory holding the SRTM tiles
+          ram: RAM available for the application, in MB
         """
-        This method concatenates images sub-swath for all generated tiles.
+        image_ok = image.replace(".tiff", "_OrthoReady.tiff")
+        params = self.get_ortho_parameters(tile_origin, ortho_image)
+        return "otbcli_OrthoRectification -opt.ram "\
+          +str(ram)\
+          +" -progress false -io.in "+image_ok\
+          +" -io.out \""+ortho_image\
+          +"?&writegeom=false\" -interpolator nn -outputs.spacingx "\
+          +str(self.cfg.out_spatial_res)\
+          +" -outputs.spacingy -"+str(self.cfg.out_spatial_res)\
+          +" -outputs.sizex "+str(params["sizex"])\
+          +" -outputs.sizey "+str(params["sizey"])\
+          +" -opt.gridspacing "+str(self.cfg.grid_spacing)\
+          +" -map utm -map.utm.zone "+str(params["zone"])\
+          +" -map.utm.northhem "+str(params["northern"]).lower()\
+          +" -outputs.ulx "+str(params["ulx"])\
+          +" -outputs.uly "+str(params["uly"])\
+          +" -elev.dem "+tmp_srtm_dir+" -elev.geoid "+self.cfg.GeoidFile
+
+    def write_ortho_metadata(self, output_image):
         """
-        print ("Start concatenation :",tile)
-        cmd_list = []
-        files_to_remove = []
+        This method writes the metadata of an image of a tile (named like
+        the ortho-rectified images) once it has been produced.
 
-        image_list = [i for i in os.walk(os.path.join(self.cfg.output_preprocess, tile)).__next__()[2] if (len(i) == 40 and "xxxxxx" not in i)]
-        image_list.sort()
-            
+        Args:
+          output_image: the ortho-rectified, concatenated or mask image
+        """
+        oin = os.path.basename(output_image).split('_')
+        dst = gdal.Open(output_image, gdal.GA_Update)
+        dst.SetMetadataItem('S2_TILE_CORRESPONDING_CODE', oin[1])
+        dst.SetMetadataItem('PROCESSED_DATETIME', str(datetime.datetime.now().strftime('%Y:%m:%d')))
+        dst.SetMetadataItem('ORTHORECTIFIED', 'true')
+        dst.SetMetadataItem('CALIBRATION', str(self.cfg.calibration_type))
+        dst.SetMetadataItem('SPATIAL_RESOLUTION', str(self.cfg.out_spatial_res))
+        dst.SetMetadataItem('IMAGE_TYPE', 'GRD')
+        dst.SetMetadataItem('FLYING_UNIT_CODE', oin[0])
+        dst.SetMetadataItem('POLARIZATION', oin[2])
+        dst.SetMetadataItem('ORBIT', oin[4])
+        dst.SetMetadataItem('ORBIT_DIRECTION', oin[3])
+        if oin[5][9] == 'x':
+            date = oin[5][0:4]+':'+oin[5][4:6]+':'+oin[5][6:8]+' 00:00:00'
+        else:
+            date = oin[5][0:4]+':'+oin[5][4:6]+':'+oin[5][6:8]+' '+oin[5][9:11]+':'+oin[5][11:13]+':'+oin[5][13:15]
+        dst.SetMetadataItem('ACQUISITION_DATETIME', date)
+        dst = None
+
+    def get_concatenation_groups(self, tile, new_images=()):
+        """
+        This method groups the ortho-rectified images of a tile that
+        belong to the same orbit and date.
+
+        Args:
+          tile: Name of the MGRS tile
+          new_images: ortho-rectified images that are not produced yet
+
+        Returns:
+          the list of groups (list of image paths) to concatenate
+        """
+        tile_directory = os.path.join(self.cfg.output_preprocess, tile)
+        image_list = []
+        if os.path.exists(tile_directory):
+            image_list = [i for i in os.walk(tile_directory).__next__()[2] if (len(i) == 40 and "xxxxxx" not in i)\
+                          and self.state.is_output_done(os.path.join(tile_directory, i))]
+        image_list = sorted(set(image_list+[os.path.basename(i) for i in new_images]))
+
+        groups = []
         while len(image_list) > 1:
 
             image_sublist=[i for i in image_list if (image_list[0][:29] in i)]
 
             if len(image_sublist) >1 :
-                images_to_concatenate=[os.path.join(self.cfg.output_preprocess, tile,i) for i in image_sublist]
-                files_to_remove=files_to_remove+images_to_concatenate
-                output_image = images_to_concatenate[0][:-10]+"xxxxxx"+images_to_concatenate[0][-4:]
-
-                # build the expression for BandMath for concanetation of many images
-                # for each pixel, the concatenation consists in selecting the first non-zero value in the time serie
-                expression="(im%sb1!=0 ? im%sb1 : 0)" % (str(len(images_to_concatenate)),str(len(images_to_concatenate)))
-                for i in range(len(images_to_concatenate)-1,0,-1):
-                    expression="(im%sb1!=0 ? im%sb1 : %s)" % (str(i),str(i),expression)
-                cmd_list.append('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+'otbcli_BandMath -progress false -ram '\
-                                   +str(self.cfg.ram_per_process)\
-                                    +' -il '+' '.join(images_to_concatenate)\
-                                    +' -out '+output_image\
-                                    + ' -exp "'+expression+'"')
-                                    
-                if self.cfg.mask_cond:
-                    if "vv" in image_list[0]:
-                        images_msk_to_concatenate = [i.replace(".tif", "_BorderMask.tif") for i in images_to_concatenate]
-                        files_to_remove=files_to_remove+images_msk_to_concatenate
-                        cmd_list.append('export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.cfg.OTBThreads)+'otbcli_BandMath -progress false -ram '\
-                                    +str(self.cfg.ram_per_process)\
-                                    +' -il '+' '.join(images_msk_to_concatenate)\
-                                    +' -out '+output_image.replace(".tif",\
-                                                                "_BorderMask.tif")\
-                                    + ' -exp "'+expression+'"')
-                
+                groups.append([os.path.join(tile_directory, i) for i in image_sublist])
+
             for i in  image_sublist:
                 image_list.remove(i)
+        return groups
+
+    def concatenate_rasters(self, groups):
+        """
+        This method concatenates groups of images sub-swath in one pass:
+        for each pixel, the concatenation selects the first non-zero value
+        of the group. The output is written block by block, and each block
+        reads only the valid lines of each input (see Utils.get_valid_lines)
+        that overlap it, so that every input is read once, outside of its
+        nodata lines, and the memory used is bounded by a block. The valid
+        lines of the first group apply to the others (border masks).
+
+        Args:
+          groups: list of (images to concatenate, output image, creation
+            options). All the groups share the layout of the first one
+            (data and border masks)
+        """
+        rasters = [[gdal.Open(i) for i in images] for images, _, _ in groups]
+        geo = rasters[0][0].GetGeoTransform()
+
+        # Window of each input in the output grid
+        offsets = []
+        for raster in rasters[0]:
+            raster_geo = raster.GetGeoTransform()
+            offsets.append((int(round((raster_geo[0]-geo[0])/geo[1])),\
+                            int(round((raster_geo[3]-geo[3])/geo[5]))))
+        min_x = min(x_off for x_off, _ in offsets)
+        min_y = min(y_off for _, y_off in offsets)
+        offsets = [(x_off-min_x, y_off-min_y) for x_off, y_off in offsets]
+        xsize = max(x_off+raster.RasterXSize for (x_off, _), raster in zip(offsets, rasters[0]))
+        ysize = max(y_off+raster.RasterYSize for (_, y_off), raster in zip(offsets, rasters[0]))
+        out_geo = (geo[0]+min_x*geo[1], geo[1], geo[2], geo[3]+min_y*geo[5], geo[4], geo[5])
+        valid_lines = [Utils.get_valid_lines(raster.GetRasterBand(1)) for raster in rasters[0]]
+
+        driver = gdal.GetDriverByName("GTiff")
+        outputs = []
+        item_size = 0
+        for (_, output_image, options), group_rasters in zip(groups, rasters):
+            data_type = group_rasters[0].GetRasterBand(1).DataType
+            outdata = driver.Create(output_image, xsize, ysize, 1, data_type, options)
+            outdata.SetGeoTransform(out_geo)
+            outdata.SetProjection(group_rasters[0].GetProjection())
+            outdata.SetMetadata(group_rasters[0].GetMetadata())
+            outputs.append(outdata)
+            item_size += gdal.GetDataTypeSize(data_type)//8
+
+        # Number of lines per block, so that a block (one output and one
+        # input at a time per group) uses about the RAM of the stage
+        _, ram = self.cfg.tuning.get("Concatenation")
+        block_lines = max(1, ram*1024*1024//(2*xsize*item_size))
+
+        for y_start in range(0, ysize, block_lines):
+            y_end = min(ysize, y_start+block_lines)
+            for group_rasters, outdata in zip(rasters, outputs):
+                out_band = outdata.GetRasterBand(1)
+                block = np.zeros((y_end-y_start, xsize), dtype=gdal_array.GDALTypeCodeToNumericTypeCode(out_band.DataType))
+                # The inputs are merged from the last one to the first one,
+                # so that the first non-zero value is kept
+                for raster, (x_off, y_off), (first_valid, last_valid)\
+                        in reversed(list(zip(group_rasters, offsets, valid_lines))):
+                    first_line = max(y_start, y_off+first_valid)
+                    last_line = min(y_end, y_off+last_valid)
+                    if first_line >= last_line:
+                        continue
+                    data = raster.GetRasterBand(1).ReadAsArray(0, first_line-y_off,\
+                                                               raster.RasterXSize,\
+                                                               last_line-first_line)
+                    window = block[first_line-y_start:last_line-y_start,\
+                                   x_off:x_off+raster.RasterXSize]
+                    np.copyto(window, data, casting="unsafe", where=(data != 0))
+                out_band.WriteArray(block, 0, y_start)
+
+        for outdata in outputs:
+            outdata.FlushCache()
+        outputs = None
+        rasters = None
+
+    def concatenation_jobs(self, images_to_concatenate, dependencies=None):
+        """
+        This method builds the jobs that concatenate images sub-swath
+        of the same orbit and date, together with their border masks.
+
+        Args:
+          images_to_concatenate: the images to concatenate (a group from
+            get_concatenation_groups)
+          dependencies: jobs that produce the images
+
+        Returns:
+          The list of jobs
+        """
+        files_to_remove = list(images_to_concatenate)
+        output_image = images_to_concatenate[0][:-10]+"xxxxxx"+images_to_concatenate[0][-4:]
+        groups = [(images_to_concatenate, output_image, ["BIGTIFF=IF_SAFER"])]
+
+        if self.cfg.mask_cond:
+            if "vv" in os.path.basename(images_to_concatenate[0]):
+                images_msk_to_concatenate = [i.replace(".tif", "_BorderMask.tif") for i in images_to_concatenate]
+                files_to_remove=files_to_remove+images_msk_to_concatenate
+                groups.append((images_msk_to_concatenate,\
+                               output_image.replace(".tif", "_BorderMask.tif"),\
+                               S1BorderMask.MASK_CREATION_OPTIONS))
+
+        def record_concatenation():
+            for inputs, output, _ in groups:
+                self.record_output("concatenation", output, inputs)
+
+        concatenation = S1Job(func=lambda: self.concatenate_rasters(groups),\
+                              stage="Concatenation", nb_threads=1,\
+                              ram=self.cfg.tuning.get("Concatenation")[1],\
+                              dependencies=dependencies, fork=True,\
+                              on_success=record_concatenation,\
+                              tile=os.path.basename(output_image).split("_")[1],\
+                              product=os.path.basename(output_image))
+
+        def remove_slices():
+            for file_it in files_to_remove:
+                if os.path.exists(file_it):
+                    os.remove(file_it)
+
+        return [concatenation,\
+                S1Job(func=remove_slices, stage="Concatenation cleaning",\
+                      dependencies=[concatenation])]
+
+    def border_mask_exists(self, ortho_image):
+        """
+        Tells whether the border mask of an ortho-rectified image has
+        already been produced, either as is or concatenated.
+        """
+        return self.state.is_output_done(ortho_image.replace(".tif", "_BorderMask.tif"))\
+            or self.state.is_output_done(ortho_image[:-11]+"txxxxxx_BorderMask.tif")
+
+    def image_jobs(self, raster, image, targets, tmp_srtm_dir):
+        """
+        This method builds the jobs that produce the ortho-rectified images
+        of a raw S1 image on one or several tiles, skipping the steps
+        already completed. Extraction, calibration and cutting are shared
+        by all tiles, and the image is ortho-rectified onto all of them
+        by a single job.
+
+        Args:
+          raster: the S1 product, as instance of S1DateAcquisition
+          image: raw S1 raster file to process
+          targets: list of (tile corners, path of the output image)
+          tmp_srtm_dir: directory holding the SRTM tiles
+
+        Returns:
+          a tuple (list of jobs, dict output image -> jobs producing it)
+        """
+        if self.cfg.engine == "python":
+            job = self.pipeline_job(image, targets, tmp_srtm_dir)
+            extraction = self.extraction_job(raster, image, job)
+            jobs = [extraction, job] if extraction is not None else [job]
+            return jobs, dict((ortho_image, list(jobs)) for _, ortho_image in targets)
+        jobs = []
+        producers = {}
+        if not self.is_step_done(image, "", "cut") or not self.cache.use(image):
+            calibration = self.calibration_job(image)
+            if calibration is not None:
+                extraction = self.extraction_job(raster, image, calibration)
+                if extraction is not None:
+                    jobs.append(extraction)
+                jobs.append(calibration)
+            jobs.append(self.cut_job(image, jobs[-1:]))
+        # One job ortho-rectifies the image on all the tiles
+        ortho = self.ortho_job(image, targets, tmp_srtm_dir, jobs[-1:])
+        for _, ortho_image in targets:
+            producers[ortho_image] = jobs+[ortho]
+        return jobs+[ortho], producers
+
+    def download_jobs(self, file_manager, tile_name, tmp_srtm_dir):
+        """
+        This method builds the jobs that download the missing S1 products
+        of a tile. As soon as a product is downloaded, the jobs that
+        ortho-rectify its images on the tile are added to the run, so that
+        the processing goes on while the other products are transferred.
+        The tile is completed afterwards by process_tile.
+
+        Each job moves its product one step forward through the staging
+        tracker (see S1StagingTracker.step): the staging of a product on
+        tape is requested once, then a new job polls its storage at its
+        next poll time, without holding a download slot meanwhile.
+
+        Args:
+          file_manager: the S1FileManager instance
+          tile_name: Name of the MGRS tile
+          tmp_srtm_dir: directory holding the SRTM tiles
+
+        Returns:
+          the list of download jobs
+        """
+        downloader = file_manager.get_downloader()
+        tracker = file_manager.get_staging_tracker()
+        products = file_manager.get_downloads(tile_name)
+        tracker.add(products)
+
+        def download_job(product, not_before=0.):
+
+            def on_step():
+                entry = tracker.load(product["product"])
+                if entry["state"] == DOWNLOADED:
+                    process_product(product)
+                elif entry["state"] == FAILED:
+                    raise Exception(product["product"]+" could not be downloaded")
+                else:
+                    self.scheduler.submit([download_job(product, entry["next_time"])])
+
+            # The child updates the state through a connection of its own
+            return S1Job(func=lambda: file_manager.open_staging_tracker().step(product["product"]),\
+                         stage="Download", nb_threads=0, ram=0, fork=True,\
+                         on_success=on_step, tile=tile_name,\
+                         product=product["product"], not_before=not_before)
+
+        def process_product(product):
+            raster = file_manager.add_archive(downloader.get_product_path(product["product"]))
+            if raster is None:
+                raise Exception(product["product"]+" is corrupted")
+            raster_list = file_manager.get_s1_intersect_by_tile(tile_name, [raster])
+            self.register_consumers(tile_name, raster_list)
+            self.store.use(raster_list)
+            new_jobs = []
+            for _, tile_origin in raster_list:
+                for image in raster.get_images_list():
+                    ortho_image = self.get_ortho_filename(raster, image, tile_name)
+                    if not self.ortho_exists(ortho_image):
+                        new_jobs += self.image_jobs(raster, image, [(tile_origin, ortho_image)],\
+                                                    tmp_srtm_dir)[0]
+            self.scheduler.submit(new_jobs)
+
+        return [download_job(product) for product in products]
+
+    def tile_jobs(self, raster_list, tile_name, producers, new_images):
+        """
+        This method builds the jobs that complete a tile once its images
+        are ortho-rectified: border masks and concatenation.
+
+        Args:
+          raster_list: list of (S1 product, tile corners) intersecting the tile
+          tile_name: Name of the MGRS tile
+          producers: dict output image -> jobs producing it (updated
+            with the border mask jobs)
+          new_images: ortho-rectified images produced by this run
+
+        Returns:
+          the list of jobs
+        """
+        all_jobs = []
+        if self.cfg.mask_cond:
+            for raster, _ in raster_list:
+                for image in raster.get_images_list():
+                    ortho_image = self.get_ortho_filename(raster, image, tile_name)
+                    if "vv" in os.path.basename(ortho_image)\
+                       and not self.border_mask_exists(ortho_image)\
+                       and (ortho_image in producers or self.state.is_output_done(ortho_image)):
+                        mask_jobs = self.border_mask_jobs(ortho_image, producers.get(ortho_image, [])[-1:])
+                        all_jobs += mask_jobs
+                        producers[ortho_image] = producers.get(ortho_image, [])+mask_jobs
+
+        for images_to_concatenate in self.get_concatenation_groups(tile_name, new_images):
+            dependencies = []
+            for image in images_to_concatenate:
+                dependencies += producers.get(image, [])
+            all_jobs += self.concatenation_jobs(images_to_concatenate, dependencies)
+        return all_jobs
+
+    def process_tile(self, raster_list, tile_name, tmp_srtm_dir):
+        """
+        This method processes a list of S1 images on a given tile as a
+        dependency graph: each image goes through calibration, cutting,
+        ortho-rectification and border mask generation as soon as its
+        own inputs are ready, and each group of sub-swaths is
+        concatenated as soon as all its members are ortho-rectified.
+
+        Args:
+          raster_list: list of (S1 product, tile corners) intersecting the tile
+          tile_name: Name of the MGRS tile to generate
+          tmp_srtm_dir: directory holding the SRTM tiles
+
+        Returns:
+          the list of ortho-rectified images produced
+        """
+        all_jobs = []
+        output_files_list = []
+        producers = {}
+        print ("Start processing :",tile_name)
+        for raster, tile_origin in raster_list:
+            for image in raster.get_images_list():
+                ortho_image = self.get_ortho_filename(raster, image, tile_name)
+                if not self.ortho_exists(ortho_image):
+                    jobs, image_producers = self.image_jobs(raster, image,\
+                                                            [(tile_origin, ortho_image)],\
+                                                            tmp_srtm_dir)
+                    all_jobs += jobs
+                    producers.update(image_producers)
+                    output_files_list.append(ortho_image)
 
-                   
-        self.run_processing(cmd_list, "Concatenation")
+        all_jobs += self.tile_jobs(raster_list, tile_name, producers, output_files_list)
 
-        for file_it in files_to_remove:
-            if os.path.exists(file_it):
-                os.remove(file_it)
+        self.run_processing(all_jobs, title="Processing "+tile_name)
 
+        # The cut rasters of the tile can now be evicted
+        self.cache.release(tile_name)
+
+        return output_files_list
+
+    def process_products(self, tiles_raster_list, tmp_srtm_dir):
+        """
+        This method processes several tiles product by product: each S1
+        image is read once and ortho-rectified onto all the requested
+        tiles it intersects (in a single process with the python engine),
+        then each tile is completed as in process_tile.
+
+        Args:
+          tiles_raster_list: list of (tile name, list of (S1 product,
+            tile corners) intersecting the tile)
+          tmp_srtm_dir: directory holding the SRTM tiles
+
+        Returns:
+          the list of ortho-rectified images produced
+        """
+        all_jobs = []
+        output_files_list = []
+        producers = {}
+        targets = {}
+        rasters = {}
+        new_images = {}
+        for tile_name, raster_list in tiles_raster_list:
+            new_images[tile_name] = []
+            for raster, tile_origin in raster_list:
+                for image in raster.get_images_list():
+                    ortho_image = self.get_ortho_filename(raster, image, tile_name)
+                    if not self.ortho_exists(ortho_image):
+                        targets.setdefault(image, []).append((tile_origin, ortho_image))
+                        rasters[image] = raster
+                        new_images[tile_name].append(ortho_image)
+                        output_files_list.append(ortho_image)
+
+        print ("Start processing "+str(len(targets))+" images on "\
+               +str(len(tiles_raster_list))+" tiles")
+        for image, image_targets in targets.items():
+            jobs, image_producers = self.image_jobs(rasters[image], image,\
+                                                    image_targets, tmp_srtm_dir)
+            all_jobs += jobs
+            producers.update(image_producers)
+
+        for tile_name, raster_list in tiles_raster_list:
+            all_jobs += self.tile_jobs(raster_list, tile_name, producers,\
+                                       new_images[tile_name])
+
+        self.run_processing(all_jobs, title="Processing products")
+
+        for tile_name, _ in tiles_raster_list:
+            self.cache.release(tile_name)
+
+        return output_files_list
 
     def run_processing(self, cmd_list, title=""):
         """
-        This method executes a given command.
+        This method executes a list of commands through the job scheduler.
         Args:
-          cmd_list: the command to run
+          cmd_list: the commands (or S1Job instances) to run
           title: optional title
+
+        Returns:
+          the list of jobs that failed
         """
-        import time
-        nb_cmd = len(cmd_list)
-        pids = []
-
-        while len(cmd_list) > 0 or len(pids) > 0:
-            if (len(pids) < self.cfg.nb_procs) and (len(cmd_list) > 0):
-                pids.append([Popen(cmd_list[0], stdout=self.cfg.stdoutfile,\
-                                  stderr=self.cfg.stderrfile, shell=True),cmd_list[0]])
-                cmd_list.remove(cmd_list[0])
-            for i, pid in enumerate(pids):
-                status = pid[0].poll()
-                if status is not None and status != 0:
-                    print ("Error in pid #"+str(i)+" id="+str(pid[0]))
-                    print (pid[1])
-                    del pids[i]
-                    break
-                    #sys.exit(status)
-                if status == 0:
-                    del pids[i]
-                    print (title+"... "+str(int((nb_cmd-(len(cmd_list)\
-                                                +len(pids)))*100./nb_cmd))+"%")
-                    time.sleep(0.2)
-                    break
-        print (title+" done")
+        return self.scheduler.run(cmd_list, title=title)
+
+
+def download_and_process_tile(tile, pending_tiles, cfg, chain, file_manager,\
+                              dem_cache, srtm_tiles, filtering_processor):
+    """
+    Download the S1 products of a MGRS tile and process it
+
+    Args:
+      tile: the MGRS tile
+      pending_tiles: the tiles still to be processed, starting with tile
+      cfg: the configuration
+      chain: the Sentinel1PreProcess instance
+      file_manager: the S1FileManager instance
+      dem_cache: the S1DEMCache instance
+      srtm_tiles: list of (SRTM tile, coverage) needed by the tile
+      filtering_processor: the S1FilteringProcessor instance
+    """
+    # Keep the S1 products under ProductStoreQuota
+    chain.store.set_pending_tiles(pending_tiles)
+    if chain.store.evict(tile):
+        file_manager.get_s1_img()
+
+    if cfg.pepsdownload and cfg.pipeline:
+        # The products are processed on the tile as soon as they arrive
+        dem_dir = dem_cache.stage(tile, [srtm_tile for srtm_tile, _ in srtm_tiles])
+        chain.run_processing(chain.download_jobs(file_manager, tile, dem_dir),\
+                             title="Downloading and processing "+tile)
+        dem_cache.release(tile)
+    else:
+        file_manager.download_images(tiles=tile)
+    if cfg.pepsdownload:
+        # New products may be needed by the next tiles too
+        for next_tile in pending_tiles[1:]:
+            chain.register_consumers(next_tile, file_manager.get_s1_intersect_by_tile(next_tile))
+
+    intersect_raster_list = file_manager.get_s1_intersect_by_tile(tile)
+    chain.register_consumers(tile, intersect_raster_list)
+    chain.store.use(intersect_raster_list)
+
+    if len(intersect_raster_list) == 0:
+        print ("No intersections with tile "+str(tile))
+        return
+
+    dem_dir = dem_cache.stage(tile, [srtm_tile for srtm_tile, _ in srtm_tiles])
+    chain.process_tile(intersect_raster_list, tile, dem_dir)
+    dem_cache.release(tile)
+    chain.store.release(tile)
+
+    if cfg.filtering_activated:
+        filtering_processor.process(tile)
 
 
 def mainproc(args):
@@ -482,15 +1160,15 @@ def mainproc(args):
     CFG = args.input
 
     Cg_Cfg=Configuration(CFG)
+    if Cg_Cfg.OTBThreads <= 0 or Cg_Cfg.ram_per_process <= 0:
+        Cg_Cfg.tuning.print_settings()
     S1_CHAIN = Sentinel1PreProcess(Cg_Cfg)
     S1_FILE_MANAGER = S1FileManager.S1FileManager(Cg_Cfg)
 
-    # If inputs are zipped
+    # Zipped inputs are read in place (S1FileManager.get_s1_img), and their
+    # images extracted when an OTB application needs them
     if args.zip:
-        inp = glob.glob(os.path.join(Cg_Cfg.raw_directory, '*.zip'))
-        for i in inp:
-            with ZipFile(i, 'r') as zipObj:
-                zipObj.extractall(Cg_Cfg.raw_directory)
+        S1_FILE_MANAGER.unzip_images()
 
     TILES_TO_PROCESS = []
     ALL_REQUESTED = False
@@ -565,71 +1243,117 @@ def mainproc(args):
     print ("Required SRTM tiles: "+str(NEEDED_SRTM_TILES))
 
     SRTM_OK = True
-    srtmpath = []
     for srtm_tile in NEEDED_SRTM_TILES:
         tile_path = os.path.join(Cg_Cfg.srtm, srtm_tile)
         if not os.path.exists(tile_path):
             SRTM_OK = False
             print (tile_path+" is missing")
-        else:
-            srtmpath.append(tile_path)
 
     if not SRTM_OK:
         print ("Some SRTM tiles are missing, exiting ...")
         sys.exit(1)
-    else:
-        # copy all needed SRTM file in a temp directory for orthorectification processing
-        i = 0
-        for srtm_p in srtmpath:
-            srtm_tile = NEEDED_SRTM_TILES[i]
-            os.system('cp {0:s} {1:s}'.format(srtm_p, os.path.join(S1_FILE_MANAGER.tmpsrtmdir, srtm_tile)))
-            i = i + 1
+
+    # The SRTM tiles are staged for each MGRS tile from a persistent cache
+    DEM_CACHE = S1DEMCache(Cg_Cfg)
 
     if not os.path.exists(Cg_Cfg.GeoidFile):
         print ("Geoid file does not exists ("+Cg_Cfg.GeoidFile+"), exiting ...")
         sys.exit(1)
 
-    filteringProcessor=S1FilteringProcessor.S1FilteringProcessor(Cg_Cfg)
+    filteringProcessor=S1FilteringProcessor.S1FilteringProcessor(Cg_Cfg, S1_CHAIN.state)
 
-    for idx, tile_it in enumerate(TILES_TO_PROCESS_CHECKED):
-
-        print ("Tile: "+tile_it+" ("+str(idx+1)+"/"+str(len(TILES_TO_PROCESS_CHECKED))+")")
-        # keep only the 500's newer files
-        safeFileList=sorted(glob.glob(os.path.join(Cg_Cfg.raw_directory,"*")),key=os.path.getctime)
-        if len(safeFileList)> 500:
-            for f in safeFileList[:len(safeFileList)-500]:
-                print ("Remove : ",os.path.basename(f))
-                shutil.rmtree(f)
-
-        S1_FILE_MANAGER.download_images(tiles=tile_it)
+    # One catalog search for all the tiles, instead of one per tile
+    if Cg_Cfg.pepsdownload and S1_FILE_MANAGER.roi_by_tiles is not None:
+        S1_FILE_MANAGER.plan_downloads(TILES_TO_PROCESS_CHECKED)
 
+    # Declare which tiles need which products, so that their cut rasters
+    # are kept until the last tile using them is processed, and record the
+    # images of the tiles produced by the previous versions
+    TILES_COST = {}
+    for tile_it in TILES_TO_PROCESS_CHECKED:
         intersect_raster_list = S1_FILE_MANAGER.get_s1_intersect_by_tile(tile_it)
-
-        if len(intersect_raster_list) == 0:
-            print ("No intersections with tile "+str(tile_it))
-            continue
-
-        S1_CHAIN.do_calibration_cmd(intersect_raster_list)
-        S1_CHAIN.cut_image_cmd(intersect_raster_list)
-
-        raster_tiles_list = S1_CHAIN.do_ortho_by_tile(intersect_raster_list, tile_it, S1_FILE_MANAGER.tmpsrtmdir)
-        if Cg_Cfg.mask_cond:
-            S1_CHAIN.generate_border_mask(raster_tiles_list)
-
-        S1_CHAIN.concatenate_images(tile_it)
+        S1_CHAIN.register_consumers(tile_it, intersect_raster_list)
+        TILES_COST[tile_it] = len(intersect_raster_list)
+        S1_CHAIN.migrate_outputs(tile_it)
+
+    # The tiles are either processed in order, or pulled from a queue
+    # shared with other workers
+    WORK_QUEUE = None
+    TILES_ITERATOR = TILES_TO_PROCESS_CHECKED
+    if Cg_Cfg.work_queue is not None and Cg_Cfg.processing_order == "tile":
+        WORK_QUEUE = S1WorkQueue(Cg_Cfg.work_queue, Cg_Cfg.lease_duration)
+        WORK_QUEUE.add_tiles([(tile_it, TILES_COST[tile_it]) for tile_it in TILES_TO_PROCESS_CHECKED])
+        TILES_ITERATOR = WORK_QUEUE.tiles()
+    DONE_TILES = []
+    RELEASED_TILES = set()
+
+    if Cg_Cfg.processing_order == "product":
+        # Get all the products first, then read each of them once for all its tiles
+        for tile_it in TILES_TO_PROCESS_CHECKED:
+            S1_FILE_MANAGER.download_images(tiles=tile_it)
+        TILES_RASTER_LIST = []
+        for tile_it in TILES_TO_PROCESS_CHECKED:
+            intersect_raster_list = S1_FILE_MANAGER.get_s1_intersect_by_tile(tile_it)
+            S1_CHAIN.register_consumers(tile_it, intersect_raster_list)
+            S1_CHAIN.store.use(intersect_raster_list)
+            if len(intersect_raster_list) == 0:
+                print ("No intersections with tile "+str(tile_it))
+                continue
+            TILES_RASTER_LIST.append((tile_it, intersect_raster_list))
+
+        dem_dir = DEM_CACHE.stage("products", NEEDED_SRTM_TILES)
+        S1_CHAIN.process_products(TILES_RASTER_LIST, dem_dir)
+        DEM_CACHE.release("products")
 
         if Cg_Cfg.filtering_activated:
-            filteringProcessor.process(tile_it)
-
-        # Cleaning
-        shutil.rmtree(S1_FILE_MANAGER.tmpsrtmdir)
+            for tile_it, _ in TILES_RASTER_LIST:
+                filteringProcessor.process(tile_it)
+    else:
+        for tile_it in TILES_ITERATOR:
+            if WORK_QUEUE is None:
+                PENDING_TILES = [tile_it]+[t for t in TILES_TO_PROCESS_CHECKED if t != tile_it and t not in DONE_TILES]
+            else:
+                # The tiles processed by the other workers are not
+                # consumers of the products anymore
+                PENDING_TILES = [tile_it]+[t for t in WORK_QUEUE.get_pending_tiles() if t != tile_it]
+                for t in TILES_TO_PROCESS_CHECKED:
+                    if t not in PENDING_TILES and t not in RELEASED_TILES:
+                        S1_CHAIN.release_consumers(t)
+                        RELEASED_TILES.add(t)
+
+            print ("Tile: "+tile_it+" ("+str(len(DONE_TILES)+1)+"/"+str(len(TILES_TO_PROCESS_CHECKED))+")")
+            if WORK_QUEUE is not None:
+                WORK_QUEUE.print_progress()
+                # The products of the tiles of the other workers are kept
+                S1_CHAIN.store.set_leased_tiles(WORK_QUEUE.get_leased_tiles())
+            try:
+                download_and_process_tile(tile_it, PENDING_TILES, Cg_Cfg, S1_CHAIN,\
+                                          S1_FILE_MANAGER, DEM_CACHE,\
+                                          SRTM_TILES_CHECK[tile_it], filteringProcessor)
+            except Exception:
+                if WORK_QUEUE is None:
+                    raise
+                traceback.print_exc()
+                WORK_QUEUE.complete(tile_it, success=False)
+            else:
+                if WORK_QUEUE is not None:
+                    WORK_QUEUE.complete(tile_it)
+            DONE_TILES.append(tile_it)
+
+        if WORK_QUEUE is not None:
+            WORK_QUEUE.print_progress()
+
+    print_trace_summary(Cg_Cfg.trace_file)
+    S1_CHAIN.store.print_statistics()
+    S1_CHAIN.cache.print_statistics()
+    DEM_CACHE.print_statistics()
 
 
 ## Main call
 if __name__=="__main__":
     parser = argparse.ArgumentParser(description='Launch S1 Tiling')
     parser.add_argument('-i', '--input', help='Input config file (CFG)', type=str, required=True)
-    parser.add_argument('-z', '--zip', help='If S1 are zipped', action="store_true")
+    parser.add_argument('-z', '--zip', help='If S1 are zipped (the archives are checked, then read in place)', action="store_true")
     args = parser.parse_args()
 
     mainproc(args)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+Stand-in for the otbcli_* applications used by the S1Processor, for the
+benchmarks: it waits for a configurable time, then copies its first input
+image to each of its outputs so that the next steps have a valid raster.
+
+It is called by the otbcli_<application> scripts generated by
+s1tiling_benchmark.py:
+  otb_stub.py <application> <otbcli arguments>
+
+The cost of an application (in seconds) is taken from the environment:
+S1TILING_STUB_COST_<application>, or S1TILING_STUB_COST (default 0).
+"""
+
+import os
+import sys
+import time
+import shutil
+
+INPUT_KEYS = ["-in", "-io.in", "-il", "-inl"]
+OUTPUT_KEYS = ["-out", "-io.out", "-oc", "-enl"]
+
+
+def parse_arguments(arguments):
+    """
+    Returns a dict key -> list of values of otbcli arguments
+    """
+    values = {}
+    key = None
+    for argument in arguments:
+        if argument.startswith("-") and not argument[1:2].isdigit():
+            key = argument
+            values[key] = []
+        elif key is not None:
+            values[key].append(argument)
+    return values
+
+
+def main():
+    """ Command line entry point """
+    application = sys.argv[1]
+    values = parse_arguments(sys.argv[2:])
+    cost = os.environ.get("S1TILING_STUB_COST_"+application,\
+                          os.environ.get("S1TILING_STUB_COST", "0"))
+    time.sleep(float(cost))
+
+    inputs = [value for key in INPUT_KEYS for value in values.get(key, [])]
+    outputs = [values[key][0] for key in OUTPUT_KEYS if values.get(key)]
+    for output in outputs:
+        # Remove the extended filename
+        output = output.split("?")[0]
+        if os.path.dirname(output) != "" and not os.path.exists(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+        if inputs:
+            shutil.copyfile(inputs[0], output)
+        else:
+            open(output, "w").close()
+
+
+if __name__ == "__main__":
+    main()
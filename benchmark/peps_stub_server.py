@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+Local stand-in for the PEPS resto API, to test and benchmark the
+downloads without the network:
+  peps_stub_server.py <directory of product archives> [--port 8000]
+
+The products are the <product>.zip archives of the directory. The server
+answers:
+  - /resto/api/collections/S1/search.json: every product, with the
+    pagination parameters (maxRecords, page) and totalResults of resto;
+  - /resto/collections/S1/<product>.json: the description of a product;
+  - /resto/collections/S1/<product>/download/: the archive, with HTTP
+    Range support.
+
+Options simulate the behaviour of the real server: bandwidth per transfer,
+products on tape (staged after a delay), and transfers cut halfway.
+Then use --url http://localhost:<port>/resto with peps_download.py.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_SIZE = 64*1024
+
+
+class PepsStub(object):
+    """ The products served, and the state of the simulated tape"""
+    def __init__(self, directory, tape_ratio, staging_delay, cut_ratio, bandwidth):
+        self.directory = directory
+        self.staging_delay = staging_delay
+        self.cut_ratio = cut_ratio
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.products = sorted(f[:-4] for f in os.listdir(directory) if f.endswith(".zip"))
+        # Time at which a product on tape comes online (None: not requested)
+        self.on_tape = dict((product, None) for product in\
+                            self.products[:int(len(self.products)*tape_ratio)])
+        self.cut = set(self.products[:int(len(self.products)*cut_ratio)])
+        self.checksums = {}
+        for product in self.products:
+            digest = hashlib.md5()
+            with open(os.path.join(directory, product+".zip"), "rb") as in_file:
+                for chunk in iter(lambda: in_file.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            self.checksums[product] = digest.hexdigest()
+        self.searches = 0
+        self.lookups = 0
+        self.downloads = 0
+
+    def get_storage(self, product):
+        """ Returns the storage mode of a product, as the catalog reports it"""
+        with self.lock:
+            if product not in self.on_tape:
+                return "disk"
+            online_time = self.on_tape[product]
+            if online_time is None:
+                return "tape"
+            if online_time <= time.time():
+                del self.on_tape[product]
+                return "disk"
+            return "staging"
+
+    def request_staging(self, product):
+        """ A download of a product on tape starts its staging"""
+        with self.lock:
+            if self.on_tape.get(product, 0) is None:
+                self.on_tape[product] = time.time()+self.staging_delay
+
+    def get_feature(self, index, product):
+        """ Returns the catalog feature of a product"""
+        return {"id": product,\
+                "properties": {"productIdentifier": product,\
+                               "storage": {"mode": self.get_storage(product)},\
+                               "realtime": "Nominal", "platform": product[:3],\
+                               "orbitNumber": 10000+index,\
+                               "startDate": "2019-01-01T00:00:00Z",\
+                               "services": {"download": {"checksum": "md5:"+self.checksums[product]}}}}
+
+
+class PepsStubHandler(BaseHTTPRequestHandler):
+    """ Answers the requests of peps_download.py"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts[-1] == "search.json":
+            stub.searches += 1
+            max_records = int(query.get("maxRecords", ["500"])[0])
+            page = int(query.get("page", ["1"])[0])
+            first = (page-1)*max_records
+            self.send_json(200, {"type": "FeatureCollection",\
+                                 "properties": {"totalResults": len(stub.products)},\
+                                 "features": [stub.get_feature(index, product) for index, product\
+                                              in enumerate(stub.products)][first:first+max_records]})
+        elif len(parts) >= 3 and parts[-3] == "collections" and parts[-1].endswith(".json"):
+            stub.lookups += 1
+            product = parts[-1][:-5]
+            if product not in stub.products:
+                self.send_json(404, {"ErrorCode": 404, "ErrorMessage": "Not Found"})
+                return
+            self.send_json(200, stub.get_feature(stub.products.index(product), product))
+        elif len(parts) >= 2 and parts[-1] == "download":
+            product = parts[-2]
+            if product not in stub.products:
+                self.send_json(404, {"ErrorCode": 404, "ErrorMessage": "Not Found"})
+                return
+            if stub.get_storage(product) != "disk":
+                stub.request_staging(product)
+                self.send_json(202, {"message": "Product is being staged"})
+                return
+            self.send_product(product)
+        else:
+            self.send_json(404, {"ErrorCode": 404, "ErrorMessage": "Not Found"})
+
+    def send_product(self, product):
+        """ Send an archive, or the requested range of it"""
+        stub = self.server.stub
+        stub.downloads += 1
+        path = os.path.join(stub.directory, product+".zip")
+        size = os.path.getsize(path)
+        start = 0
+        ranges = self.headers.get("Range")
+        if ranges:
+            start = int(ranges.split("=")[1].split("-")[0])
+            if start >= size:
+                self.send_json(416, {"ErrorCode": 416, "ErrorMessage": "Range Not Satisfiable"})
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, size-1, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(size-start))
+        self.end_headers()
+        # The first transfer of some products is cut halfway
+        stop = size
+        with stub.lock:
+            if product in stub.cut and start == 0:
+                stub.cut.discard(product)
+                stop = size//2
+        with open(path, "rb") as in_file:
+            in_file.seek(start)
+            position = start
+            while position < stop:
+                chunk = in_file.read(min(CHUNK_SIZE, stop-position))
+                self.wfile.write(chunk)
+                position += len(chunk)
+                if stub.bandwidth > 0:
+                    time.sleep(len(chunk)/(stub.bandwidth*1024.*1024.))
+        if stop < size:
+            self.close_connection = True
+
+
+def main():
+    """ Command line entry point"""
+    parser = argparse.ArgumentParser(description='Local stand-in for the PEPS server')
+    parser.add_argument('directory', help='Directory of the product archives (<product>.zip)')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--tape', type=float, default=0., help='Ratio of the products on tape')
+    parser.add_argument('--staging-delay', dest='staging_delay', type=float, default=30.,\
+                        help='Time to stage a product from tape, in seconds')
+    parser.add_argument('--cut', type=float, default=0.,\
+                        help='Ratio of the products whose first transfer is cut halfway')
+    parser.add_argument('--bandwidth', type=float, default=0.,\
+                        help='Bandwidth of a transfer in MB/s (0: unlimited)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("localhost", args.port), PepsStubHandler)
+    server.stub = PepsStub(args.directory, args.tape, args.staging_delay, args.cut, args.bandwidth)
+    print ("Serving "+str(len(server.stub.products))+" products on http://localhost:"\
+           +str(args.port)+"/resto")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+End-to-end benchmark of the S1Processor orchestration, without real data
+nor OTB.
+
+For each requested scale, it generates in a work directory:
+  - a grid of fake MGRS tiles (Features.shp) and SRTM tiles (srtm.shp,
+    with empty .hgt files),
+  - synthetic S1 products (.SAFE with a manifest.safe holding the
+    footprint, relative orbit and pass, and small measurement images),
+    by pairs of consecutive slices so that they are concatenated,
+  - otbcli_* scripts calling otb_stub.py, which wait for a configurable
+    time and copy their input,
+then runs mainproc and reports its wall time, the time spent by the jobs
+of each stage and the time spent in the products inventory and the
+geometry lookups.
+
+Example:
+  python benchmark/s1tiling_benchmark.py --products 10 100 1000 --cost 0.1
+
+The processing writes about 4 copies of each image per tile it
+intersects: the disk usage grows with --products, --xsize and --ysize.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import configparser
+from collections import defaultdict
+
+import numpy as np
+from osgeo import ogr, osr, gdal
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import S1Processor
+from s1tiling import S1FileManager
+from s1tiling.S1JobScheduler import S1JobScheduler
+from s1tiling.S1DEMCache import S1DEMCache
+
+OTB_APPLICATIONS = ["SARCalibration", "OrthoRectification", "BandMath",\
+                    "BinaryMorphologicalOperation", "MultitempFilteringOutcore",\
+                    "MultitempFilteringFilter"]
+
+MANIFEST_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" xmlns:gml="http://www.opengis.net/gml" xmlns:safe="http://www.esa.int/safe/sentinel-1.0" xmlns:s1="http://www.esa.int/safe/sentinel-1.0/sentinel-1">
+  <metadataSection>
+    <metadataObject ID="measurementOrbitReference">
+      <metadataWrap>
+        <xmlData>
+          <safe:orbitReference>
+            <safe:relativeOrbitNumber type="start">{orbit}</safe:relativeOrbitNumber>
+            <safe:extension>
+              <s1:orbitProperties>
+                <s1:pass>{direction}</s1:pass>
+              </s1:orbitProperties>
+            </safe:extension>
+          </safe:orbitReference>
+        </xmlData>
+      </metadataWrap>
+    </metadataObject>
+    <metadataObject ID="measurementFrameSet">
+      <metadataWrap>
+        <xmlData>
+          <safe:frameSet>
+            <safe:frame>
+              <safe:footPrint srsName="http://www.opengis.net/gml/srs/epsg.xml#4326">
+                <gml:coordinates>{coordinates}</gml:coordinates>
+              </safe:footPrint>
+            </safe:frame>
+          </safe:frameSet>
+        </xmlData>
+      </metadataWrap>
+    </metadataObject>
+  </metadataSection>
+</xfdu:XFDU>
+"""
+
+
+def get_tiles(nb_tiles):
+    """
+    Returns the fake MGRS tiles, as a list of (name, lon min, lat min) of
+    1 degree squares in the UTM zone 31 north
+    """
+    nb_columns = int(np.ceil(np.sqrt(nb_tiles)))
+    return [("31T"+chr(ord('C')+i//nb_columns)+chr(ord('A')+i%nb_columns),\
+             1.+i%nb_columns, 43.+i//nb_columns) for i in range(nb_tiles)]
+
+
+def write_grid(shapefile, field, cells):
+    """
+    Write a shapefile of 1 degree squares
+
+    Args:
+      shapefile: the shapefile to write
+      field: name of the field holding the cell names
+      cells: list of (name, lon min, lat min)
+    """
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(shapefile):
+        driver.DeleteDataSource(shapefile)
+    data_source = driver.CreateDataSource(shapefile)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    layer = data_source.CreateLayer(os.path.basename(shapefile)[:-4], srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn(field, ogr.OFTString))
+    for name, lon, lat in cells:
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        # Upper left, upper right, lower right, lower left
+        for x_coord, y_coord in [(lon, lat+1), (lon+1, lat+1), (lon+1, lat), (lon, lat), (lon, lat+1)]:
+            ring.AddPoint(x_coord, y_coord)
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField(field, name)
+        feature.SetGeometry(polygon)
+        layer.CreateFeature(feature)
+    data_source = None
+
+
+def write_image(path, xsize, ysize):
+    """ Write a small compressed measurement image"""
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(path, xsize, ysize, 1, gdal.GDT_UInt16, ["COMPRESS=DEFLATE"])
+    data = np.ones((ysize, xsize), dtype=np.uint16)
+    data[:, :xsize//20] = 0
+    data[:, -xsize//20:] = 0
+    dataset.GetRasterBand(1).WriteArray(data)
+    dataset = None
+
+
+def write_products(directory, nb_products, tiles, polarisations, xsize, ysize):
+    """
+    Write synthetic S1 products over the tiles, by pairs of consecutive
+    slices of the same orbit
+
+    Args:
+      directory: the S1Images directory
+      nb_products: number of products
+      tiles: the tiles (see get_tiles)
+      polarisations: list of polarisations (vv, vh)
+      xsize, ysize: size of the measurement images
+    """
+    rand = random.Random(0)
+    lon_min = min(lon for _, lon, _ in tiles)
+    lon_max = max(lon for _, lon, _ in tiles)+1
+    lat_min = min(lat for _, _, lat in tiles)
+    lat_max = max(lat for _, _, lat in tiles)+1
+    for index in range(nb_products):
+        pair = index//2
+        date = datetime.datetime(2020, 1, 1)+datetime.timedelta(days=pair)
+        start = date+datetime.timedelta(hours=6, seconds=25*(index%2))
+        stop = start+datetime.timedelta(seconds=25)
+        orbit = 1+pair%175
+        direction = "DESCENDING" if pair%2 == 0 else "ASCENDING"
+        if index%2 == 0:
+            lon = rand.uniform(lon_min-1, lon_max-1)
+            lat = rand.uniform(lat_min-0.5, lat_max-1)
+        else:
+            # Next slice of the pair, south of the previous one
+            lat = lat-1.
+        # North west, north east, south east, south west (lat,lon)
+        coordinates = " ".join("{},{}".format(y, x) for y, x in\
+                               [(lat+1., lon), (lat+1., lon+2.), (lat, lon+2.), (lat, lon)])
+
+        name = "S1A_IW_GRDH_1SDV_{}_{}_{:06d}_{:06d}_{:04X}".format(\
+            start.strftime("%Y%m%dT%H%M%S"), stop.strftime("%Y%m%dT%H%M%S"),\
+            30000+pair, 37000+pair, index)
+        safe_dir = os.path.join(directory, name+".SAFE")
+        os.makedirs(os.path.join(safe_dir, "measurement"))
+        with open(os.path.join(safe_dir, "manifest.safe"), "w") as manifest:
+            manifest.write(MANIFEST_TEMPLATE.format(orbit=orbit, direction=direction,\
+                                                    coordinates=coordinates))
+        for number, polarisation in enumerate(polarisations):
+            image = "s1a-iw-grd-{}-{}-{}-{:06d}-{:06d}-{:03d}.tiff".format(\
+                polarisation, start.strftime("%Y%m%dt%H%M%S"),\
+                stop.strftime("%Y%m%dt%H%M%S"), 30000+pair, 37000+pair, number+1)
+            write_image(os.path.join(safe_dir, "measurement", image), xsize, ysize)
+
+
+def write_stubs(directory):
+    """ Write the otbcli_* scripts calling otb_stub.py"""
+    os.makedirs(directory)
+    for application in OTB_APPLICATIONS:
+        path = os.path.join(directory, "otbcli_"+application)
+        with open(path, "w") as script:
+            script.write("#!/bin/sh\nexec "+sys.executable+" "\
+                         +os.path.join(BENCHMARK_DIR, "otb_stub.py")\
+                         +" "+application+' "$@"\n')
+        os.chmod(path, 0o755)
+
+
+def write_config(work_dir, tiles, args):
+    """
+    Write the configuration of the benchmark, from the configuration of
+    the repository
+
+    Returns:
+      the configuration file
+    """
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(BENCHMARK_DIR), "S1Processor.cfg"))
+    config.set("Paths", "Output", os.path.join(work_dir, "output"))
+    config.set("Paths", "S1Images", os.path.join(work_dir, "input"))
+    config.set("Paths", "SRTM", os.path.join(work_dir, "srtm"))
+    config.set("Paths", "GeoidFile", os.path.join(work_dir, "geoid", "egm96.grd"))
+    config.set("Paths", "tmp", os.path.join(work_dir, "tmp"))
+    config.set("PEPS", "Download", "False")
+    config.set("Processing", "TilesShapefile", os.path.join(work_dir, "grid", "Features.shp"))
+    config.set("Processing", "SRTMShapefile", os.path.join(work_dir, "grid", "srtm.shp"))
+    config.remove_option("Processing", "TilesListInFile")
+    config.set("Processing", "Tiles", ", ".join(name for name, _, _ in tiles))
+    config.set("Processing", "Mode", "Normal")
+    config.set("Processing", "Engine", "cli")
+    config.set("Processing", "ProcessingOrder", args.order)
+    config.set("Processing", "NbParallelProcesses", str(args.nb_procs))
+    config.set("Processing", "RAMPerProcess", "64")
+    config.set("Processing", "OTBNbThreads", "1")
+    config.set("Mask", "Generate_border_mask", "True")
+    config.set("Filtering", "Filtering_activated", "False")
+    config_file = os.path.join(work_dir, "S1Processor.cfg")
+    with open(config_file, "w") as out:
+        config.write(out)
+    return config_file
+
+
+def prepare(work_dir, nb_products, args):
+    """
+    Generate the data of a benchmark run
+
+    Returns:
+      the configuration file
+    """
+    tiles = get_tiles(args.tiles)
+    for sub_dir in ["input", "output", "srtm", "geoid", "tmp", "grid"]:
+        os.makedirs(os.path.join(work_dir, sub_dir))
+    write_grid(os.path.join(work_dir, "grid", "Features.shp"), "NAME", tiles)
+    srtm_cells = []
+    for lon in range(-1, int(max(lon for _, lon, _ in tiles))+3):
+        for lat in range(42, int(max(lat for _, _, lat in tiles))+3):
+            srtm_tile = "N{:02d}{}{:03d}.hgt".format(lat, "E" if lon >= 0 else "W", abs(lon))
+            srtm_cells.append((srtm_tile, lon, lat))
+            open(os.path.join(work_dir, "srtm", srtm_tile), "w").close()
+    write_grid(os.path.join(work_dir, "grid", "srtm.shp"), "FILE", srtm_cells)
+    open(os.path.join(work_dir, "geoid", "egm96.grd"), "w").close()
+    write_products(os.path.join(work_dir, "input"), nb_products, tiles,\
+                   args.polarisations, args.xsize, args.ysize)
+    write_stubs(os.path.join(work_dir, "bin"))
+    return write_config(work_dir, tiles, args)
+
+
+class Timings(object):
+    """ This class collects the timings of a benchmark run"""
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.jobs = defaultdict(int)
+        self.functions = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def instrument(self, owner, name):
+        """ Measure the time spent in a method of a class"""
+        method = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.functions[owner.__name__+"."+name] += time.time()-start
+                self.calls[owner.__name__+"."+name] += 1
+        setattr(owner, name, timed)
+        return method
+
+    def instrument_jobs(self):
+        """ Measure the duration of the jobs of each stage"""
+        run = S1JobScheduler.run
+        timings = self
+
+        def timed_run(scheduler, job_list, title="", on_complete=None):
+            def record(job):
+                timings.stages[job.stage] += job.duration()
+                timings.jobs[job.stage] += 1
+                if on_complete is not None:
+                    on_complete(job)
+            return run(scheduler, job_list, title, record)
+        S1JobScheduler.run = timed_run
+        return run
+
+
+def run_benchmark(work_dir, nb_products, args):
+    """
+    Run the S1Processor on synthetic data
+
+    Returns:
+      a dict of the timings
+    """
+    start = time.time()
+    config_file = prepare(work_dir, nb_products, args)
+    preparation = time.time()-start
+
+    timings = Timings()
+    originals = [(S1FileManager.S1FileManager, name,\
+                  timings.instrument(S1FileManager.S1FileManager, name))\
+                 for name in ["get_s1_img", "get_s1_intersect_by_tile",\
+                              "check_srtm_coverage"]]
+    originals.append((S1DEMCache, "stage", timings.instrument(S1DEMCache, "stage")))
+    run = timings.instrument_jobs()
+
+    cwd = os.getcwd()
+    path = os.environ["PATH"]
+    os.environ["PATH"] = os.path.join(work_dir, "bin")+os.pathsep+path
+    os.environ["S1TILING_STUB_COST"] = str(args.cost)
+    os.chdir(work_dir)
+    try:
+        start = time.time()
+        S1Processor.mainproc(argparse.Namespace(input=config_file, zip=False))
+        wall = time.time()-start
+    finally:
+        os.chdir(cwd)
+        os.environ["PATH"] = path
+        S1JobScheduler.run = run
+        for owner, name, method in originals:
+            setattr(owner, name, method)
+
+    return {"products": nb_products, "tiles": args.tiles,\
+            "preparation": preparation, "wall": wall,\
+            "stages": dict((stage, {"jobs": timings.jobs[stage],\
+                                    "time": timings.stages[stage]})\
+                           for stage in timings.stages),\
+            "functions": dict((name, {"calls": timings.calls[name],\
+                                      "time": timings.functions[name]})\
+                              for name in timings.functions)}
+
+
+def print_results(result):
+    """ Print the timings of a benchmark run"""
+    print ("")
+    print ("== "+str(result["products"])+" products, "+str(result["tiles"])\
+           +" tiles: {:.2f}s (data generation {:.2f}s)".format(result["wall"],\
+                                                               result["preparation"]))
+    for stage, stage_timings in sorted(result["stages"].items()):
+        print ("  {:<30} {:>6} jobs {:>10.2f}s".format(stage, stage_timings["jobs"],\
+                                                      stage_timings["time"]))
+    for name, function_timings in sorted(result["functions"].items()):
+        print ("  {:<30} {:>6} calls {:>9.2f}s".format(name.split(".")[-1],\
+                                                       function_timings["calls"],\
+                                                       function_timings["time"]))
+
+
+def main():
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description='Benchmark the S1Processor on synthetic data')
+    parser.add_argument('--products', help='Numbers of products (one run each)', type=int,\
+                        nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--tiles', help='Number of MGRS tiles', type=int, default=4)
+    parser.add_argument('--cost', help='Duration of each otbcli_* call (s)', type=float, default=0.)
+    parser.add_argument('--nb-procs', dest='nb_procs', help='NbParallelProcesses', type=int, default=8)
+    parser.add_argument('--order', help='ProcessingOrder', choices=['tile', 'product'], default='tile')
+    parser.add_argument('--polarisations', help='Polarisations of the products', nargs='+', default=['vv'])
+    parser.add_argument('--xsize', help='Width of the measurement images', type=int, default=2048)
+    parser.add_argument('--ysize', help='Height of the measurement images', type=int, default=256)
+    parser.add_argument('--workdir', help='Work directory', default='./s1tiling_benchmark')
+    parser.add_argument('--output', help='JSON file of the results', default=None)
+    args = parser.parse_args()
+
+    results = []
+    for nb_products in args.products:
+        work_dir = os.path.abspath(os.path.join(args.workdir, str(nb_products)))
+        if os.path.exists(work_dir):
+            print ("ERROR: "+work_dir+" already exists")
+            sys.exit(1)
+        results.append(run_benchmark(work_dir, nb_products, args))
+
+    for result in results:
+        print_results(result)
+    if args.output is not None:
+        with open(args.output, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,65 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
 
-import ConfigParser
-import shutil
+import configparser
+import argparse
+import subprocess
 import sys
-import fileinput
 import os
+import time
 
-if len(sys.argv) != 2:
-    print "Usage: "+sys.argv[0]+" config.cfg"
-    sys.exit(1)
-
-CFG = sys.argv[1]
-config = ConfigParser.SafeConfigParser()
-config.read(CFG)
+from s1tiling.S1WorkQueue import S1WorkQueue
 
+parser = argparse.ArgumentParser(description='Distribute the S1 Tiling tiles between several workers')
+parser.add_argument('input', help='Input config file (CFG)')
+parser.add_argument('-n', '--workers', help='Number of workers (default: one per tile)', type=int, default=0)
+parser.add_argument('-l', '--local', help='Run the workers as local processes instead of a PBS job array', action="store_true")
+args = parser.parse_args()
 
-raw_directory = config.get('Paths', 'S1Images')
+CFG = args.input
+config = configparser.ConfigParser()
+config.read(CFG)
 
 output_preprocess = config.get('Paths', 'Output')
 
 tiles_list = [s.strip() for s in config.get('Processing','Tiles').split(",")]
-try:
-    os.remove(os.path.join("./jobs","*.cfg"))
-except:
-    pass
-
-for itile,tile in enumerate(tiles_list):
-    cfgFilename=os.path.join("./jobs","job-"+str(itile+1)+".cfg")
-    if not os.path.exists("./jobs"):
-        os.mkdir("./jobs")
-    config.set("Processing","Tiles",tile)
-    config.set("PEPS","ROI_by_tiles","ALL")
-    with open(cfgFilename, 'wb') as configfile:
+nb_workers = args.workers if args.workers > 0 else len(tiles_list)
+
+# All the workers pull their tiles from the same queue
+if not config.has_option('HPC-Cluster','WorkQueue'):
+    config.set('HPC-Cluster','WorkQueue',os.path.join(output_preprocess,"s1tiling_queue.sqlite"))
+work_queue = config.get('HPC-Cluster','WorkQueue')
+
+if not os.path.exists("./jobs"):
+    os.mkdir("./jobs")
+for f in os.listdir("./jobs"):
+    if f.endswith(".cfg"):
+        os.remove(os.path.join("./jobs",f))
+
+config.set("PEPS","ROI_by_tiles","ALL")
+for iworker in range(nb_workers):
+    cfgFilename=os.path.join("./jobs","job-"+str(iworker+1)+".cfg")
+    with open(cfgFilename, 'w') as configfile:
         config.write(configfile)
-    print itile," ",tile,"->" ,cfgFilename
-with open("s1tiling.jobarray.template") as f:
-    newtext=f.read().replace("#PBS -J","#PBS -J 1:"+str(len(tiles_list))+":1")
-with open("s1tiling.jobarray","w") as f:
-    f.write(newtext)
+    print (iworker," ",work_queue,"->" ,cfgFilename)
+
+if not args.local:
+    with open("s1tiling.jobarray.template") as f:
+        newtext=f.read().replace("#PBS -J","#PBS -J 1:"+str(nb_workers)+":1")
+    with open("s1tiling.jobarray","w") as f:
+        f.write(newtext)
+    sys.exit(0)
+
+# Local workers, mostly for testing
+workers = []
+for iworker in range(nb_workers):
+    cfgFilename=os.path.join("./jobs","job-"+str(iworker+1)+".cfg")
+    workers.append(subprocess.Popen([sys.executable, "S1Processor.py", "-i", cfgFilename],\
+                                    stdout=open(os.path.join("./jobs","job-"+str(iworker+1)+".log"),"a"),\
+                                    stderr=subprocess.STDOUT))
+while any(worker.poll() is None for worker in workers):
+    time.sleep(30)
+    if os.path.exists(work_queue):
+        S1WorkQueue(work_queue, 0).print_progress()
+S1WorkQueue(work_queue, 0).print_progress()
+sys.exit(max(worker.returncode for worker in workers))
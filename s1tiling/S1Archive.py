@@ -0,0 +1,137 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+This module contains functions to use the S1 products (SAFE directories)
+inside their zip archives. Files inside an archive are designated by GDAL
+virtual paths (/vsizip/<archive>/<member>), which GDAL opens directly and
+open_product_file() reads; the members are only extracted on demand.
+"""
+
+import os
+import io
+import shutil
+import zipfile
+
+VSIZIP = "/vsizip/"
+
+
+def get_vsizip_path(archive, member):
+    """ Returns the GDAL virtual path of a member of a zip archive"""
+    return VSIZIP+os.path.abspath(archive)+"/"+member
+
+
+def split_vsizip_path(path):
+    """
+    Returns (archive, member) for a GDAL virtual path, or None if the path
+    does not point into a zip archive
+    """
+    if not path.startswith(VSIZIP):
+        return None
+    archive, member = path[len(VSIZIP):].split(".zip/", 1)
+    return archive+".zip", member
+
+
+def open_product_file(path):
+    """
+    Open a text file (manifest, annotation) of a S1 product, extracted or
+    inside its archive.
+
+    Args:
+      path: file path or GDAL virtual path
+
+    Returns:
+      a file object opened for reading text
+    """
+    archive_member = split_vsizip_path(path)
+    if archive_member is None:
+        return open(path, "r")
+    archive, member = archive_member
+    with zipfile.ZipFile(archive, "r") as zip_ref:
+        return io.StringIO(zip_ref.read(member).decode("utf-8"))
+
+
+def list_archive(archive):
+    """
+    List the content of a product archive. Only the central directory of
+    the archive is read.
+
+    Args:
+      archive: the zip archive of a S1 product
+
+    Returns:
+      a tuple (name of the SAFE directory, list of members), or
+      (None, []) if the archive is corrupted or holds no SAFE directory
+    """
+    try:
+        with zipfile.ZipFile(archive, "r") as zip_ref:
+            members = zip_ref.namelist()
+    except (zipfile.BadZipfile, IOError, OSError):
+        return None, []
+    for member in members:
+        if member.split("/")[0].endswith(".SAFE"):
+            return member.split("/")[0], members
+    return None, []
+
+
+def move_tree(source, destination):
+    """
+    Move the files of a directory into another one, file by file, each
+    with an atomic rename. The files already in destination are kept.
+    """
+    for root, _, files in os.walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for file_it in files:
+            if not os.path.exists(os.path.join(target_root, file_it)):
+                os.replace(os.path.join(root, file_it), os.path.join(target_root, file_it))
+
+
+def extract_members(archive, members, directory):
+    """
+    Extract members of an archive which are not already present. The
+    members are written to a temporary directory, then renamed into
+    directory: a SAFE directory seen in directory only holds complete
+    files, even if several processes extract the same product.
+
+    Args:
+      archive: the zip archive
+      members: list of members to extract (in a single SAFE directory)
+      directory: destination directory
+    """
+    members = [member for member in members if not member.endswith("/")\
+               and not os.path.exists(os.path.join(directory, member))]
+    if not members:
+        return
+    safe_name = members[0].split("/")[0]
+    tmp_directory = os.path.join(directory, "."+safe_name+".tmp"+str(os.getpid()))
+    try:
+        with zipfile.ZipFile(archive, "r") as zip_ref:
+            for member in members:
+                destination = os.path.join(tmp_directory, member)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                with zip_ref.open(member) as source, open(destination, "wb") as target:
+                    shutil.copyfileobj(source, target, 1024*1024)
+        try:
+            # Most of the time, the whole SAFE directory appears at once
+            os.rename(os.path.join(tmp_directory, safe_name), os.path.join(directory, safe_name))
+        except OSError:
+            move_tree(os.path.join(tmp_directory, safe_name), os.path.join(directory, safe_name))
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
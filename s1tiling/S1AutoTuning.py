@@ -0,0 +1,169 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1AutoTuning class"""
+
+import os
+import json
+
+from s1tiling.S1JobScheduler import get_nb_cpus, get_available_ram
+
+# Starting point of each stage: (threads, RAM in MB)
+DEFAULT_STAGE_COSTS = {
+    "Calibration": (2, 1024),
+    "Orthorectification": (4, 2048),
+    "In-memory orthorectification": (4, 4096),
+    "Compute outcore": (4, 2048),
+    "Compute filtered images": (4, 2048),
+    "Cutting": (1, 512),
+    "Mask building": (1, 512),
+    "Concatenation": (1, 512),
+    "Extraction": (1, 128),
+}
+DEFAULT_COST = (2, 1024)
+
+# Number of most recent successful jobs of a stage used to refine its cost
+NB_RECORDS = 50
+# Weight of a job record relative to the next (more recent) one
+DECAY = 0.9
+# Share of its threads a job must keep busy for its stage to get more threads
+SATURATION = 0.9
+# Margin added to the largest memory footprint observed
+RAM_MARGIN = 1.2
+# Smallest memory given to a job, in MB
+MIN_RAM = 64
+
+
+class S1AutoTuning(object):
+    """
+    This class gives the number of threads and the memory of the jobs of
+    each stage.
+
+    When OTBNbThreads or RAMPerProcess is "auto", the cost of a stage
+    starts from a default, bounded by the host (allowed cores, cgroup
+    quota, available memory), and is refined from the jobs of the stage
+    recorded in the trace file by the previous runs: threads from the
+    CPU time per wall second they achieved, RAM from their peak resident
+    memory plus a margin. Otherwise the configured values are used.
+
+    A job that kept its threads busy asks for twice as many, a job that
+    did not asks for the threads it kept busy. The requests of the jobs
+    are averaged with weights decaying with their age, so that the
+    threads of a stage grow on large hosts, and recover from runs that
+    were bound by I/O.
+    """
+    def __init__(self, cfg):
+        """
+        Args:
+          cfg: the configuration (OTBThreads and ram_per_process, 0 for auto)
+        """
+        self.threads = cfg.OTBThreads
+        self.ram = cfg.ram_per_process
+        self.nb_cpus = get_nb_cpus()
+        self.available_ram = cfg.ram_budget if cfg.ram_budget > 0 else get_available_ram()
+        if cfg.cpu_budget > 0:
+            self.nb_cpus = min(self.nb_cpus, cfg.cpu_budget)
+        self.costs = {}
+        if self.threads <= 0 or self.ram <= 0:
+            self.costs = self.read_profiles(cfg.trace_file)
+
+    def read_profiles(self, trace_file):
+        """
+        Returns the cost of each stage learnt from the traces
+
+        Args:
+          trace_file: the JSONL trace written by the schedulers
+
+        Returns:
+          dict stage -> (threads, RAM in MB)
+        """
+        records = {}
+        if not trace_file or not os.path.exists(trace_file):
+            return {}
+        with open(trace_file, "r") as trace:
+            for line in trace:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("returncode") != 0 or not record.get("wall")\
+                   or not record.get("nb_threads"):
+                    continue
+                records.setdefault(record["stage"], []).append(record)
+
+        costs = {}
+        for stage, stage_records in records.items():
+            stage_records = stage_records[-NB_RECORDS:]
+            _, default_ram = DEFAULT_STAGE_COSTS.get(stage, DEFAULT_COST)
+            requests = []
+            weights = []
+            for age, record in enumerate(reversed(stage_records)):
+                requests.append(self.get_thread_request(record))
+                weights.append(DECAY**age)
+            threads = max(1, int(round(sum(request*weight for request, weight\
+                                           in zip(requests, weights))/sum(weights))))
+            rss = [record["max_rss"] for record in stage_records if record.get("max_rss")]
+            ram = default_ram
+            if rss:
+                ram = max(MIN_RAM, int(max(rss)/1024.*RAM_MARGIN))
+            costs[stage] = (threads, ram)
+        return costs
+
+    def get_thread_request(self, record):
+        """
+        Returns the number of threads a recorded job asks for its stage
+
+        Args:
+          record: the profiling record of the job (see S1Job.get_record)
+        """
+        # A job that used its cores N times faster than the wall clock
+        # keeps N threads busy: more would be wasted, unless it kept all
+        # its threads busy
+        parallelism = (record["user"]+record["sys"])/record["wall"]
+        if parallelism >= SATURATION*record["nb_threads"]:
+            return 2*record["nb_threads"]
+        return max(1, min(record["nb_threads"], int(round(parallelism))))
+
+    def get(self, stage):
+        """
+        Returns the cost of the jobs of a stage
+
+        Args:
+          stage: name of the processing stage
+
+        Returns:
+          (number of threads, RAM in MB)
+        """
+        threads, ram = self.costs.get(stage, DEFAULT_STAGE_COSTS.get(stage, DEFAULT_COST))
+        threads = min(threads, self.nb_cpus)
+        ram = min(ram, self.available_ram)
+        if self.threads > 0:
+            threads = self.threads
+        if self.ram > 0:
+            ram = self.ram
+        return threads, ram
+
+    def print_settings(self):
+        """ Print the cost chosen for each stage"""
+        print ("Auto-tuning: "+str(self.nb_cpus)+" cores, "\
+               +str(self.available_ram)+" MB available")
+        for stage in sorted(DEFAULT_STAGE_COSTS):
+            threads, ram = self.get(stage)
+            print ("  {:<30} {} threads, {} MB{}".format(stage, threads, ram,\
+                   " (learnt)" if stage in self.costs else ""))
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+This module generates the border mask of an ortho-rectified image in one
+pass: the image is thresholded (0 where the image is 0, 1 elsewhere) and
+smoothed by a binary opening with a ball structuring element, as
+otbcli_BandMath followed by otbcli_BinaryMorphologicalOperation did.
+"""
+
+import numpy as np
+from osgeo import gdal
+
+# Radius of the ball structuring element of the opening (in pixels)
+MASK_OPENING_RADIUS = 5
+
+# Creation options of the border masks (1 bit per pixel, compressed)
+MASK_CREATION_OPTIONS = ["COMPRESS=DEFLATE", "NBITS=1", "BIGTIFF=IF_SAFER"]
+
+
+def get_ball_half_widths(radius):
+    """
+    Returns the half width of each line of a ball structuring element,
+    from -radius to +radius (as itk::BinaryBallStructuringElement)
+    """
+    return [int(np.floor(np.sqrt((radius+0.5)**2-dy**2)))\
+            for dy in range(-radius, radius+1)]
+
+
+def erode_lines(mask, half_width):
+    """
+    Binary erosion of each line of a mask by a segment. The pixels outside
+    the mask are considered as foreground.
+    """
+    if half_width == 0:
+        return mask.copy()
+    padded = np.pad(~mask, ((0, 0), (half_width+1, half_width)), constant_values=False)
+    holes = np.cumsum(padded, axis=1, dtype=np.int32)
+    return (holes[:, 2*half_width+1:]-holes[:, :-2*half_width-1]) == 0
+
+
+def dilate_lines(mask, half_width):
+    """
+    Binary dilation of each line of a mask by a segment. The pixels outside
+    the mask are considered as background.
+    """
+    if half_width == 0:
+        return mask.copy()
+    padded = np.pad(mask, ((0, 0), (half_width+1, half_width)), constant_values=False)
+    count = np.cumsum(padded, axis=1, dtype=np.int32)
+    return (count[:, 2*half_width+1:]-count[:, :-2*half_width-1]) > 0
+
+
+def morphology(mask, radius, erosion):
+    """
+    Binary erosion or dilation of a mask by a ball, computed as the
+    combination of the vertically shifted erosions (dilations) of each
+    line by the segments of the ball.
+
+    Args:
+      mask: boolean array
+      radius: radius of the ball
+      erosion: True for an erosion, False for a dilation
+
+    Returns:
+      the eroded (dilated) mask
+    """
+    nb_lines = mask.shape[0]
+    # Outside the mask: foreground for an erosion, background for a dilation
+    padded = np.pad(mask, ((radius, radius), (0, 0)), constant_values=erosion)
+    result = np.full(mask.shape, erosion, dtype=bool)
+    for dy, half_width in zip(range(-radius, radius+1), get_ball_half_widths(radius)):
+        lines = padded[radius+dy:radius+dy+nb_lines]
+        if erosion:
+            result &= erode_lines(lines, half_width)
+        else:
+            result |= dilate_lines(lines, half_width)
+    return result
+
+
+def generate_border_mask(ortho_image, mask_image, ram):
+    """
+    Generate the border mask of an ortho-rectified image. The mask is
+    written block by block: each block is read with a halo of twice the
+    radius of the opening, so that the opened lines of the block are
+    exact, and the memory used is bounded by a block.
+
+    Args:
+      ortho_image: the ortho-rectified image
+      mask_image: the border mask to write
+      ram: memory available, in MB
+    """
+    raster = gdal.Open(ortho_image)
+    in_band = raster.GetRasterBand(1)
+    xsize = raster.RasterXSize
+    ysize = raster.RasterYSize
+
+    driver = gdal.GetDriverByName("GTiff")
+    outdata = driver.Create(mask_image, xsize, ysize, 1, gdal.GDT_Byte,\
+                            MASK_CREATION_OPTIONS)
+    outdata.SetGeoTransform(raster.GetGeoTransform())
+    outdata.SetProjection(raster.GetProjection())
+    out_band = outdata.GetRasterBand(1)
+
+    # Number of lines per block: the input block and a few boolean copies
+    halo = 2*MASK_OPENING_RADIUS
+    item_size = gdal.GetDataTypeSize(in_band.DataType)//8
+    block_lines = max(1, ram*1024*1024//((item_size+8)*xsize))
+
+    for y_start in range(0, ysize, block_lines):
+        y_end = min(ysize, y_start+block_lines)
+        first_line = max(0, y_start-halo)
+        last_line = min(ysize, y_end+halo)
+        mask = in_band.ReadAsArray(0, first_line, xsize, last_line-first_line) != 0
+        # Only the image borders are outside the mask: the lines eroded
+        # wrongly at the inner borders of the halo are not used
+        mask = morphology(mask, MASK_OPENING_RADIUS, True)
+        mask = morphology(mask, MASK_OPENING_RADIUS, False)
+        out_band.WriteArray(mask[y_start-first_line:y_end-first_line].astype(np.uint8),\
+                            0, y_start)
+
+    outdata.FlushCache()
+    outdata = None
+    raster = None
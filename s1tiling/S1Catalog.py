@@ -0,0 +1,231 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1Catalog class"""
+
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of products per page of the catalog answers
+MAX_RECORDS = 500
+
+
+def get_box_query(box):
+    """
+    Returns the geometric parameter of a catalog search on a box
+
+    Args:
+      box: (lonmin, latmin, lonmax, latmax)
+    """
+    return "box="+",".join("{:.6f}".format(coordinate) for coordinate in box)
+
+
+def get_cfg_parameters(cfg):
+    """
+    Returns the search parameters of the configuration (dates,
+    polarisation, GRD, IW)
+    """
+    return [("startDate", cfg.first_date),\
+            ("completionDate", cfg.last_date),\
+            ("polarisation", cfg.polarisation.replace("-", "%20")),\
+            ("productType", cfg.type_image),\
+            ("sensorMode", "IW")]
+
+
+class S1Catalog(object):
+    """
+    This class searches the products of the PEPS catalog (resto API).
+
+    The answers are cached on disk, keyed by the normalised search
+    parameters, for ttl seconds: a search repeated within that delay (next
+    tile, next run, next poll of the products on tape) is not sent again.
+    The pages of a search are fetched concurrently once the first one has
+    given the number of results, and the storage mode of the products
+    still waiting for their download is refreshed product by product
+    instead of searching everything again.
+    """
+    def __init__(self, downloader, parameters, cache_dir=None, ttl=3600):
+        """
+        Args:
+          downloader: the S1Downloader whose connections are used
+          parameters: list of (name, value) of the search, besides the
+            geometry
+          cache_dir: directory of the cached answers (None: no cache)
+          ttl: lifetime of the cached answers, in seconds
+        """
+        self.downloader = downloader
+        self.base_url = downloader.base_url
+        self.collection = downloader.collection
+        self.parameters = sorted((key, str(value)) for key, value in parameters if value != "")
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_search_url(self, query, page):
+        """
+        Returns the URL of a page of a catalog search
+
+        Args:
+          query: the geometric parameter ("box=...", "lat=...&lon=...", "q=...")
+          page: the page, starting at 1
+        """
+        return self.base_url+"/api/collections/"+self.collection+"/search.json?"+query+"&"\
+            +"&".join(key+"="+value for key, value in self.parameters)\
+            +"&maxRecords="+str(MAX_RECORDS)+"&page="+str(page)
+
+    def get_feature_url(self, feature_id):
+        """ Returns the URL of the description of one product"""
+        return self.base_url+"/collections/"+self.collection+"/"+feature_id+".json"
+
+    def get_cache_file(self, query):
+        """ Returns the file caching the answer of a search, or None"""
+        if self.cache_dir is None:
+            return None
+        key = json.dumps([self.base_url, self.collection, query, self.parameters])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()+".json")
+
+    def read_cache(self, query):
+        """ Returns the cached features of a search, or None if expired"""
+        cache_file = self.get_cache_file(query)
+        if cache_file is None or self.ttl <= 0 or not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r") as in_file:
+                cached = json.load(in_file)
+        except ValueError:
+            return None
+        if time.time()-cached["time"] > self.ttl:
+            return None
+        return cached["features"]
+
+    def write_cache(self, query, features, search_time):
+        """ Cache the features found by a search"""
+        cache_file = self.get_cache_file(query)
+        if cache_file is None:
+            return
+        tmp_file = cache_file+".tmp"+str(os.getpid())
+        with open(tmp_file, "w") as out_file:
+            json.dump({"time": search_time, "query": query, "parameters": self.parameters,\
+                       "features": features}, out_file)
+        os.replace(tmp_file, cache_file)
+
+    def get_page(self, query, page):
+        """ Returns the answer of one page of a search"""
+        data = self.downloader.get_json(self.get_search_url(query, page))
+        if 'ErrorCode' in data:
+            raise Exception(data['ErrorMessage'])
+        return data
+
+    def search_features(self, query):
+        """
+        Search the products matching a geometric parameter
+
+        Args:
+          query: the geometric parameter ("box=...", "lat=...&lon=...", "q=...")
+
+        Returns:
+          the list of the GeoJSON features of the catalog
+        """
+        features = self.read_cache(query)
+        if features is not None:
+            return features
+        search_time = time.time()
+        data = self.get_page(query, 1)
+        features = data["features"]
+        total = data.get("properties", {}).get("totalResults")
+        if len(data["features"]) < MAX_RECORDS:
+            pass
+        elif total is not None:
+            # The number of pages is known: they are fetched at once
+            nb_pages = (int(total)+MAX_RECORDS-1)//MAX_RECORDS
+            with ThreadPoolExecutor(max_workers=self.downloader.nb_transfers) as executor:
+                for data in executor.map(lambda page: self.get_page(query, page),\
+                                         range(2, nb_pages+1)):
+                    features += data["features"]
+        else:
+            page = 2
+            while True:
+                data = self.get_page(query, page)
+                features += data["features"]
+                if len(data["features"]) < MAX_RECORDS:
+                    break
+                page += 1
+        self.write_cache(query, features, search_time)
+        return features
+
+    def search(self, query):
+        """
+        Search the products matching a geometric parameter
+
+        Args:
+          query: the geometric parameter (see get_box_query)
+
+        Returns:
+          a list of dict with the product identifier ("product"), its
+          catalog identifier ("id"), its storage mode ("storage"), whether
+          it is a near real time product ("realtime"), the checksum of
+          its archive ("checksum", or None) and its footprint as GeoJSON
+          ("geometry", or None)
+        """
+        products = []
+        for feature in self.search_features(query):
+            properties = feature["properties"]
+            products.append({"product": properties["productIdentifier"],\
+                             "id": feature["id"],\
+                             "storage": properties["storage"]["mode"],\
+                             "realtime": "NRT" in properties.get("realtime", ""),\
+                             "checksum": properties.get("services", {})\
+                             .get("download", {}).get("checksum"),\
+                             "geometry": feature.get("geometry")})
+        return products
+
+    def refresh(self, feature_ids, query=None):
+        """
+        Refresh the storage mode (disk, tape, staging) of some products,
+        for instance the ones still on tape, and update the cache of the
+        search they were found by
+
+        Args:
+          feature_ids: the catalog identifiers of the products
+          query: the geometric parameter of the search, or None
+
+        Returns:
+          dict catalog identifier -> storage mode
+        """
+        def get_storage(feature_id):
+            return self.downloader.get_json(self.get_feature_url(feature_id))\
+                ["properties"]["storage"]["mode"]
+
+        feature_ids = list(feature_ids)
+        with ThreadPoolExecutor(max_workers=self.downloader.nb_transfers) as executor:
+            storages = dict(zip(feature_ids, executor.map(get_storage, feature_ids)))
+
+        cache_file = self.get_cache_file(query) if query is not None else None
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, "r") as in_file:
+                cached = json.load(in_file)
+            for feature in cached["features"]:
+                if feature["id"] in storages:
+                    feature["properties"]["storage"]["mode"] = storages[feature["id"]]
+            self.write_cache(query, cached["features"], cached["time"])
+        return storages
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1DEMCache class"""
+
+import os
+import json
+import fcntl
+import socket
+import shutil
+import hashlib
+
+
+def get_owner():
+    """
+    Returns the suffix of the files and directories of the running
+    process: host name and pid
+    """
+    return socket.gethostname().replace("_", "-")+"_"+str(os.getpid())
+
+
+class S1DEMCache(object):
+    """
+    This class manages a persistent cache of the SRTM tiles, shared by
+    all the runs (and processes) using the same cache directory.
+
+    Each SRTM tile is copied once into the store, under the digest of its
+    content, so that identical tiles found at different paths share one
+    entry and a modified source tile is copied again. The digests are
+    kept in the index of the cache by path, size and modification time
+    of the source tiles, and computed while copying, so that each source
+    tile is read only once. The tiles needed by a MGRS tile are then staged
+    in a directory of their own by hard links (or symbolic links if the
+    store is on another file system), which is given to the
+    orthorectification as DEM directory.
+
+    The store is evicted in LRU order when it exceeds its quota. All the
+    changes are made under an exclusive lock on the cache directory (a
+    POSIX lock, which NFS supports through its lock manager). The staging
+    directories are named after the host and pid of their process: only
+    the ones left by the processes of the local host that are gone are
+    removed, the ones of the other hosts are kept. The cache is meant to
+    be on a local disk; on a shared file system, its consistency relies
+    on the locking support of the file system.
+    """
+    def __init__(self, cfg):
+        """
+        Args:
+          cfg: the configuration (SRTM source directory, DEMCache
+            directory, DEMCacheQuota in MB, 0 for no limit)
+        """
+        self.source = cfg.srtm
+        self.directory = cfg.dem_cache
+        self.quota = cfg.dem_cache_quota*1024*1024
+        self.store = os.path.join(self.directory, "store")
+        self.index_file = os.path.join(self.directory, "index.json")
+        self.staging = os.path.join(self.directory, "tiles")
+        self.staged = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for directory in [self.store, self.staging]:
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+    def lock(self):
+        """ Returns the lock file of the cache, locked exclusively"""
+        lock_file = open(os.path.join(self.directory, ".lock"), "w")
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def read_index(self):
+        """
+        Returns the names of the source tiles in the store, by path, size
+        and modification time. Must be called with the lock held.
+        """
+        if not os.path.exists(self.index_file):
+            return {}
+        with open(self.index_file) as index_file:
+            return json.load(index_file)
+
+    def write_index(self, index):
+        """
+        Write the index of the cache, without the entries that have been
+        evicted from the store. Must be called with the lock held.
+        """
+        index = {identity: name for identity, name in index.items()\
+                 if os.path.exists(os.path.join(self.store, name))}
+        tmp = self.index_file+".tmp_"+get_owner()
+        with open(tmp, "w") as index_file:
+            json.dump(index, index_file)
+        os.rename(tmp, self.index_file)
+
+    def fetch(self, srtm_tile, index):
+        """
+        Copy a SRTM tile into the store if it is not there yet.
+        Must be called with the lock held.
+
+        Args:
+          srtm_tile: SRTM tile file name
+          index: the index of the cache (see read_index), updated
+
+        Returns:
+          the path of the tile in the store
+        """
+        source = os.path.abspath(os.path.join(self.source, srtm_tile))
+        stat = os.stat(source)
+        identity = "{}:{}:{}".format(source, stat.st_size, stat.st_mtime_ns)
+        if identity in index and os.path.exists(os.path.join(self.store, index[identity])):
+            self.hits += 1
+            stored = os.path.join(self.store, index[identity])
+        else:
+            self.misses += 1
+            tmp = os.path.join(self.store, ".tmp_"+get_owner()+"_"+srtm_tile)
+            digest = hashlib.sha1()
+            with open(source, "rb") as source_file, open(tmp, "wb") as tmp_file:
+                for block in iter(lambda: source_file.read(1024*1024), b""):
+                    digest.update(block)
+                    tmp_file.write(block)
+            index[identity] = digest.hexdigest()+os.path.splitext(srtm_tile)[1]
+            stored = os.path.join(self.store, index[identity])
+            if os.path.exists(stored):
+                # The same tile has been stored from another path
+                os.remove(tmp)
+            else:
+                os.rename(tmp, stored)
+        # The modification time of the stored tile is its last use
+        os.utime(stored)
+        return stored
+
+    def stage(self, name, srtm_tiles):
+        """
+        Stage SRTM tiles in a directory of their own.
+
+        Args:
+          name: name of the staging directory (the MGRS tile for instance)
+          srtm_tiles: list of SRTM tile file names
+
+        Returns:
+          the directory holding the SRTM tiles
+        """
+        staging_dir = os.path.join(self.staging, name+"_"+get_owner())
+        lock_file = self.lock()
+        try:
+            if not os.path.exists(staging_dir):
+                os.makedirs(staging_dir)
+            index = self.read_index()
+            for srtm_tile in srtm_tiles:
+                stored = self.fetch(srtm_tile, index)
+                link = os.path.join(staging_dir, srtm_tile)
+                if os.path.lexists(link):
+                    os.remove(link)
+                try:
+                    os.link(stored, link)
+                except OSError:
+                    os.symlink(stored, link)
+            self.staged[name] = staging_dir
+            self.evict()
+            self.write_index(index)
+        finally:
+            lock_file.close()
+        return staging_dir
+
+    def release(self, name):
+        """
+        Remove the staging directory of a MGRS tile once it is processed.
+        """
+        staging_dir = self.staged.pop(name, None)
+        if staging_dir is None:
+            return
+        lock_file = self.lock()
+        try:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.evict()
+        finally:
+            lock_file.close()
+
+    def get_used_tiles(self):
+        """
+        Returns the store entries staged by running processes, and removes
+        the staging directories left by the processes of the local host
+        that are gone. Must be called with the lock held.
+        """
+        used = set()
+        hostname = socket.gethostname().replace("_", "-")
+        for entry in os.scandir(self.staging):
+            fields = entry.name.rsplit("_", 2)
+            # Directories named without host were staged on the local host
+            host = fields[1] if len(fields) == 3 else hostname
+            if host == hostname:
+                try:
+                    os.kill(int(fields[-1]), 0)
+                except ProcessLookupError:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                except (ValueError, PermissionError):
+                    pass
+            for link in os.scandir(entry.path):
+                try:
+                    stat = os.stat(link.path)
+                except OSError:
+                    continue
+                used.add((stat.st_dev, stat.st_ino))
+        return used
+
+    def evict(self):
+        """
+        Remove the least recently used SRTM tiles of the store that are not
+        staged, until the store fits into the quota.
+        Must be called with the lock held.
+        """
+        if self.quota <= 0:
+            return
+        entries = [(entry.stat().st_mtime, entry) for entry in os.scandir(self.store)\
+                   if not entry.name.startswith(".tmp_")]
+        total_size = sum(entry.stat().st_size for _, entry in entries)
+        if total_size <= self.quota:
+            return
+        used = self.get_used_tiles()
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            if total_size <= self.quota:
+                break
+            stat = entry.stat()
+            if (stat.st_dev, stat.st_ino) in used:
+                continue
+            os.remove(entry.path)
+            total_size -= stat.st_size
+            self.evictions += 1
+
+    def print_statistics(self):
+        """ Print the cache usage"""
+        total_size = sum(entry.stat().st_size for entry in os.scandir(self.store))
+        print ("DEM cache: "+str(total_size//(1024*1024))+" MB, "\
+               +str(self.hits)+" hits, "+str(self.misses)+" misses, "\
+               +str(self.evictions)+" evictions")
@@ -19,16 +19,72 @@
 
 """ This module contains the S1DateAcquisition class"""
 
+import os
+from s1tiling.S1Archive import get_vsizip_path, extract_members
+
 class S1DateAcquisition(object):
-    """This class handles the list of images for one S1 product"""
-    def __init__(self, manifest, image_filenames_list):
+    """
+    This class handles the list of images for one S1 product.
+
+    The images are always designated by their path in the SAFE directory,
+    so that the intermediate files are written next to them. When the
+    product comes from a zip archive which is not (fully) extracted, the
+    manifest is read from the archive and the images are extracted on
+    demand (see needs_extraction and extract).
+    """
+    def __init__(self, manifest, image_filenames_list, archive=None):
         self.manifest = manifest
         self.image_filenames_list = image_filenames_list
+        self.archive = archive
+        self.safe_dir = os.path.dirname(manifest)
+        self.metadata_members = []
+        if archive is not None and not os.path.exists(manifest):
+            self.manifest = get_vsizip_path(archive, self.get_member(manifest))
 
     def get_manifest(self):
         """ Get the manifest file """
         return self.manifest
 
+    def get_safe_dir(self):
+        """ Get the SAFE directory of the product (which may not exist yet)"""
+        return self.safe_dir
+
+    def get_archive(self):
+        """ Get the zip archive of the product, or None"""
+        return self.archive
+
+    def get_member(self, path):
+        """ Returns the member of the archive matching a path of the SAFE directory"""
+        return os.path.basename(self.safe_dir)+path.split(".SAFE", 1)[1]
+
+    def set_metadata_members(self, members):
+        """
+        Set the members of the archive (manifest, annotations) needed with
+        any image of the product
+        """
+        self.metadata_members = members
+
+    def needs_extraction(self, image):
+        """ Tells whether an image must be extracted before OTB can read it"""
+        return self.archive is not None and not os.path.exists(image)
+
+    def extract(self, image):
+        """
+        Extract an image from the archive, with the manifest and the
+        annotation, calibration and noise files of its polarisation only
+        """
+        polarisation = "-"+os.path.basename(image).split("-")[3]+"-"
+        members = [member for member in self.metadata_members\
+                   if member.endswith("manifest.safe")\
+                   or polarisation in os.path.basename(member)]
+        extract_members(self.archive, members+[self.get_member(image)],\
+                        os.path.dirname(self.safe_dir))
+
+    def remove_extracted(self, image):
+        """ Remove an extracted image, which the archive still holds"""
+        if self.archive is not None and os.path.exists(image):
+            os.remove(image)
+
     def add_image(self, image_list):
         """ Add an image to the image list """
         self.image_filenames_list.append(image_list)
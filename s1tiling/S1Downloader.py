@@ -0,0 +1,294 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1Downloader class"""
+
+import os
+import ssl
+import json
+import time
+import heapq
+import base64
+import random
+import hashlib
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Default PEPS server (resto API)
+PEPS_URL = "https://peps.cnes.fr/resto"
+
+# Size of the chunks read from the network and written to disk
+CHUNK_SIZE = 1024*1024
+
+# Status of a product after a download attempt
+DOWNLOADED = "downloaded"
+STAGING = "staging"
+FAILED = "failed"
+
+
+class DownloadError(Exception):
+    """ Raised when a transfer fails and may be retried"""
+    pass
+
+
+def read_auth_file(auth_file):
+    """
+    Read a PEPS authentication file ("email password" on one line)
+
+    Returns:
+      a tuple (email, password)
+    """
+    with open(auth_file, "r") as in_file:
+        email, password = in_file.readline().split(' ')
+    return email, password.strip()
+
+
+class S1Downloader(object):
+    """
+    This class downloads products from PEPS in process. It keeps one
+    persistent HTTP connection per transfer thread, runs several transfers
+    at once, resumes partial files with HTTP Range requests, verifies the
+    checksum of the products while they are streamed, and retries each
+    failed product after its own exponential backoff, without holding
+    back the others.
+    """
+    def __init__(self, auth_file, write_dir, base_url=PEPS_URL, collection="S1",\
+                 nb_transfers=4, max_attempts=5, backoff=10, timeout=120):
+        """
+        Args:
+          auth_file: PEPS account and password file
+          write_dir: directory where the products (zip archives) are written
+          base_url: URL of the resto API (PEPS or a local stand-in)
+          collection: the catalog collection
+          nb_transfers: number of concurrent transfers
+          max_attempts: number of attempts of a product before it is failed
+          backoff: delay before the first retry of a product, in seconds
+          timeout: network timeout in seconds
+        """
+        email, password = read_auth_file(auth_file)
+        self.authorization = "Basic "+base64.b64encode((email+":"+password)\
+                                                       .encode("utf-8")).decode("ascii")
+        self.write_dir = write_dir
+        self.base_url = base_url.rstrip("/")
+        self.collection = collection
+        self.nb_transfers = nb_transfers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+        self.pid = os.getpid()
+        self.downloaded_bytes = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(write_dir):
+            os.makedirs(write_dir, exist_ok=True)
+
+    def get_connection(self, url):
+        """ Returns the persistent connection of this thread to the host of an URL"""
+        parts = urllib.parse.urlsplit(url)
+        if os.getpid() != self.pid:
+            # Forked process: the inherited connections belong to the parent
+            self.local = threading.local()
+            self.pid = os.getpid()
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        key = (parts.scheme, parts.netloc)
+        if key not in connections:
+            if parts.scheme == "https":
+                connections[key] = http.client.HTTPSConnection(parts.netloc, timeout=self.timeout,\
+                                                               context=ssl._create_unverified_context())
+            else:
+                connections[key] = http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+        return connections[key]
+
+    def close_connection(self, url):
+        """ Drop the connection of this thread to the host of an URL"""
+        parts = urllib.parse.urlsplit(url)
+        connection = getattr(self.local, "connections", {}).pop((parts.scheme, parts.netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def request(self, url, headers=None, auth=False):
+        """
+        Send a GET request on the persistent connection. A connection
+        closed by the server since the previous request is opened again.
+
+        Returns:
+          the http.client.HTTPResponse (to be read completely)
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path+("?"+parts.query if parts.query else "")
+        headers = dict(headers or {})
+        if auth:
+            headers["Authorization"] = self.authorization
+        for attempt in range(2):
+            connection = self.get_connection(url)
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close_connection(url)
+                if attempt == 1:
+                    raise
+            except (OSError, http.client.HTTPException):
+                self.close_connection(url)
+                raise
+
+    def get_json(self, url):
+        """ Returns the JSON document at an URL"""
+        response = self.request(url)
+        data = response.read()
+        if response.status != 200:
+            raise DownloadError("HTTP "+str(response.status)+" for "+url)
+        return json.loads(data.decode("utf-8"))
+
+    def get_download_url(self, feature_id):
+        """ Returns the download URL of a catalog feature"""
+        return self.base_url+"/collections/"+self.collection+"/"+feature_id\
+            +"/download/?issuerId=peps"
+
+    def get_product_path(self, product):
+        """ Returns the path of the archive of a product"""
+        return os.path.join(self.write_dir, product+".zip")
+
+    def download_product(self, product, feature_id, checksum=None):
+        """
+        Download one product. A partial file left by a previous attempt is
+        resumed.
+
+        Args:
+          product: the product identifier
+          feature_id: the catalog identifier of the product
+          checksum: expected checksum of the archive ("md5:<hex>"), or None
+
+        Returns:
+          DOWNLOADED, or STAGING if the product is not online yet
+
+        Raises:
+          DownloadError if the transfer failed
+        """
+        url = self.get_download_url(feature_id)
+        part_file = os.path.join(self.write_dir, "."+product+".zip.part")
+        algorithm, expected = checksum.split(":", 1) if checksum else ("md5", None)
+        digest = hashlib.new(algorithm)
+        offset = 0
+        if os.path.exists(part_file):
+            # The checksum covers the bytes already received
+            with open(part_file, "rb") as part:
+                for chunk in iter(lambda: part.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    offset += len(chunk)
+
+        headers = {"Range": "bytes="+str(offset)+"-"} if offset > 0 else {}
+        try:
+            response = self.request(url, headers, auth=True)
+        except (OSError, http.client.HTTPException) as err:
+            raise DownloadError(str(err))
+        content_type = response.getheader("Content-Type", "")
+        if response.status == 416:
+            # The partial file is not a prefix of the product anymore
+            response.read()
+            os.remove(part_file)
+            raise DownloadError("Range not satisfiable, restarting "+product)
+        if response.status == 202 or "json" in content_type:
+            # The product is being staged from tape (or the server
+            # answered with an error message instead of the product)
+            message = response.read()
+            if response.status in (200, 202):
+                return STAGING
+            raise DownloadError("HTTP "+str(response.status)+": "+message.decode("utf-8", "replace"))
+        if response.status not in (200, 206):
+            response.read()
+            raise DownloadError("HTTP "+str(response.status)+" for "+product)
+        if response.status == 200 and offset > 0:
+            # The server does not support ranges: start again
+            digest = hashlib.new(algorithm)
+            offset = 0
+
+        try:
+            with open(part_file, "ab" if offset > 0 else "wb") as part:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    part.write(chunk)
+                    digest.update(chunk)
+                    with self.lock:
+                        self.downloaded_bytes += len(chunk)
+        except (OSError, http.client.HTTPException) as err:
+            self.close_connection(url)
+            raise DownloadError("Transfer of "+product+" interrupted: "+str(err))
+        if response.length:
+            # Connection closed before the end of the product
+            self.close_connection(url)
+            raise DownloadError("Transfer of "+product+" incomplete")
+
+        if expected is not None and digest.hexdigest() != expected.lower():
+            os.remove(part_file)
+            raise DownloadError("Checksum mismatch for "+product)
+        os.replace(part_file, self.get_product_path(product))
+        return DOWNLOADED
+
+    def get_delay(self, attempt):
+        """ Returns the delay before the next attempt on a product, in seconds"""
+        return self.backoff*2**(attempt-1)*random.uniform(0.8, 1.2)
+
+    def download(self, products):
+        """
+        Download products concurrently. A failed product is retried after
+        a delay doubling at each attempt, while the other products go on.
+
+        Args:
+          products: list of (product, feature id, checksum or None)
+
+        Returns:
+          dict product -> DOWNLOADED, STAGING or FAILED
+        """
+        statuses = {}
+        attempts = {}
+        # Products waiting for a transfer slot: (time they are ready, product)
+        ready = [(0., product) for product in products]
+        heapq.heapify(ready)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.nb_transfers) as executor:
+            while ready or running:
+                while ready and len(running) < self.nb_transfers and ready[0][0] <= time.time():
+                    _, product = heapq.heappop(ready)
+                    running[executor.submit(self.download_product, *product)] = product
+                timeout = max(0., ready[0][0]-time.time()) if ready else None
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    product = running.pop(future)
+                    name = product[0]
+                    try:
+                        statuses[name] = future.result()
+                        print (name+": "+statuses[name])
+                    except DownloadError as err:
+                        attempts[name] = attempts.get(name, 0)+1
+                        if attempts[name] >= self.max_attempts:
+                            print ("ERROR: "+name+" failed after "+str(attempts[name])\
+                                   +" attempts: "+str(err))
+                            statuses[name] = FAILED
+                        else:
+                            delay = self.get_delay(attempts[name])
+                            print ("WARNING: "+str(err)+", retrying in "+str(int(delay))+" s")
+                            heapq.heappush(ready, (time.time()+delay, product))
+        return statuses
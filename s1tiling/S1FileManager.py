@@ -20,10 +20,18 @@
 """ This module contains the S1FileManager class"""
 
 import os
+import sys
+import json
+import time
+import fnmatch
 import ogr
 from s1tiling.Utils import get_origin
 from s1tiling.S1DateAcquisition import S1DateAcquisition
-import tempfile
+from s1tiling.S1Archive import list_archive
+from s1tiling.S1Downloader import S1Downloader
+from s1tiling.S1Catalog import S1Catalog, get_box_query, get_cfg_parameters
+from s1tiling.S1StagingTracker import S1StagingTracker
+from s1tiling.S1Inventory import S1Inventory
 
 class S1FileManager(object):
     """ Class to manage processed files (downloads, checks) """
@@ -31,9 +39,14 @@ class S1FileManager(object):
         
         self.cfg=cfg
         self.raw_raster_list = []
+        # SAFE directory name -> S1DateAcquisition
+        self.rasters = {}
         self.nb_images = 0
-
-        self.tmpsrtmdir=tempfile.mkdtemp(dir=cfg.tmpdir)
+        self.inventory = None
+        self.downloader = None
+        self.staging_tracker = None
+        # product -> catalog entry and tiles, see plan_downloads
+        self.download_plan = None
 
         self.vh_pattern = "measurement/*vh*-???.tiff"
         self.vv_pattern = "measurement/*vv*-???.tiff"
@@ -47,9 +60,10 @@ class S1FileManager(object):
         if self.cfg.pepsdownload == True:
             self.fd=cfg.first_date
             self.ld=cfg.last_date
-            self.pepscommand = "python ./peps/peps_download/peps_download.py -c S1 -p"+ self.cfg.type_image+\
+            self.pepscommand = sys.executable+" ./peps/peps_download/peps_download.py -c S1 -p"+ self.cfg.type_image+\
             " -a ./peps/peps_download/peps.txt -m IW -d "\
-            +self.cfg.first_date+" -f "+self.cfg.last_date+ " --pol "+self.cfg.polarisation
+            +self.cfg.first_date+" -f "+self.cfg.last_date+ " --pol "+self.cfg.polarisation\
+            +" --url "+self.cfg.peps_url+" -t "+str(self.cfg.nb_downloads)
             self.roi_by_coordinates = None
             self.roi_by_tiles = None
 
@@ -72,10 +86,13 @@ class S1FileManager(object):
         """ This method downloads the required images if pepsdownload is True"""
         import numpy as np
         from subprocess import Popen
-        import time
         if self.cfg.pepsdownload == True:
 
-            if self.roi_by_tiles is not None:
+            if self.roi_by_tiles is not None and self.download_plan is not None\
+               and tiles is not None:
+                # The products of the tile were found by plan_downloads
+                self.download_products(self.get_downloads(tiles))
+            elif self.roi_by_tiles is not None:
                 if tiles is None:
                     if "ALL" in self.roi_by_tiles:
                         tiles_list = self.cfg.tiles_list
@@ -146,82 +163,322 @@ class S1FileManager(object):
             self.unzip_images()
             self.get_s1_img()
 
+    def get_downloader(self):
+        """ This method returns the in-process downloader (see S1Downloader)"""
+        if self.downloader is None:
+            self.downloader = S1Downloader("./peps/peps_download/peps.txt",\
+                                           self.cfg.raw_directory,\
+                                           base_url=self.cfg.peps_url,\
+                                           nb_transfers=self.cfg.nb_downloads)
+        return self.downloader
+
+    def get_catalog(self):
+        """ This method returns the catalog client (see S1Catalog)"""
+        return S1Catalog(self.get_downloader(), get_cfg_parameters(self.cfg),\
+                         cache_dir=os.path.join(self.cfg.raw_directory, ".catalog"),\
+                         ttl=self.cfg.catalog_ttl)
+
+    def get_staging_tracker(self):
+        """
+        This method returns the tracker of the products on tape (see
+        S1StagingTracker), whose states are kept in raw_directory
+        """
+        if self.staging_tracker is None:
+            self.staging_tracker = self.open_staging_tracker()
+        return self.staging_tracker
+
+    def open_staging_tracker(self):
+        """
+        This method returns a new tracker of the products on tape, with a
+        connection of its own to the database of the states (for the
+        download jobs run in a child process)
+        """
+        return S1StagingTracker(os.path.join(self.cfg.raw_directory, ".staging.sqlite"),\
+                                self.get_downloader(), self.get_catalog())
+
+    def get_tile_box(self, tile_name):
+        """
+        This method returns the bounding box of a MGRS tile
+
+        Returns:
+          a tuple (lonmin, latmin, lonmax, latmax)
+        """
+        lonmin, lonmax, latmin, latmax = self.get_mgrs_tile_geometry_by_name(tile_name).GetEnvelope()
+        return lonmin, latmin, lonmax, latmax
+
+    def get_query_boxes(self, tiles):
+        """
+        This method merges the bounding boxes of MGRS tiles into a few
+        catalog query boxes: two boxes are merged as long as their union
+        is not larger than the sum of their areas, so that neighbouring
+        tiles (which overlap) are searched at once without querying large
+        empty areas.
+
+        Args:
+          tiles: list of MGRS tile identifiers
+
+        Returns:
+          a list of ((lonmin, latmin, lonmax, latmax), tiles of the box)
+        """
+        def area(box):
+            return (box[2]-box[0])*(box[3]-box[1])
+
+        boxes = [(self.get_tile_box(tile), [tile]) for tile in tiles]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i+1, len(boxes)):
+                    (box_i, tiles_i), (box_j, tiles_j) = boxes[i], boxes[j]
+                    union = (min(box_i[0], box_j[0]), min(box_i[1], box_j[1]),\
+                             max(box_i[2], box_j[2]), max(box_i[3], box_j[3]))
+                    if area(union) <= area(box_i)+area(box_j):
+                        boxes[i] = (union, tiles_i+tiles_j)
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return boxes
+
+    def plan_downloads(self, tiles):
+        """
+        This method searches the catalog once for all the tiles to
+        process: the tile footprints are merged into a few query boxes, the
+        products found are deduplicated by identifier and assigned to the
+        tiles their footprint intersects. The plan is written to
+        download_manifest.json in raw_directory, then used by
+        get_downloads and download_images instead of one search per tile.
+
+        Args:
+          tiles: list of MGRS tile identifiers
+
+        Returns:
+          dict product -> catalog entry (see S1Catalog.search) with the
+          list of its tiles ("tiles")
+        """
+        catalog = self.get_catalog()
+        footprints = dict((tile, self.get_mgrs_tile_geometry_by_name(tile)) for tile in tiles)
+        boxes = self.get_query_boxes(tiles)
+        products = {}
+        for box, box_tiles in boxes:
+            for product in catalog.search(get_box_query(box)):
+                if product["realtime"]:
+                    continue
+                footprint = None
+                if product["geometry"] is not None:
+                    footprint = ogr.CreateGeometryFromJson(json.dumps(product["geometry"]))
+                product_tiles = [tile for tile in box_tiles if footprint is None\
+                                 or footprint.Intersects(footprints[tile])]
+                if not product_tiles:
+                    continue
+                entry = products.setdefault(product["id"], dict(product, tiles=[]))
+                entry["tiles"] = sorted(set(entry["tiles"]+product_tiles))
+
+        self.download_plan = dict((product["product"], product) for product in products.values())
+        with open(os.path.join(self.cfg.raw_directory, "download_manifest.json"), "w") as manifest:
+            json.dump({"queries": [{"box": box, "tiles": box_tiles} for box, box_tiles in boxes],\
+                       "products": dict((name, dict((key, value) for key, value in product.items()\
+                                                    if key != "geometry"))\
+                                        for name, product in self.download_plan.items())},\
+                      manifest, indent=1, sort_keys=True)
+        print (str(len(self.download_plan))+" products found for "+str(len(tiles))\
+               +" tiles with "+str(len(boxes))+" catalog queries")
+        return self.download_plan
+
+    def get_downloads(self, tile_name):
+        """
+        This method returns the S1 products of a tile which are not
+        available yet, from the plan of plan_downloads if any, otherwise
+        from a catalog search
+
+        Args:
+          tile_name: MGRS tile identifier
+
+        Returns:
+          a list of products, as returned by S1Catalog.search
+        """
+        if self.download_plan is not None:
+            candidates = [product for product in self.download_plan.values()\
+                          if tile_name in product["tiles"]]
+        else:
+            candidates = self.get_catalog().search(get_box_query(self.get_tile_box(tile_name)))
+        downloads = []
+        for product in candidates:
+            product_path = os.path.join(self.cfg.raw_directory, product["product"])
+            if not product["realtime"] and not os.path.exists(product_path+".SAFE")\
+               and not os.path.exists(product_path+".zip"):
+                downloads.append(product)
+        return downloads
+
+    def download_products(self, products):
+        """
+        This method downloads products in process, waiting for the ones
+        on tape to be staged (see S1StagingTracker), then lists the S1
+        images available again
+
+        Args:
+          products: list of products, as returned by S1Catalog.search
+        """
+        tracker = self.get_staging_tracker()
+        tracker.add(products)
+        tracker.run([product["product"] for product in products])
+        tracker.print_statistics()
+        self.get_s1_img()
+
     def unzip_images(self):
-        """This method handles unzipping of product archives"""
-        import zipfile
-        for file_it in os.walk(self.cfg.raw_directory).next()[2]:
-            if ".zip" in file_it:
-                print ("unzipping "+file_it)
-                try:
-                    zip_ref = zipfile.ZipFile(self.cfg.raw_directory+"/"+\
-                                              file_it, 'r')
-                    zip_ref.extractall(self.cfg.raw_directory)
-                    zip_ref.close()
-                except  zipfile.BadZipfile:
-                    print ("WARNING: "+self.cfg.raw_directory+"/"+\
-                        file_it+" is corrupted. This file will be removed")
-                os.remove(self.cfg.raw_directory+"/"+file_it)
+        """
+        This method checks the product archives. They are not extracted:
+        the products are read inside the archives (see get_s1_img) and
+        their images are extracted when an OTB application needs them.
+        """
+        for file_it in os.listdir(self.cfg.raw_directory):
+            if file_it.endswith(".zip"):
+                archive = os.path.join(self.cfg.raw_directory, file_it)
+                if list_archive(archive)[0] is None:
+                    print ("WARNING: "+archive+" is corrupted. This file will be removed")
+                    os.remove(archive)
+
+    def get_polarisations(self):
+        """
+        This method returns the configured polarisations (Polarisation :
+        VV-VH or HH-HV)
+        """
+        polarisations = [pol for pol in self.cfg.polarisation.lower().split("-")\
+                         if pol in ["vv", "vh", "hh", "hv"]]
+        if polarisations == []:
+            polarisations = ["vv", "vh", "hh", "hv"]
+        return polarisations
+
+    def get_polarisation_patterns(self):
+        """
+        This method returns the patterns of the measurement images of the
+        configured polarisations
+        """
+        patterns = {"vv": self.vv_pattern, "vh": self.vh_pattern,\
+                    "hh": self.hh_pattern, "hv": self.hv_pattern}
+        return [patterns[pol] for pol in self.get_polarisations()]
+
+    def get_product_images(self, acquisition, members, archived):
+        """
+        This method adds to a product the images to process: all the
+        images of an extracted product, as before, but only the images of
+        the configured polarisations of an archive, the others being
+        never extracted
+
+        Args:
+          acquisition: the product, as instance of S1DateAcquisition
+          members: paths of the files of the product, relative to its
+            SAFE directory
+          archived: True if the product is read in its archive
+        """
+        safe_dir = acquisition.get_safe_dir()
+        patterns = [self.vv_pattern, self.vh_pattern, self.hh_pattern, self.hv_pattern]
+        if archived:
+            patterns = self.get_polarisation_patterns()
+        for pattern in patterns:
+            images = [os.path.join(safe_dir, f) for f in fnmatch.filter(members, pattern)]
+            if images == []:
+                images = [os.path.join(safe_dir, f.replace("_OrthoReady.tiff",".tiff")) for f in\
+                          fnmatch.filter(members, pattern.replace(".tiff","_OrthoReady.tiff"))]
+            for image in images:
+                if image not in self.processed_filenames:
+                    acquisition.add_image(image)
+                    self.nb_images += 1
+
+    def get_acquisition(self, product):
+        """
+        This method builds a S1 product from the inventory
+
+        Args:
+          product: the product, as returned by S1Inventory.get_products
+
+        Returns:
+          the product as instance of S1DateAcquisition class
+        """
+        safe_name = product["safe_name"]
+        safe_dir = os.path.join(self.cfg.raw_directory, safe_name)
+        acquisition = S1DateAcquisition(os.path.join(safe_dir, self.manifest_pattern),\
+                                        [], product["archive"])
+        if product["archive"] is not None:
+            acquisition.set_metadata_members([safe_name+"/"+member for member in product["members"]\
+                                              if member == self.manifest_pattern\
+                                              or member.startswith("annotation/")])
+        self.get_product_images(acquisition, product["members"],\
+                                product["archive"] is not None)
+        return acquisition
+
+    def add_archive(self, archive):
+        """
+        This method adds a newly downloaded product to the list of S1
+        images available
 
+        Args:
+          archive: the zip archive of the product
+
+        Returns:
+          the product as instance of S1DateAcquisition class, or None if
+          the archive is corrupted
+        """
+        product = self.get_inventory().add(os.path.basename(archive))
+        if product is None:
+            return None
+        acquisition = self.get_acquisition(product)
+        self.raw_raster_list = [raster for raster in self.raw_raster_list\
+                                if raster.get_safe_dir() != acquisition.get_safe_dir()]
+        self.raw_raster_list.append(acquisition)
+        self.rasters[product["safe_name"]] = acquisition
+        return acquisition
 
     def get_s1_img(self):
         """
         This method returns the list of S1 images available
-        (from analysis of raw_directory)
+        (from analysis of raw_directory, see S1Inventory). The products
+        still in their zip archives are listed without being extracted.
 
         Returns:
            the list of S1 images available as instances
            of S1DateAcquisition class
         """
-        import glob
         self.raw_raster_list=[]
+        self.rasters = {}
         if os.path.exists(self.cfg.raw_directory) == False:
             os.makedirs(self.cfg.raw_directory)
             return
-        content = os.listdir(self.cfg.raw_directory)
-        for current_content in content:
-            safe_dir = os.path.join(self.cfg.raw_directory, current_content)
-            if os.path.isdir(safe_dir) == True:
-                manifest = os.path.join(safe_dir, self.manifest_pattern)
-                acquisition = S1DateAcquisition(manifest, [])
-                vv_images = [f for f in\
-                             glob.glob(os.path.join(safe_dir, self.vv_pattern))]
-                if vv_images == []:
-                    vv_images = [f.replace("_OrthoReady.tiff",".tiff") for f in\
-                             glob.glob(os.path.join(safe_dir, self.vv_pattern.replace(".tiff","_OrthoReady.tiff")))]
-                for vv_image in vv_images:
-                    if vv_image not in self.processed_filenames:
-                        acquisition.add_image(vv_image)
-                        self.nb_images += 1
-                vh_images = [f for f in\
-                             glob.glob(os.path.join(safe_dir, self.vh_pattern))]
-                if vh_images == []:
-                    vh_images = [f.replace("_OrthoReady.tiff",".tiff") for f in\
-                             glob.glob(os.path.join(safe_dir, self.vh_pattern.replace(".tiff","_OrthoReady.tiff")))]
-                for vh_image in vh_images:
-                    if vh_image not in self.processed_filenames:
-                        acquisition.add_image(vh_image)
-                        self.nb_images += 1
-                hh_images = [f for f in\
-                             glob.glob(os.path.join(safe_dir, self.hh_pattern))]
-                if hh_images == []:
-                    hh_images = [f.replace("_OrthoReady.tiff",".tiff") for f in\
-                             glob.glob(os.path.join(safe_dir, self.hh_pattern.replace(".tiff","_OrthoReady.tiff")))]
-                for hh_image in hh_images:
-                    if hh_image not in self.processed_filenames:
-                        acquisition.add_image(hh_image)
-                        self.nb_images += 1
-                hv_images = [f for f in\
-                             glob.glob(os.path.join(safe_dir, self.hv_pattern))]
-                if hv_images == []:
-                    hv_images = [f.replace("_OrthoReady.tiff",".tiff") for f in\
-                             glob.glob(os.path.join(safe_dir, self.hv_pattern.replace(".tiff","_OrthoReady.tiff")))]
-                for hv_image in hv_images:
-                    if hv_image not in self.processed_filenames:
-                        acquisition.add_image(hv_image)
-                        self.nb_images += 1
-
-                self.raw_raster_list.append(acquisition)
-        
+        for product in self.get_inventory().scan():
+            acquisition = self.get_acquisition(product)
+            self.raw_raster_list.append(acquisition)
+            self.rasters[product["safe_name"]] = acquisition
+
+    def get_inventory(self):
+        """ This method returns the inventory of raw_directory (see S1Inventory)"""
+        if self.inventory is None:
+            self.inventory = S1Inventory(self.cfg.raw_directory)
+        return self.inventory
+
+    def get_rasters(self, date=None, orbit=None):
+        """
+        This method returns the S1 products available, selected through
+        the indexes of the inventory: the archives without images of the
+        configured polarisations are not opened by the tile selection
+        (the extracted products are processed in all their polarisations,
+        see get_product_images).
+
+        Args:
+          date: acquisition date (YYYYMMDD)
+          orbit: relative orbit
+
+        Returns:
+          the list of products as instances of S1DateAcquisition class
+        """
+        inventory = self.get_inventory()
+        selected = set(product["safe_name"] for product in\
+                       inventory.get_products(self.get_polarisations(), date, orbit))
+        return [self.rasters[product["safe_name"]] for product in\
+                inventory.get_products(date=date, orbit=orbit)\
+                if product["safe_name"] in self.rasters\
+                and (product["archive"] is None or product["safe_name"] in selected)]
+
     def tile_exists(self, tile_name_field):
         """
         This method check if a given MGRS tiles exists in the database
@@ -257,7 +514,7 @@ class S1FileManager(object):
         layer = data_source.GetLayer()
 
         #Loop on images
-        for image in self.raw_raster_list:
+        for image in self.get_rasters():
             manifest = image.get_manifest()
             nw_coord, ne_coord, se_coord, sw_coord = get_origin(manifest)
 
@@ -280,12 +537,14 @@ class S1FileManager(object):
                         tiles.append(tile_name)
         return tiles
 
-    def get_s1_intersect_by_tile(self, tile_name_field):
+    def get_s1_intersect_by_tile(self, tile_name_field, raster_list=None):
         """
         This method return the list of S1 product intersecting a given MGRS tile
 
         Args:
           tile_name_field: The MGRS tile identifier
+          raster_list: the S1 products to consider (default: all the
+            products available)
 
         Returns:
           A list of tuple (image as instance of
@@ -307,7 +566,7 @@ class S1FileManager(object):
         poly = ogr.Geometry(ogr.wkbPolygon)
         tile_footprint = current_tile.GetGeometryRef()
 
-        for image in self.raw_raster_list:
+        for image in (self.get_rasters() if raster_list is None else raster_list):
             manifest = image.get_manifest()
             nw_coord, ne_coord, se_coord, sw_coord = get_origin(manifest)
 
@@ -397,9 +656,9 @@ class S1FileManager(object):
         try:
             with open(os.path.join(self.cfg.output_preprocess,\
                                    "processed_filenames.txt"), "r") as in_file:
-                return in_file.read().splitlines()
+                return set(in_file.read().splitlines())
         except (IOError, OSError):
-            return []
+            return set()
 
     def get_raster_list(self):
         """
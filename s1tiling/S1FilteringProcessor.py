@@ -19,14 +19,16 @@
 
 """ This module contains the multitemporal speckle filtering processor """
 
-import glob, os, joblib, time
-from subprocess import Popen
+import glob, os, joblib
 import pickle
 from osgeo import gdal, gdalconst
+from s1tiling.S1JobScheduler import S1JobScheduler
 
 class S1FilteringProcessor():
-    def __init__(self,cfg):
+    def __init__(self,cfg,state):
         self.Cg_Cfg=cfg
+        self.scheduler=S1JobScheduler(cfg)
+        self.state=state
 
     def process(self,tile):
         """Main function for speckle filtering script"""
@@ -53,17 +55,19 @@ class S1FilteringProcessor():
                 continue
             filelist_s1basc = filelist_s1basc+" "+file_it
     
-        if self.Cg_Cfg.Reset_outcore:
-            processed_files = []
-            try:
-                os.remove(os.path.join(directory,"outcore.txt"))
-            except:
-                pass
-        else:
+        # Files recorded by previous versions are moved to the state database
+        if os.path.exists(os.path.join(directory,"outcore.txt")):
             try:
-                processed_files = joblib.load(os.path.join(directory, "outcore.txt"))
+                if not self.Cg_Cfg.Reset_outcore:
+                    for file_it in joblib.load(os.path.join(directory, "outcore.txt")):
+                        self.state.record(os.path.basename(file_it), "", tile.upper(), "outcore", file_it)
             except pickle.PickleError:
-                processed_files = []
+                pass
+            os.remove(os.path.join(directory,"outcore.txt"))
+
+        if self.Cg_Cfg.Reset_outcore:
+            self.state.forget(tile.upper(), "outcore")
+        processed_files = self.state.get_outputs(tile.upper(), "outcore")
 
         filelist_s1ades_updateoutcore = filelist_s1ades
         filelist_s1aasc_updateoutcore = filelist_s1aasc
@@ -76,133 +80,123 @@ class S1FilteringProcessor():
             filelist_s1bdes_updateoutcore = filelist_s1bdes_updateoutcore.replace(file_it, "")
             filelist_s1basc_updateoutcore = filelist_s1basc_updateoutcore.replace(file_it, "")
 
-        pids = []
+        outcore_threads, _ = self.Cg_Cfg.tuning.get("Compute outcore")
+        cmd_list = []
+        outcore_files = {}
         if filelist_s1ades_updateoutcore.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(outcore_threads)\
                       +"otbcli_MultitempFilteringOutcore -progress false -inl"\
                       +filelist_s1ades_updateoutcore+" -oc "\
                       +os.path.join(directory, "outcore_S1aDES.tif")\
                       +" -wr {}".format(self.Cg_Cfg.Window_radius)
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile, stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            outcore_files[command] = filelist_s1ades_updateoutcore.split()
 
         if filelist_s1aasc_updateoutcore.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(outcore_threads)\
                       +"otbcli_MultitempFilteringOutcore -progress false -inl"\
                       +filelist_s1aasc_updateoutcore+" -oc "\
                       +os.path.join(directory, "outcore_S1aASC.tif")\
                       +" -wr "+str(self.Cg_Cfg.Window_radius)
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile, stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            outcore_files[command] = filelist_s1aasc_updateoutcore.split()
 
         if filelist_s1bdes_updateoutcore.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(outcore_threads)\
                       +"otbcli_MultitempFilteringOutcore -progress false -inl"\
                       +filelist_s1bdes_updateoutcore+" -oc "\
                       +os.path.join(directory, "outcore_S1bDES.tif")\
                       +" -wr "+str(self.Cg_Cfg.Window_radius)
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile, stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            outcore_files[command] = filelist_s1bdes_updateoutcore.split()
 
         if filelist_s1basc_updateoutcore.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(outcore_threads)\
                       +"otbcli_MultitempFilteringOutcore -progress false -inl"\
                       +filelist_s1basc_updateoutcore+" -oc "\
                       +os.path.join(directory, "outcore_S1bASC.tif")\
                       +" -wr "+str(self.Cg_Cfg.Window_radius)
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile, stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            outcore_files[command] = filelist_s1basc_updateoutcore.split()
 
         try:
             os.makedirs(os.path.join(directory, "filtered"))
         except os.error:
             pass
 
-        title="Compute outcore"
-        nb_cmd=len(pids)
-        print (title+"... 0%")
-        while len(pids) > 0:
-
-            for i, pid in enumerate(pids):
-                status = pid[0].poll()
-                if status is not None and status != 0:
-                   print ("Error in pid #"+str(i)+" id="+str(pid[0]))
-                   print (pid[1])
-                   del pids[i]
-                   break
-
-                if status == 0:
-                   del pids[i]
-                   print (title+"... "+str(int((nb_cmd-len(pids))*100./nb_cmd))+"%")
-                   time.sleep(0.2)
-                   break
-
-        processed_files = processed_files+filelist_s1ades_updateoutcore.split()\
-                     +filelist_s1aasc_updateoutcore.split()\
-                     +filelist_s1bdes_updateoutcore.split()\
-                     +filelist_s1basc_updateoutcore.split()
-
-        joblib.dump(processed_files, os.path.join(directory, "outcore.txt"))
-        # pickle.dump(processed_files, open(os.path.join(directory,"outcore.txt"), 'w'))
-        pids = []
+        failed = self.scheduler.run([self.scheduler.new_job(command, "Compute outcore", tile=tile.upper())\
+                                     for command in cmd_list], title="Compute outcore")
+
+        # Only the files integrated into an outcore are recorded
+        failed_commands = [job.cmd for job in failed]
+        for command, files in outcore_files.items():
+            if command not in failed_commands:
+                for file_it in files:
+                    self.state.record(os.path.basename(file_it), "", tile.upper(), "outcore", file_it)
+        filtering_threads, _ = self.Cg_Cfg.tuning.get("Compute filtered images")
+        cmd_list = []
+        filtered_files = {}
         if filelist_s1ades.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(filtering_threads)\
                       +"otbcli_MultitempFilteringFilter -progress false -inl"\
                       +filelist_s1ades+" -oc "\
                       +os.path.join(directory,"outcore_S1aDES.tif")\
                       +" -wr "+str(self.Cg_Cfg.Window_radius)+" -enl "\
                       +os.path.join(directory,"filtered","enl_S1aDES.tif")
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile, stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            filtered_files[command] = filelist_s1ades.split()
 
         if filelist_s1aasc.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(filtering_threads)\
                   +"otbcli_MultitempFilteringFilter -progress false -inl"\
                   +filelist_s1aasc+" -oc "\
                   +os.path.join(directory,"outcore_S1aASC.tif")\
                   +" -wr "+str(self.Cg_Cfg.Window_radius)+" -enl "\
                   +os.path.join(directory,"filtered","enl_S1aASC.tif")
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile,\
-                          stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            filtered_files[command] = filelist_s1aasc.split()
 
         if filelist_s1bdes.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(filtering_threads)\
                   +"otbcli_MultitempFilteringFilter -progress false -inl"\
                   +filelist_s1bdes+" -oc "\
                   +os.path.join(directory,"outcore_S1bDES.tif")\
                   +" -wr "+str(self.Cg_Cfg.Window_radius)+" -enl "\
                   +os.path.join(directory,"filtered","enl_S1bDES.tif")
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile,\
-                          stderr=self.Cg_Cfg.stderrfile, shell=True),command])
+            cmd_list.append(command)
+            filtered_files[command] = filelist_s1bdes.split()
 
         if filelist_s1basc.strip() is not "":
-            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(self.Cg_Cfg.OTBThreads)\
+            command = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={};'.format(filtering_threads)\
                   +"otbcli_MultitempFilteringFilter -progress false -inl"\
                   +filelist_s1basc+" -oc "\
                   +os.path.join(directory,"outcore_S1bASC.tif")\
                   +" -wr "+str(self.Cg_Cfg.Window_radius)+" -enl "\
                   +os.path.join(directory,"filtered","enl_S1bASC.tif")
-            pids.append([Popen(command, stdout=self.Cg_Cfg.stdoutfile,\
-                          stderr=self.Cg_Cfg.stderrfile, shell=True),command])
-
-        title="Compute filtered images"
-        nb_cmd=len(pids)
-        print (title+"... 0%")
-        while len(pids) > 0:
-
-            for i, pid in enumerate(pids):
-                status = pid[0].poll()
-                if status is not None and status != 0:
-                    print ("Error in pid #"+str(i)+" id="+str(pid[0]))
-                    print (pid[1])
-                    del pids[i]
-                    break
-
-                if status == 0:
-                    del pids[i]
-                    print (title+"... "+str(int((nb_cmd-len(pids))*100./nb_cmd))+"%")
-                    time.sleep(0.2)
-                    break
-
-        filtering_directory = os.path.join(directory,'filtered/')
-        for f in os.listdir(filtering_directory):
-            fullpath = os.path.join(filtering_directory, f)
-            if os.path.isfile(fullpath) and f.startswith('s1') and f.endswith('filtered.tif'):
-                dst = gdal.Open(fullpath, gdal.GA_Update)
-                dst.SetMetadataItem('FILTERED', 'true')
-                dst.SetMetadataItem('FILTERING_WINDOW_RADIUS', str(self.Cg_Cfg.Window_radius))
+            cmd_list.append(command)
+            filtered_files[command] = filelist_s1basc.split()
+
+        failed = self.scheduler.run([self.scheduler.new_job(command, "Compute filtered images", tile=tile.upper())\
+                                     for command in cmd_list], title="Compute filtered images")
+
+        # Only the images written by the filtering commands are tagged
+        failed_commands = [job.cmd for job in failed]
+        for command, files in filtered_files.items():
+            if command not in failed_commands:
+                for file_it in files:
+                    self.write_filtered_metadata(os.path.join(directory, "filtered",\
+                        os.path.basename(file_it).replace(".tif", "_filtered.tif")))
+
+    def write_filtered_metadata(self, filtered_image):
+        """
+        Write the metadata of a filtered image
+
+        Args:
+          filtered_image: the filtered image
+        """
+        if not os.path.isfile(filtered_image):
+            return
+        dst = gdal.Open(filtered_image, gdal.GA_Update)
+        dst.SetMetadataItem('FILTERED', 'true')
+        dst.SetMetadataItem('FILTERING_WINDOW_RADIUS', str(self.Cg_Cfg.Window_radius))
+        dst = None
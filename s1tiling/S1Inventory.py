@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1Inventory class"""
+
+import os
+import json
+
+from s1tiling.S1Archive import list_archive
+
+# Index file, in the directory of the products
+INVENTORY_FILE = ".inventory.json"
+INVENTORY_VERSION = 1
+
+# First absolute orbit of the relative orbit 1, per platform
+ORBIT_OFFSETS = {"S1A": 73, "S1B": 27}
+
+
+def get_polarisation_from_image(member):
+    """ Returns the polarisation of a measurement image from its name"""
+    return member.split("/")[-1].split("-")[3]
+
+
+def get_date_from_product(safe_name):
+    """ Returns the acquisition date (YYYYMMDD) of a product from its name"""
+    return safe_name.split("_")[4][:8]
+
+
+def get_relative_orbit_from_product(safe_name):
+    """
+    Returns the relative orbit of a product from its name (absolute orbit
+    and platform), or None if it can not be computed
+    """
+    fields = safe_name.split("_")
+    if fields[0] not in ORBIT_OFFSETS:
+        return None
+    return (int(fields[6])-ORBIT_OFFSETS[fields[0]]) % 175+1
+
+def list_measurement(safe_dir):
+    """ Returns the images of the measurement directory of a SAFE directory"""
+    try:
+        with os.scandir(os.path.join(safe_dir, "measurement")) as entries:
+            return ["measurement/"+entry.name for entry in entries if entry.name.endswith(".tiff")]
+    except OSError:
+        return []
+
+
+def get_mtime(path):
+    """ Returns the modification time of a path in ns, or None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class S1Inventory(object):
+    """
+    This class lists the S1 products of a directory (zip archives and
+    SAFE directories) in a single pass, and keeps what it found in an
+    index file with the size and modification time of each archive and
+    of each measurement directory: a product whose fingerprint has not
+    changed is not listed again. The products are indexed by
+    polarisation, acquisition date and relative orbit.
+    """
+    def __init__(self, directory):
+        """
+        Args:
+          directory: the directory of the products (S1Images)
+        """
+        self.directory = directory
+        self.index_file = os.path.join(directory, INVENTORY_FILE)
+        self.entries = self.read()
+        self.products = {}
+        self.sorted_products = []
+        self.by_polarisation = {}
+        self.by_date = {}
+        self.by_orbit = {}
+
+    def read(self):
+        """ Returns the entries of the index file (name -> entry)"""
+        try:
+            with open(self.index_file, "r") as in_file:
+                index = json.load(in_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        if index.get("version") != INVENTORY_VERSION:
+            return {}
+        return index["entries"]
+
+    def write(self):
+        """ Write the index file"""
+        tmp_file = self.index_file+".tmp"+str(os.getpid())
+        with open(tmp_file, "w") as out_file:
+            json.dump({"version": INVENTORY_VERSION, "entries": self.entries}, out_file)
+        os.replace(tmp_file, self.index_file)
+
+    def get_fingerprint(self, name, stat):
+        """
+        Returns the fingerprint of an entry of the directory
+
+        Args:
+          name: the name of the archive or SAFE directory
+          stat: its os.stat result
+        """
+        if name.endswith(".zip"):
+            # The intermediate files are written in the SAFE directory
+            safe_dir = os.path.join(self.directory, name[:-4]+".SAFE")
+            return [stat.st_size, stat.st_mtime_ns, get_mtime(os.path.join(safe_dir, "measurement"))]
+        return [get_mtime(os.path.join(self.directory, name, "measurement"))]
+
+    def list_entry(self, name, fingerprint):
+        """
+        List the files of an archive or a SAFE directory
+
+        Returns:
+          the entry: fingerprint, SAFE directory name (None if the archive
+          is corrupted), archive name (or None) and files of the product
+          (manifest, annotations and images) relative to its SAFE directory
+        """
+        entry = {"fingerprint": fingerprint, "safe_name": name, "archive": None, "members": []}
+        if name.endswith(".zip"):
+            safe_name, members = list_archive(os.path.join(self.directory, name))
+            entry["archive"] = name
+            entry["safe_name"] = safe_name
+            if safe_name is None:
+                return entry
+            members = [member[len(safe_name)+1:] for member in members]
+            entry["members"] = [member for member in members if member == "manifest.safe"\
+                                or (member.startswith("annotation/") and member.endswith(".xml"))\
+                                or (member.startswith("measurement/") and member.endswith(".tiff"))]
+            entry["members"] += [member for member in list_measurement(os.path.join(self.directory,\
+                                                                                    safe_name))\
+                                 if member.endswith("_OrthoReady.tiff")]
+        else:
+            entry["members"] = list_measurement(os.path.join(self.directory, name))
+        return entry
+
+    def scan(self):
+        """
+        List the products of the directory, listing again only the
+        archives and SAFE directories which changed since the index file
+        was written.
+
+        Returns:
+          the list of the products, see get_products
+        """
+        entries = {}
+        changed = False
+        with os.scandir(self.directory) as directory_entries:
+            for directory_entry in directory_entries:
+                name = directory_entry.name
+                # Products being downloaded or extracted are hidden
+                if name.startswith("."):
+                    continue
+                if name.endswith(".zip"):
+                    if not directory_entry.is_file():
+                        continue
+                elif not directory_entry.is_dir():
+                    continue
+                fingerprint = self.get_fingerprint(name, directory_entry.stat())
+                entry = self.entries.get(name)
+                if entry is None or entry["fingerprint"] != fingerprint:
+                    entry = self.list_entry(name, fingerprint)
+                    changed = True
+                entries[name] = entry
+        if changed or len(entries) != len(self.entries):
+            self.entries = entries
+            self.write()
+        self.build_index()
+        return self.get_products()
+
+    def add(self, name):
+        """
+        List a new archive or SAFE directory of the directory
+
+        Args:
+          name: the name of the archive or SAFE directory
+
+        Returns:
+          the product (see get_products), or None if the archive is
+          corrupted
+        """
+        path = os.path.join(self.directory, name)
+        entry = self.list_entry(name, self.get_fingerprint(name, os.stat(path)))
+        self.entries[name] = entry
+        self.write()
+        self.build_index()
+        return self.products.get(entry["safe_name"])
+
+    def build_index(self):
+        """
+        Build the products from the entries (an archive hides the SAFE
+        directory extracted from it), their sorted list and their indexes
+        """
+        self.products = {}
+        for name, entry in sorted(self.entries.items()):
+            safe_name = entry["safe_name"]
+            if safe_name is None:
+                continue
+            if entry["archive"] is None and safe_name in self.products:
+                continue
+            self.products[safe_name] = {"safe_name": safe_name,\
+                                        "archive": os.path.join(self.directory, entry["archive"])\
+                                        if entry["archive"] is not None else None,\
+                                        "members": entry["members"]}
+        self.sorted_products = [self.products[name] for name in sorted(self.products)]
+        self.by_polarisation = {}
+        self.by_date = {}
+        self.by_orbit = {}
+        for safe_name, product in self.products.items():
+            for member in product["members"]:
+                if member.startswith("measurement/"):
+                    try:
+                        polarisation = get_polarisation_from_image(member)
+                    except IndexError:
+                        # Not named like a S1 image
+                        continue
+                    self.by_polarisation.setdefault(polarisation, set()).add(safe_name)
+            try:
+                self.by_date.setdefault(get_date_from_product(safe_name), set()).add(safe_name)
+                self.by_orbit.setdefault(get_relative_orbit_from_product(safe_name), set())\
+                             .add(safe_name)
+            except (IndexError, ValueError):
+                # Not named like a S1 product
+                pass
+
+    def get_products(self, polarisations=None, date=None, orbit=None):
+        """
+        Returns the products, possibly selected by polarisation,
+        acquisition date and relative orbit. The selection is read from
+        the indexes, only the selected products are sorted.
+
+        Args:
+          polarisations: list of polarisations ("vv", "vh", "hh" or "hv"):
+            the products with an image of one of them are selected
+          date: acquisition date (YYYYMMDD)
+          orbit: relative orbit
+
+        Returns:
+          a list of dict, sorted by name, with the name of the SAFE
+          directory ("safe_name"), the path of the archive ("archive", or
+          None) and the files of the product relative to its SAFE
+          directory ("members")
+        """
+        selections = []
+        if polarisations is not None:
+            selections.append(set().union(*[self.by_polarisation.get(polarisation, set())\
+                                            for polarisation in polarisations]))
+        if date is not None:
+            selections.append(self.by_date.get(date, set()))
+        if orbit is not None:
+            selections.append(self.by_orbit.get(orbit, set()))
+        if not selections:
+            return self.sorted_products
+        names = set.intersection(*selections)
+        return [self.products[name] for name in sorted(names)]
@@ -0,0 +1,554 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the resource-aware job scheduler"""
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import selectors
+import traceback
+from collections import defaultdict
+from subprocess import Popen
+
+# Identifier of this run in the job traces
+RUN_ID = "{}:{}:{}".format(socket.gethostname(), os.getpid(), int(time.time()))
+
+
+def read_first_line(path):
+    """ Returns the first line of a file, or None if it can not be read"""
+    try:
+        with open(path, "r") as in_file:
+            return in_file.readline().strip()
+    except (IOError, OSError):
+        return None
+
+def get_cgroup_cpus():
+    """
+    Returns the CPU quota of the cgroup of this process (in cores), or
+    None if there is no quota.
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    line = read_first_line("/sys/fs/cgroup/cpu.max")
+    if line is not None:
+        quota, period = line.split()
+        if quota == "max":
+            return None
+        return float(quota)/float(period)
+    # cgroup v1
+    quota = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return float(quota)/float(period)
+
+def get_nb_cpus():
+    """
+    Returns the number of cores this process is allowed to run on,
+    taking the cgroup CPU quota into account.
+    """
+    try:
+        nb_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        nb_cpus = os.cpu_count() or 1
+    quota = get_cgroup_cpus()
+    if quota is not None:
+        nb_cpus = min(nb_cpus, max(1, int(quota)))
+    return nb_cpus
+
+def get_cgroup_available_ram():
+    """
+    Returns the memory left under the memory limit of the cgroup of this
+    process in MB, or None if there is no limit.
+    """
+    for limit_file, usage_file in [("/sys/fs/cgroup/memory.max",\
+                                    "/sys/fs/cgroup/memory.current"),\
+                                   ("/sys/fs/cgroup/memory/memory.limit_in_bytes",\
+                                    "/sys/fs/cgroup/memory/memory.usage_in_bytes")]:
+        limit = read_first_line(limit_file)
+        usage = read_first_line(usage_file)
+        if limit is None or usage is None:
+            continue
+        # No limit: "max" (v2) or a huge number (v1)
+        if limit == "max" or int(limit) >= 2**60:
+            return None
+        return max(0, int(limit)-int(usage)) // (1024*1024)
+    return None
+
+def read_process_io(pid):
+    """
+    Returns the bytes read and written by a process (and the children it
+    has waited for), from /proc/<pid>/io, or None if not available.
+    """
+    try:
+        with open("/proc/"+str(pid)+"/io", "r") as proc_io:
+            counters = dict(line.split(": ") for line in proc_io.read().splitlines())
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+def get_available_ram():
+    """
+    Returns the memory available on the host, in MB, taking the cgroup
+    memory limit into account.
+    """
+    available = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024*1024)
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError):
+        pass
+    cgroup_available = get_cgroup_available_ram()
+    if cgroup_available is not None:
+        available = min(available, cgroup_available)
+    return available
+
+
+class S1Job(object):
+    """This class handles one step to be run by the S1JobScheduler"""
+    def __init__(self, cmd=None, nb_threads=1, ram=0, stage="",\
+                 func=None, dependencies=None, fork=False, on_success=None,\
+                 tile="", product="", not_before=0.):
+        """
+        Args:
+          cmd: the shell command to run
+          nb_threads: number of cores the command is expected to use
+          ram: memory the command is expected to use, in MB
+          stage: name of the processing stage (for reporting)
+          func: python callable to run instead of a shell command
+          dependencies: list of S1Job that must succeed before this one starts
+          fork: if True, func is run in a child process and accounted for
+            like a command, otherwise it is run by the orchestrator
+          on_success: python callable run by the orchestrator once the
+            job has succeeded, before its dependents start
+          tile: MGRS tile the job works on (for profiling)
+          product: S1 product the job works on (for profiling)
+          not_before: time before which the job is not started (next poll
+            of a product being staged for instance)
+        """
+        self.cmd = cmd
+        self.func = func
+        self.fork = fork
+        self.on_success = on_success
+        self.pid = None
+        self.nb_threads = nb_threads
+        self.ram = ram
+        self.stage = stage
+        self.dependencies = dependencies if dependencies is not None else []
+        self.process = None
+        self.returncode = None
+        self.cancelled = False
+        self.start_time = None
+        self.end_time = None
+        self.tile = tile
+        self.product = product
+        self.not_before = not_before
+        # Resources used, filled in when the job finishes
+        self.user_time = 0.
+        self.sys_time = 0.
+        self.max_rss = None
+        self.read_bytes = None
+        self.write_bytes = None
+
+    def succeeded(self):
+        """ Returns True if the job has run and exited with status 0"""
+        return self.returncode == 0
+
+    def finished(self):
+        """ Returns True if the job will not run anymore"""
+        return self.returncode is not None or self.cancelled
+
+    def is_ready(self):
+        """ Returns True if all the dependencies of the job have succeeded"""
+        return all(dep.succeeded() for dep in self.dependencies)
+
+    def is_doomed(self):
+        """ Returns True if a dependency of the job has failed"""
+        return any(dep.finished() and not dep.succeeded()\
+                   for dep in self.dependencies)
+
+    def duration(self):
+        """ Returns the wall time of the job in seconds"""
+        if self.start_time is None or self.end_time is None:
+            return 0.
+        return self.end_time - self.start_time
+
+    def get_record(self):
+        """ Returns the profiling record of the job, as a dict"""
+        return {"run": RUN_ID, "stage": self.stage, "tile": self.tile,\
+                "product": self.product, "command": str(self),\
+                "returncode": self.returncode, "cancelled": self.cancelled,\
+                "nb_threads": self.nb_threads, "ram": self.ram,\
+                "start": self.start_time, "wall": self.duration(),\
+                "user": self.user_time, "sys": self.sys_time,\
+                "max_rss": self.max_rss, "read_bytes": self.read_bytes,\
+                "write_bytes": self.write_bytes}
+
+    def __str__(self):
+        if self.cmd is not None:
+            return self.cmd
+        return self.stage+": "+getattr(self.func, "__name__", str(self.func))
+
+
+class S1JobScheduler(object):
+    """
+    This class runs commands in parallel. Jobs are admitted as long as
+    their declared cost (threads and RAM) fits into the CPU and memory
+    budgets of the host, and the scheduler sleeps until a child exits
+    instead of polling them.
+
+    The jobs of a pooled stage (downloads) wait on the network, not on the
+    host: they are only limited by the size of their pool, and neither
+    count against NbParallelProcesses nor use the CPU and RAM budgets.
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.max_jobs = cfg.nb_procs
+        # Maximum number of jobs of a stage running at once (I/O bound stages)
+        self.stage_limits = {"Extraction": cfg.nb_extractions}
+        # Stages run in their own pool, besides the processing jobs
+        self.pools = {"Download": cfg.nb_downloads}
+        self.cpu_budget = cfg.cpu_budget if cfg.cpu_budget > 0 else get_nb_cpus()
+        self.ram_budget = cfg.ram_budget if cfg.ram_budget > 0 else get_available_ram()
+        self.use_pidfd = hasattr(os, "pidfd_open")
+        self.trace_file = cfg.trace_file
+        if self.trace_file and os.path.dirname(self.trace_file) != ""\
+           and not os.path.exists(os.path.dirname(self.trace_file)):
+            os.makedirs(os.path.dirname(self.trace_file), exist_ok=True)
+        self.running = {}
+        self.submitted = []
+        self.used_cpu = 0
+        self.used_ram = 0
+
+    def new_job(self, cmd, stage="", dependencies=None, tile="", product=""):
+        """
+        Build a job with the OTB cost of its stage (see S1AutoTuning)
+
+        Args:
+          cmd: the shell command to run
+          stage: name of the processing stage
+          dependencies: list of S1Job that must succeed first
+          tile: MGRS tile the job works on
+          product: S1 product the job works on
+
+        Returns:
+          a S1Job instance
+        """
+        nb_threads, ram = self.cfg.tuning.get(stage)
+        return S1Job(cmd, nb_threads=nb_threads, ram=ram, stage=stage,\
+                     dependencies=dependencies, tile=tile, product=product)
+
+    def submit(self, job_list):
+        """
+        Add jobs to the run in progress, for instance from the on_success
+        hook of a job whose outputs tell what to do next.
+
+        Args:
+          job_list: list of S1Job
+        """
+        self.submitted += job_list
+
+    def _is_pooled(self, job):
+        """ Tells whether a job runs in the pool of its stage"""
+        return job.stage in self.pools
+
+    def _count_running(self, stage):
+        """ Returns the number of running jobs of a stage"""
+        return sum(1 for running in self.running.values() if running.stage == stage)
+
+    def _fits(self, job):
+        """ Tells whether a job can be launched now"""
+        if self._is_pooled(job):
+            return self._count_running(job.stage) < max(1, self.pools[job.stage])
+        nb_running = sum(1 for running in self.running.values() if not self._is_pooled(running))
+        if nb_running == 0:
+            # Always launch at least one job, even if it exceeds the budgets
+            return True
+        if job.stage in self.stage_limits\
+           and self._count_running(job.stage) >= self.stage_limits[job.stage]:
+            return False
+        return nb_running < self.max_jobs\
+            and self.used_cpu + job.nb_threads <= self.cpu_budget\
+            and self.used_ram + job.ram <= self.ram_budget
+
+    def _launch(self, job):
+        job.start_time = time.time()
+        if job.func is not None:
+            sys.stdout.flush()
+            job.pid = os.fork()
+            if job.pid == 0:
+                # Child process: run the python step and exit
+                status = 0
+                try:
+                    job.func()
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(status)
+        else:
+            job.process = Popen(job.cmd, stdout=self.cfg.stdoutfile,\
+                                stderr=self.cfg.stderrfile, shell=True)
+            job.pid = job.process.pid
+        self.running[job.pid] = job
+        if not self._is_pooled(job):
+            self.used_cpu += job.nb_threads
+            self.used_ram += job.ram
+
+    def _reap(self, pid, flags=0):
+        """
+        Collect the exit status of a child.
+
+        Returns:
+          the finished job, or None if the child is still running
+        """
+        if flags & os.WNOHANG:
+            # Check that the child has exited without reaping it yet
+            if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+                return None
+        # The I/O counters disappear once the child is reaped
+        process_io = read_process_io(pid)
+        _, status, rusage = os.wait4(pid, 0)
+        job = self.running.pop(pid)
+        job.end_time = time.time()
+        job.returncode = os.waitstatus_to_exitcode(status)
+        job.user_time = rusage.ru_utime
+        job.sys_time = rusage.ru_stime
+        job.max_rss = rusage.ru_maxrss
+        if process_io is not None:
+            job.read_bytes, job.write_bytes = process_io
+        if job.process is not None:
+            job.process.returncode = job.returncode
+        if not self._is_pooled(job):
+            self.used_cpu -= job.nb_threads
+            self.used_ram -= job.ram
+        self._complete(job)
+        return job
+
+    def _wait_for_exits(self, timeout=None):
+        """
+        Block until at least one running child exits, or until the timeout.
+
+        Args:
+          timeout: longest wait in seconds (None: no limit)
+
+        Returns:
+          the list of finished jobs
+        """
+        deadline = time.time()+timeout if timeout is not None else None
+        if self.use_pidfd:
+            finished = []
+            with selectors.DefaultSelector() as selector:
+                pidfds = []
+                try:
+                    for pid in self.running:
+                        pidfd = os.pidfd_open(pid)
+                        pidfds.append(pidfd)
+                        selector.register(pidfd, selectors.EVENT_READ, pid)
+                    for key, _ in selector.select(timeout):
+                        finished.append(self._reap(key.data))
+                except OSError:
+                    # pidfd_open is not supported by the running kernel
+                    self.use_pidfd = False
+                finally:
+                    for pidfd in pidfds:
+                        os.close(pidfd)
+            if self.use_pidfd:
+                return finished
+
+        # No pidfd support: sweep all children without blocking
+        while True:
+            finished = [self._reap(pid, os.WNOHANG) for pid in list(self.running)]
+            finished = [job for job in finished if job is not None]
+            if finished or (deadline is not None and time.time() >= deadline):
+                return finished
+            time.sleep(0.1)
+
+    def _complete(self, job):
+        """ Run the success hook of a finished job"""
+        if job.succeeded() and job.on_success is not None:
+            try:
+                job.on_success()
+            except Exception as e:
+                print ("ERROR: "+str(job)+": "+str(e))
+                job.returncode = 1
+
+    def _run_inline(self, job):
+        """ Run a python step in the orchestrator process"""
+        job.start_time = time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            job.func()
+            job.returncode = 0
+        except Exception as e:
+            print ("ERROR: "+str(job)+": "+str(e))
+            job.returncode = 1
+        job.end_time = time.time()
+        job.user_time = resource.getrusage(resource.RUSAGE_SELF).ru_utime-usage.ru_utime
+        job.sys_time = resource.getrusage(resource.RUSAGE_SELF).ru_stime-usage.ru_stime
+        self._complete(job)
+
+    def _trace(self, jobs):
+        """ Append the profiling records of finished jobs to the trace file"""
+        if not self.trace_file or len(jobs) == 0:
+            return
+        with open(self.trace_file, "a") as trace:
+            for job in jobs:
+                trace.write(json.dumps(job.get_record())+"\n")
+
+    def _admit(self, pending):
+        """
+        Launch all the pending jobs that are ready and fit in the budgets.
+        Jobs are considered in submission order, so that a product moves
+        on to its next step before new products are started, the
+        processing jobs ahead of the queued pooled jobs.
+
+        Returns:
+          the list of jobs that finished without being launched (inline
+          python steps and cancelled jobs)
+        """
+        finished = []
+        progress = True
+        while progress:
+            progress = False
+            for job in sorted(pending, key=self._is_pooled):
+                if job.is_doomed():
+                    job.cancelled = True
+                elif not job.is_ready() or job.not_before > time.time():
+                    continue
+                elif job.func is not None and not job.fork:
+                    self._run_inline(job)
+                elif self._fits(job):
+                    self._launch(job)
+                    pending.remove(job)
+                    continue
+                else:
+                    continue
+                pending.remove(job)
+                finished.append(job)
+                progress = True
+        return finished
+
+    def run(self, job_list, title="", on_complete=None):
+        """
+        Run a list of jobs and wait for all of them to finish. Each job
+        starts as soon as its own dependencies have succeeded; the
+        dependents of a failed job are cancelled.
+
+        Args:
+          job_list: list of S1Job (or shell commands) to run
+          title: optional title for progress information
+          on_complete: optional callback called with each finished job
+
+        Returns:
+          the list of jobs that failed or were cancelled
+        """
+        pending = [job if isinstance(job, S1Job) else self.new_job(job, title)\
+                   for job in job_list]
+        nb_jobs = len(pending)
+        nb_done = 0
+        failed = []
+
+        while len(pending) > 0 or len(self.running) > 0 or len(self.submitted) > 0:
+            pending += self.submitted
+            nb_jobs += len(self.submitted)
+            self.submitted = []
+            finished = self._admit(pending)
+            # Jobs ready but delayed wake the scheduler up at their time
+            delayed = [job.not_before for job in pending\
+                       if job.not_before > time.time() and job.is_ready()]
+            timeout = max(0., min(delayed)-time.time()) if delayed else None
+            if len(self.running) > 0:
+                finished += self._wait_for_exits(timeout)
+            elif len(finished) == 0 and delayed:
+                time.sleep(timeout)
+            elif len(finished) == 0:
+                # Remaining jobs depend on jobs that are not scheduled
+                for job in pending:
+                    job.cancelled = True
+                finished = pending
+                pending = []
+
+            self._trace(finished)
+            for job in finished:
+                nb_done += 1
+                if job.cancelled:
+                    print ("Cancelled "+str(job))
+                    failed.append(job)
+                elif not job.succeeded():
+                    print ("Error in job "+str(job.stage)+" (status="\
+                           +str(job.returncode)+")")
+                    print (str(job))
+                    failed.append(job)
+                else:
+                    print (title+"... "+str(int(nb_done*100./nb_jobs))+"%"\
+                           +" ("+job.stage+", {:.1f}s)".format(job.duration()))
+                if on_complete is not None:
+                    on_complete(job)
+        print (title+" done")
+        return failed
+
+
+def print_trace_summary(trace_file, run_id=RUN_ID):
+    """
+    Print the resources used by the jobs of a run, per stage and per tile
+
+    Args:
+      trace_file: the JSONL trace written by the schedulers
+      run_id: the run to summarize (default: this one)
+    """
+    if not trace_file or not os.path.exists(trace_file):
+        return
+    records = []
+    with open(trace_file, "r") as trace:
+        for line in trace:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("run") == run_id:
+                records.append(record)
+
+    for key, title in [("stage", "Stage"), ("tile", "Tile")]:
+        totals = defaultdict(lambda: {"jobs": 0, "failed": 0, "wall": 0.,\
+                                      "cpu": 0., "max_rss": 0, "read": 0, "write": 0})
+        for record in records:
+            total = totals[record[key] or "-"]
+            total["jobs"] += 1
+            if record["returncode"] != 0:
+                total["failed"] += 1
+            total["wall"] += record["wall"]
+            total["cpu"] += record["user"]+record["sys"]
+            total["max_rss"] = max(total["max_rss"], record["max_rss"] or 0)
+            total["read"] += record["read_bytes"] or 0
+            total["write"] += record["write_bytes"] or 0
+        print ("{:<30} {:>6} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format(\
+            title, "jobs", "failed", "wall(s)", "cpu(s)", "maxRSS(MB)", "read(MB)", "write(MB)"))
+        for name, total in sorted(totals.items()):
+            print ("{:<30} {:>6} {:>6} {:>10.1f} {:>10.1f} {:>10} {:>10} {:>10}".format(\
+                name, total["jobs"], total["failed"], total["wall"], total["cpu"],\
+                total["max_rss"]//1024, total["read"]//(1024*1024),\
+                total["write"]//(1024*1024)))
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+"""
+This module chains calibration, border cutting and orthorectification
+of a S1 image in memory through the OTB python API: only the final
+ortho-rectified image is written to disk.
+
+It is run as a command by the S1Processor ("Engine : python"):
+  python -m s1tiling.S1OTBPipeline --in <raw image> \
+      --ortho <ortho image> <ulx> <uly> <sizex> <sizey> <zone> <northern> ...
+
+The --ortho option can be repeated to ortho-rectify the image onto several
+tiles: the raw image is opened and calibrated once, and the sensor model
+and the DEM are shared by all the tiles.
+"""
+
+import argparse
+import otbApplication
+from s1tiling import Utils
+
+
+def get_cut_expression(xsize, ysize, cut_north, cut_south):
+    """
+    Build the BandMath expression that sets to 0 the borders of an image,
+    using the pixel indices instead of a mask image.
+
+    Args:
+      xsize, ysize: size of the image
+      cut_north, cut_south: whether the north (south) border is cut
+
+    Returns:
+      the BandMath expression
+    """
+    conditions = ["idxX<"+str(Utils.CUT_OVERLAP_RANGE),\
+                  "idxX>="+str(xsize-Utils.CUT_OVERLAP_RANGE)]
+    if cut_north:
+        conditions.append("idxY<"+str(Utils.CUT_OVERLAP_AZIMUTH))
+    if cut_south:
+        conditions.append("idxY>="+str(ysize-Utils.CUT_OVERLAP_AZIMUTH))
+    return "("+" || ".join(conditions)+") ? 0 : im1b1"
+
+
+def get_border_cut(app, key="out"):
+    """
+    Probe the output image of an in-memory application to decide which of
+    its borders must be cut, as Utils.get_border_cut does on a file: only
+    the two probe lines are computed.
+
+    Args:
+      app: the executed application (the calibration)
+      key: the output image parameter of the application
+
+    Returns:
+      a tuple (xsize, ysize, cut_north, cut_south)
+    """
+    size = app.GetImageSize(key)
+    xsize, ysize = int(size[0]), int(size[1])
+    cuts = []
+    for line in (Utils.BORDER_PROBE_LINE, ysize-Utils.BORDER_PROBE_LINE):
+        probe = otbApplication.Registry.CreateApplication("ExtractROI")
+        probe.ConnectImage("in", app, key)
+        probe.SetParameterInt("startx", 0)
+        probe.SetParameterInt("starty", line)
+        probe.SetParameterInt("sizex", xsize)
+        probe.SetParameterInt("sizey", 1)
+        probe.Execute()
+        cuts.append(Utils.is_border_cut(probe.GetImageAsNumpyArray("out")))
+    return xsize, ysize, cuts[0], cuts[1]
+
+
+def cut_borders(app, ram, key="out"):
+    """
+    Build the in-memory border cutting of the output image of an
+    application, decided on that image (see get_border_cut).
+
+    Args:
+      app: the executed application (the calibration)
+      ram: RAM available for the application, in MB
+      key: the output image parameter of the application
+
+    Returns:
+      the executed BandMath application
+    """
+    xsize, ysize, cut_north, cut_south = get_border_cut(app, key)
+    cut = otbApplication.Registry.CreateApplication("BandMath")
+    cut.ConnectImage("il", app, key)
+    cut.SetParameterString("exp", get_cut_expression(xsize, ysize,\
+                                                     cut_north, cut_south))
+    cut.SetParameterInt("ram", ram)
+    cut.Execute()
+    return cut
+
+
+def calibrate_and_cut(image, lut, noise, ram):
+    """
+    Build the in-memory calibration and border cutting pipeline.
+
+    Args:
+      image: raw S1 raster file
+      lut: calibration type (sigma, gamma...)
+      noise: whether the thermal noise is removed
+      ram: RAM available for each application, in MB
+
+    Returns:
+      the list of the applications of the pipeline (the last one provides
+      the image ready for ortho-rectification). The list must be kept
+      alive as long as the pipeline is used.
+    """
+    calibration = otbApplication.Registry.CreateApplication("SARCalibration")
+    calibration.SetParameterString("in", image)
+    calibration.SetParameterString("lut", lut)
+    calibration.SetParameterValue("noise", noise)
+    calibration.SetParameterInt("ram", ram)
+    calibration.Execute()
+
+    # The borders are decided on the calibrated image, like the cli engine
+    # does on the calibrated file
+    return [calibration, cut_borders(calibration, ram)]
+
+
+def orthorectify(pipeline, out, params, spacing, gridspacing, dem, geoid, ram):
+    """
+    Ortho-rectify the output of an in-memory pipeline and write it to disk.
+
+    Args:
+      pipeline: the list of applications returned by calibrate_and_cut
+      out: the ortho-rectified output image
+      params: dict of the output grid (ulx, uly, sizex, sizey, zone, northern)
+      spacing: output spatial resolution
+      gridspacing: grid spacing of the deformation grid
+      dem: directory holding the SRTM tiles
+      geoid: geoid file
+      ram: RAM available for the application, in MB
+    """
+    ortho = otbApplication.Registry.CreateApplication("OrthoRectification")
+    ortho.ConnectImage("io.in", pipeline[-1], "out")
+    ortho.SetParameterString("io.out", out+"?&writegeom=false")
+    ortho.SetParameterString("interpolator", "nn")
+    ortho.SetParameterFloat("outputs.spacingx", spacing)
+    ortho.SetParameterFloat("outputs.spacingy", -spacing)
+    ortho.SetParameterInt("outputs.sizex", params["sizex"])
+    ortho.SetParameterInt("outputs.sizey", params["sizey"])
+    ortho.SetParameterFloat("outputs.ulx", params["ulx"])
+    ortho.SetParameterFloat("outputs.uly", params["uly"])
+    ortho.SetParameterFloat("opt.gridspacing", gridspacing)
+    ortho.SetParameterString("map", "utm")
+    ortho.SetParameterInt("map.utm.zone", int(params["zone"]))
+    ortho.SetParameterValue("map.utm.northhem", params["northern"])
+    ortho.SetParameterString("elev.dem", dem)
+    ortho.SetParameterString("elev.geoid", geoid)
+    ortho.SetParameterInt("opt.ram", ram)
+    ortho.ExecuteAndWriteOutput()
+
+
+def main():
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description='Calibrate, cut and orthorectify a S1 image in memory')
+    parser.add_argument('--in', dest='image', help='Raw S1 image', required=True)
+    parser.add_argument('--ortho', nargs=7, action='append', required=True,\
+                        metavar=('OUT', 'ULX', 'ULY', 'SIZEX', 'SIZEY', 'ZONE', 'NORTHERN'),\
+                        help='Ortho-rectified image and its grid (can be repeated)')
+    parser.add_argument('--lut', help='Calibration type', default='sigma')
+    parser.add_argument('--noise', help='Remove thermal noise', action='store_true')
+    parser.add_argument('--spacing', type=float, required=True)
+    parser.add_argument('--gridspacing', type=float, required=True)
+    parser.add_argument('--dem', required=True)
+    parser.add_argument('--geoid', required=True)
+    parser.add_argument('--ram', type=int, default=256)
+    args = parser.parse_args()
+
+    pipeline = calibrate_and_cut(args.image, args.lut, args.noise, args.ram)
+    for out, ulx, uly, sizex, sizey, zone, northern in args.ortho:
+        params = {"ulx": float(ulx), "uly": float(uly),\
+                  "sizex": int(sizex), "sizey": int(sizey),\
+                  "zone": int(zone), "northern": northern.lower() == "true"}
+        orthorectify(pipeline, out, params, args.spacing, args.gridspacing,\
+                     args.dem, args.geoid, args.ram)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1ProcessingState class"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Configuration parameters each stage depends on
+STAGE_PARAMETERS = {
+    "calibration": ("calibration_type", "removethermalnoise"),
+    "cut": ("calibration_type", "removethermalnoise"),
+    "ortho": ("calibration_type", "removethermalnoise", "out_spatial_res",\
+              "grid_spacing", "GeoidFile"),
+    "mask": ("calibration_type", "removethermalnoise", "out_spatial_res",\
+             "grid_spacing", "GeoidFile"),
+    "concatenation": ("calibration_type", "removethermalnoise",\
+                      "out_spatial_res", "grid_spacing", "GeoidFile"),
+    "outcore": ("Window_radius",),
+}
+
+# Number and size of the blocks of a file hashed by get_fingerprint
+NB_SAMPLES = 16
+SAMPLE_SIZE = 64*1024
+
+
+def get_fingerprint(path):
+    """
+    Compute the fingerprint of the content of a file: the hash of its
+    size and of NB_SAMPLES blocks spread evenly over it, first and last
+    blocks included (the whole content for small files). Hashing the
+    full rasters at each query would read them all again, so a change
+    that keeps the size and only touches bytes between the blocks is
+    not seen; the blocks hold the GeoTIFF headers and tile offsets,
+    which change whenever an image is written again.
+
+    Args:
+      path: the file
+
+    Returns:
+      the fingerprint as a string, or None if the file does not exist
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.sha1(str(size).encode())
+        with open(path, "rb") as content:
+            if size <= NB_SAMPLES*SAMPLE_SIZE:
+                digest.update(content.read())
+            else:
+                step = (size-SAMPLE_SIZE)//(NB_SAMPLES-1)
+                for sample in range(NB_SAMPLES):
+                    content.seek(sample*step)
+                    digest.update(content.read(SAMPLE_SIZE))
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class S1ProcessingState(object):
+    """
+    This class records the processing steps that completed successfully,
+    keyed by product, polarisation, tile and stage. A step is done only if
+    it has been recorded with the current configuration and neither its
+    output nor its inputs have changed since, so that partial outputs
+    left by an interrupted run are never mistaken for finished ones. The
+    inputs removed once used (intermediate images) are not checked.
+
+    The steps are read from the database at each query, so that the
+    steps completed by the other processes sharing the database (work
+    queue workers) are seen as soon as they are recorded.
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+        if os.path.dirname(cfg.state_database) != ""\
+           and not os.path.exists(os.path.dirname(cfg.state_database)):
+            os.makedirs(os.path.dirname(cfg.state_database))
+        self.connection = sqlite3.connect(cfg.state_database, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS steps ("\
+                                "product TEXT, polarisation TEXT, tile TEXT,"\
+                                " stage TEXT, output TEXT, fingerprint TEXT,"\
+                                " config_hash TEXT, done_time REAL, inputs TEXT,"\
+                                " PRIMARY KEY (product, polarisation, tile, stage))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS steps_output ON steps (output)")
+        # Directories whose files, produced before the steps were recorded,
+        # have been adopted (see migrate)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS migrations ("\
+                                "directory TEXT PRIMARY KEY, migration_time REAL)")
+        self.connection.commit()
+
+    def get_config_hash(self, stage):
+        """
+        Compute the hash of the configuration parameters a stage depends on
+        """
+        values = [str(getattr(self.cfg, param))\
+                  for param in STAGE_PARAMETERS.get(stage, ())]
+        return hashlib.sha1("|".join([stage]+values).encode()).hexdigest()
+
+    def is_done(self, product, polarisation, tile, stage):
+        """
+        Tells whether a step has been completed.
+
+        Args:
+          product: the S1 product (or output) identifier
+          polarisation: the polarisation
+          tile: the MGRS tile ("" for steps that do not depend on a tile)
+          stage: the processing stage
+
+        Returns:
+          True if the step has been recorded with the current
+          configuration and its output and inputs are unchanged
+        """
+        step = self.connection.execute("SELECT output, fingerprint, config_hash, inputs"\
+                                       " FROM steps"\
+                                       " WHERE product=? AND polarisation=? AND tile=?"\
+                                       " AND stage=?", (product, polarisation, tile, stage))\
+                                       .fetchone()
+        if step is None:
+            return False
+        return self.is_step_valid(stage, *step)
+
+    def is_step_valid(self, stage, output, fingerprint, config_hash, inputs):
+        """
+        Tells whether a recorded step is still valid: same configuration,
+        unchanged output and unchanged inputs (when they still exist)
+        """
+        if config_hash != self.get_config_hash(stage):
+            return False
+        if output != "" and get_fingerprint(output) != fingerprint:
+            return False
+        for path, input_fingerprint in json.loads(inputs or "{}").items():
+            current = get_fingerprint(path)
+            if current is not None and current != input_fingerprint:
+                return False
+        return True
+
+    def is_output_done(self, output):
+        """
+        Tells whether a file has been produced by a completed step.
+
+        Args:
+          output: the file
+
+        Returns:
+          True if a step producing this file has been completed
+        """
+        return any(self.is_step_valid(*step) for step in\
+                   self.connection.execute("SELECT stage, output, fingerprint, config_hash,"\
+                                           " inputs FROM steps WHERE output=?", (output,)))
+
+    def is_recorded(self, output):
+        """ Tells whether a file has been recorded as the output of a step"""
+        return self.connection.execute("SELECT 1 FROM steps WHERE output=?",\
+                                       (output,)).fetchone() is not None
+
+    def record(self, product, polarisation, tile, stage, output="", inputs=()):
+        """
+        Record that a step has been completed.
+
+        Args:
+          product: the S1 product (or output) identifier
+          polarisation: the polarisation
+          tile: the MGRS tile ("" for steps that do not depend on a tile)
+          stage: the processing stage
+          output: the file produced by the step
+          inputs: the files the step read
+        """
+        fingerprint = get_fingerprint(output) if output != "" else ""
+        step = (output, fingerprint, self.get_config_hash(stage))
+        inputs = {path: get_fingerprint(path) for path in inputs}
+        self.connection.execute("INSERT OR REPLACE INTO steps VALUES"\
+                                " (?, ?, ?, ?, ?, ?, ?, ?, ?)",\
+                                (product, polarisation, tile, stage)+step\
+                                +(time.time(), json.dumps(inputs)))
+        self.connection.commit()
+
+    def forget(self, tile, stage):
+        """
+        Remove the records of a stage for a tile.
+
+        Args:
+          tile: the MGRS tile
+          stage: the processing stage
+        """
+        self.connection.execute("DELETE FROM steps WHERE tile=? AND stage=?",\
+                                (tile, stage))
+        self.connection.commit()
+
+    def get_outputs(self, tile, stage):
+        """
+        Returns the files produced by the completed steps of a stage on a tile.
+        """
+        return [row[0] for row in self.connection.execute("SELECT output, fingerprint,"\
+                                                          " config_hash, inputs FROM steps"\
+                                                          " WHERE tile=? AND stage=?",\
+                                                          (tile, stage)).fetchall()\
+                if self.is_step_valid(stage, *row)]
+
+    def is_migrated(self, directory):
+        """ Tells whether the files of a directory have been adopted"""
+        return self.connection.execute("SELECT 1 FROM migrations WHERE directory=?",\
+                                       (directory,)).fetchone() is not None
+
+    def migrate(self, directory, outputs):
+        """
+        Adopt the files produced in a directory before the steps were
+        recorded, once per directory: the files with no record are
+        recorded as completed steps, as the previous versions trusted
+        every existing file. Afterwards, a file with no record is a
+        partial output and is never adopted.
+
+        Args:
+          directory: the directory
+          outputs: list of (product, polarisation, tile, stage, output)
+            of the files of the directory
+        """
+        if self.is_migrated(directory):
+            return
+        for product, polarisation, tile, stage, output in outputs:
+            if not self.is_recorded(output):
+                self.record(product, polarisation, tile, stage, output)
+        self.connection.execute("INSERT OR REPLACE INTO migrations VALUES (?, ?)",\
+                                (directory, time.time()))
+        self.connection.commit()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1ProductCache class"""
+
+import os
+import time
+
+
+class S1ProductCache(object):
+    """
+    This class manages the calibrated and cut rasters (_OrthoReady.tiff)
+    of the S1 images. They do not depend on the MGRS tile, so they are kept
+    as long as a pending tile still needs them, and evicted in LRU order
+    once they are not needed anymore and the disk quota is exceeded.
+    """
+    def __init__(self, cfg, state):
+        """
+        Args:
+          cfg: the configuration (ProductCacheQuota in MB, 0 for no limit)
+          state: the S1ProcessingState holding the completed cut steps
+        """
+        self.quota = cfg.product_cache_quota*1024*1024
+        self.entries = {}
+        self.consumers = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for output in state.get_outputs("", "cut"):
+            stat = os.stat(output)
+            self.entries[output.replace("_OrthoReady.tiff", ".tiff")]\
+                = [self.get_size(output), stat.st_mtime]
+
+    @staticmethod
+    def get_size(image_ok):
+        """ Returns the disk usage of a cut raster and its sensor model"""
+        size = 0
+        for path in [image_ok, image_ok.replace(".tiff", ".geom")]:
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def get_total_size(self):
+        """ Returns the disk usage of the cache in bytes"""
+        return sum(entry[0] for entry in self.entries.values())
+
+    def set_consumers(self, tile, images):
+        """
+        Declare the raw S1 images a pending tile needs.
+
+        Args:
+          tile: the MGRS tile
+          images: list of raw S1 raster files
+        """
+        for image in images:
+            self.consumers.setdefault(image, set()).add(tile)
+
+    def use(self, image):
+        """
+        Declare that the cut raster of an image is needed now.
+
+        Args:
+          image: raw S1 raster file
+
+        Returns:
+          True if the cut raster is in the cache
+        """
+        if image in self.entries\
+           and not os.path.exists(image.replace(".tiff", "_OrthoReady.tiff")):
+            # Removed with its S1 product
+            del self.entries[image]
+        if image in self.entries:
+            self.entries[image][1] = time.time()
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, image):
+        """
+        Add the cut raster of an image that has just been produced.
+
+        Args:
+          image: raw S1 raster file
+        """
+        image_ok = image.replace(".tiff", "_OrthoReady.tiff")
+        self.entries[image] = [self.get_size(image_ok), time.time()]
+        self.evict()
+
+    def release(self, tile):
+        """
+        Declare that a tile does not need its images anymore.
+
+        Args:
+          tile: the MGRS tile
+        """
+        for tiles in self.consumers.values():
+            tiles.discard(tile)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used cut rasters no pending tile needs,
+        until the disk usage of the cache fits into the quota.
+        """
+        if self.quota <= 0:
+            return
+        total_size = self.get_total_size()
+        candidates = sorted([image for image in self.entries\
+                             if len(self.consumers.get(image, ())) == 0],\
+                            key=lambda image: self.entries[image][1])
+        for image in candidates:
+            if total_size <= self.quota:
+                break
+            image_ok = image.replace(".tiff", "_OrthoReady.tiff")
+            for path in [image_ok, image_ok.replace(".tiff", ".geom")]:
+                if os.path.exists(path):
+                    os.remove(path)
+            total_size -= self.entries.pop(image)[0]
+            self.evictions += 1
+        if total_size > self.quota:
+            print ("WARNING: cut rasters still needed use "\
+                   +str(total_size//(1024*1024))+" MB, more than ProductCacheQuota")
+
+    def print_statistics(self):
+        """ Print the cache usage"""
+        print ("Product cache: "+str(len(self.entries))+" rasters, "\
+               +str(self.get_total_size()//(1024*1024))+" MB, "\
+               +str(self.hits)+" hits, "+str(self.misses)+" misses, "\
+               +str(self.evictions)+" evictions")
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1ProductStore class"""
+
+import os
+import time
+import shutil
+
+
+def get_product_dir(raster):
+    """ Returns the SAFE directory of a S1 product (S1DateAcquisition)"""
+    return raster.get_safe_dir()
+
+
+def get_product_archive(product):
+    """ Returns the zip archive a SAFE directory comes from"""
+    return os.path.splitext(product)[0]+".zip"
+
+
+def get_product_path(entry):
+    """
+    Returns the SAFE directory of an entry of the S1Images directory
+    (SAFE directory or product archive), or None
+    """
+    if entry.name.endswith(".zip") and entry.is_file():
+        return os.path.splitext(entry.path)[0]+".SAFE"
+    if entry.is_dir() and not entry.name.startswith("."):
+        return entry.path
+    return None
+
+
+def get_mtime(path):
+    """ Returns the modification time of a path in ns, or None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_fingerprint(product):
+    """
+    Returns the fingerprint of a product: size and modification time of
+    its archive, modification times of its SAFE and measurement
+    directories (the intermediate images are written in the latter)
+    """
+    try:
+        stat = os.stat(get_product_archive(product))
+        archive = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        archive = None
+    return (archive, get_mtime(product), get_mtime(os.path.join(product, "measurement")))
+
+
+def get_dir_size(path):
+    """ Returns the disk usage of a directory, in bytes"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_it in files:
+            try:
+                size += os.lstat(os.path.join(root, file_it)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class S1ProductStore(object):
+    """
+    This class manages the S1 products (SAFE directories and their zip
+    archives) of the S1Images directory. It knows which pending tiles need which products, and keeps
+    the disk usage of the products under a quota:
+      - the products no pending tile needs are removed first, least
+        recently used first;
+      - then, if the products can be downloaded again, the products needed
+        the latest by the pending tiles are removed (least future use).
+    The products of the tile being processed, and of the tiles leased by
+    the other workers of the work queue, are never removed.
+
+    The disk usage of each product is kept with its fingerprint, and
+    computed again only when the product changed.
+    """
+    def __init__(self, cfg):
+        """
+        Args:
+          cfg: the configuration (ProductStoreQuota in MB, 0 for no limit)
+        """
+        self.directory = cfg.raw_directory
+        self.quota = cfg.product_store_quota*1024*1024
+        self.can_download = cfg.pepsdownload
+        self.entries = {}
+        self.sizes = {}
+        self.consumers = {}
+        self.pending_tiles = []
+        self.leased_tiles = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if os.path.exists(self.directory):
+            for entry in os.scandir(self.directory):
+                product = get_product_path(entry)
+                if product is not None:
+                    self.entries[product] = entry.stat().st_mtime
+
+    def set_pending_tiles(self, tiles):
+        """
+        Declare the tiles still to be processed, in processing order.
+        """
+        self.pending_tiles = list(tiles)
+
+    def set_leased_tiles(self, tiles):
+        """
+        Declare the tiles being processed by the other workers of the work
+        queue, whose products are kept.
+        """
+        self.leased_tiles = set(tiles)
+
+    def get_size(self, product):
+        """
+        Returns the disk usage of a product (SAFE directory and archive),
+        computed again only if its fingerprint changed
+        """
+        fingerprint = get_fingerprint(product)
+        cached = self.sizes.get(product)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        size = get_dir_size(product)
+        if fingerprint[0] is not None:
+            size += fingerprint[0][0]
+        self.sizes[product] = (fingerprint, size)
+        return size
+
+    def set_consumers(self, tile, raster_list):
+        """
+        Declare the S1 products a pending tile needs.
+
+        Args:
+          tile: the MGRS tile
+          raster_list: list of (S1 product, tile corners) intersecting the tile
+        """
+        for raster, _ in raster_list:
+            self.consumers.setdefault(get_product_dir(raster), set()).add(tile)
+
+    def use(self, raster_list):
+        """
+        Declare that S1 products are used now.
+
+        Args:
+          raster_list: list of (S1 product, tile corners) intersecting a tile
+        """
+        for raster, _ in raster_list:
+            product = get_product_dir(raster)
+            if product in self.entries:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.entries[product] = time.time()
+
+    def release(self, tile):
+        """
+        Declare that a tile has been processed.
+
+        Args:
+          tile: the MGRS tile
+        """
+        for tiles in self.consumers.values():
+            tiles.discard(tile)
+        if tile in self.pending_tiles:
+            self.pending_tiles.remove(tile)
+
+    def get_next_use(self, product):
+        """
+        Returns the rank of the first pending tile needing a product, or
+        None if no pending tile needs it
+        """
+        tiles = self.consumers.get(product, ())
+        ranks = [rank for rank, tile in enumerate(self.pending_tiles) if tile in tiles]
+        return min(ranks) if ranks else None
+
+    def evict(self, current_tile=None):
+        """
+        Remove products until the disk usage fits into the quota.
+
+        Args:
+          current_tile: the tile being processed, whose products are kept
+
+        Returns:
+          True if products have been removed
+        """
+        if self.quota <= 0:
+            return False
+        for product in list(self.entries):
+            if not os.path.exists(product) and not os.path.exists(get_product_archive(product)):
+                del self.entries[product]
+                self.sizes.pop(product, None)
+        for entry in os.scandir(self.directory):
+            product = get_product_path(entry)
+            if product is not None and product not in self.entries:
+                self.entries[product] = entry.stat().st_mtime
+        sizes = dict((product, self.get_size(product)) for product in self.entries)
+        total_size = sum(sizes.values())
+        if total_size <= self.quota:
+            return False
+
+        unused = []
+        needed = []
+        for product, last_use in self.entries.items():
+            if self.consumers.get(product, set()) & self.leased_tiles:
+                continue
+            next_use = self.get_next_use(product)
+            if next_use is None:
+                unused.append((last_use, product))
+            elif current_tile not in self.consumers.get(product, ()):
+                needed.append((-next_use, product))
+        candidates = [product for _, product in sorted(unused)]
+        if self.can_download:
+            candidates += [product for _, product in sorted(needed)]
+
+        removed = False
+        for product in candidates:
+            if total_size <= self.quota:
+                break
+            print ("Remove : ",os.path.basename(product))
+            shutil.rmtree(product, ignore_errors=True)
+            if os.path.exists(get_product_archive(product)):
+                os.remove(get_product_archive(product))
+            total_size -= sizes[product]
+            del self.entries[product]
+            del self.sizes[product]
+            self.evictions += 1
+            removed = True
+        if total_size > self.quota:
+            print ("WARNING: S1 products still needed use "\
+                   +str(total_size//(1024*1024))+" MB, more than ProductStoreQuota")
+        return removed
+
+    def print_statistics(self):
+        """ Print the store usage"""
+        print ("Product store: "+str(len(self.entries))+" products, "\
+               +str(self.hits)+" hits, "+str(self.misses)+" misses, "\
+               +str(self.evictions)+" evictions")
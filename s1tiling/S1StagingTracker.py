@@ -0,0 +1,276 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1StagingTracker class"""
+
+import os
+import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from s1tiling.S1Downloader import DownloadError, DOWNLOADED, STAGING, FAILED
+
+# States of a product, besides STAGING (being staged, as reported by the
+# catalog), DOWNLOADED and FAILED
+NEW = "new"                 # on tape, staging not requested yet
+REQUESTED = "requested"     # staging requested
+ONLINE = "online"           # on disk, waiting for its download
+
+# States still to be worked on
+ACTIVE_STATES = (NEW, REQUESTED, STAGING, ONLINE)
+
+# Delay before the first poll of a product being staged, and longest
+# delay between two polls, in seconds
+STAGING_POLL = 60
+MAX_STAGING_POLL = 1800
+
+
+class S1StagingTracker(object):
+    """
+    This class follows the download of products which may be on tape.
+    Each product has its own state (new, requested, staging, online,
+    downloaded, failed), kept in a SQLite database so that a restarted
+    run never requests the staging of a product again. The storage of
+    the products being staged is polled after a delay doubling for each
+    product, and a product that comes online is downloaded at once while
+    the others are still waiting.
+    """
+    def __init__(self, database, downloader, catalog,\
+                 staging_poll=STAGING_POLL, max_staging_poll=MAX_STAGING_POLL):
+        """
+        Args:
+          database: the SQLite file of the states
+          downloader: the S1Downloader
+          catalog: the S1Catalog, to poll the storage of the products
+          staging_poll: delay before the first poll of a product, in seconds
+          max_staging_poll: longest delay between two polls, in seconds
+        """
+        self.downloader = downloader
+        self.catalog = catalog
+        self.staging_poll = staging_poll
+        self.max_staging_poll = max_staging_poll
+        self.connection = sqlite3.connect(database, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS products ("\
+                                "product TEXT PRIMARY KEY, feature_id TEXT,"\
+                                " checksum TEXT, state TEXT, attempts INTEGER,"\
+                                " polls INTEGER, next_time REAL,"\
+                                " requested_time REAL, update_time REAL)")
+        self.connection.commit()
+        self.products = {}
+        for row in self.connection.execute("SELECT product, feature_id, checksum, state,"\
+                                           " attempts, polls, next_time, requested_time"\
+                                           " FROM products"):
+            self.products[row[0]] = self.get_entry(row)
+
+    def get_entry(self, row):
+        """ Returns the state of a product from its row of the database"""
+        return {"product": row[0], "id": row[1], "checksum": row[2],\
+                "state": row[3], "attempts": row[4], "polls": row[5],\
+                "next_time": row[6], "requested_time": row[7]}
+
+    def load(self, name):
+        """
+        Read the state of a product again from the database, as updated
+        by another process (see step)
+
+        Returns:
+          the state of the product, or None if it is unknown
+        """
+        row = self.connection.execute("SELECT product, feature_id, checksum, state,"\
+                                      " attempts, polls, next_time, requested_time"\
+                                      " FROM products WHERE product=?", (name,)).fetchone()
+        if row is not None:
+            self.products[name] = self.get_entry(row)
+        return self.products.get(name)
+
+    def save(self, entry):
+        """ Write the state of a product to the database"""
+        self.connection.execute("INSERT OR REPLACE INTO products VALUES"\
+                                " (?, ?, ?, ?, ?, ?, ?, ?, ?)",\
+                                (entry["product"], entry["id"], entry["checksum"],\
+                                 entry["state"], entry["attempts"], entry["polls"],\
+                                 entry["next_time"], entry["requested_time"], time.time()))
+        self.connection.commit()
+
+    def set_state(self, entry, state, next_time=0.):
+        """ Change the state of a product"""
+        if state != entry["state"]:
+            print (entry["product"]+": "+state)
+        entry["state"] = state
+        entry["next_time"] = next_time
+        self.save(entry)
+
+    def add(self, products):
+        """
+        Declare products to download. The products already known keep
+        their state (a staging already requested is not requested again),
+        except the ones downloaded whose archive has been removed since,
+        and the ones failed, which are tried again.
+
+        Args:
+          products: list of products, as returned by S1Catalog.search
+        """
+        for product in products:
+            entry = self.products.get(product["product"])
+            if entry is not None and entry["state"] in ACTIVE_STATES:
+                continue
+            if entry is not None and entry["state"] == DOWNLOADED\
+               and os.path.exists(self.downloader.get_product_path(product["product"])):
+                continue
+            self.products[product["product"]] = {
+                "product": product["product"], "id": product["id"],\
+                "checksum": product["checksum"], "attempts": 0, "polls": 0,\
+                "state": ONLINE if product["storage"] == "disk"\
+                else STAGING if product["storage"] == "staging" else NEW,\
+                "next_time": 0., "requested_time": None}
+            self.save(self.products[product["product"]])
+
+    def get_poll_delay(self, entry):
+        """ Returns the delay before the next poll of a product being staged"""
+        return min(self.max_staging_poll, self.staging_poll*2**entry["polls"])
+
+    def poll(self, entries):
+        """ Ask the catalog the storage of products being staged"""
+        try:
+            storages = self.catalog.refresh([entry["id"] for entry in entries])
+        except (DownloadError, OSError, ValueError) as err:
+            print ("WARNING: the storage of the products could not be polled: "+str(err))
+            storages = {}
+        for entry in entries:
+            storage = storages.get(entry["id"])
+            entry["polls"] += 1
+            if storage == "disk":
+                self.set_state(entry, ONLINE)
+            else:
+                self.set_state(entry, STAGING if storage == "staging" else entry["state"],\
+                               time.time()+self.get_poll_delay(entry))
+
+    def complete(self, entry, download):
+        """
+        Update the state of a product after a download attempt
+
+        Args:
+          entry: the state of the product
+          download: callable returning the status of the attempt
+            (DOWNLOADED or STAGING), or raising DownloadError
+        """
+        try:
+            status = download()
+        except DownloadError as err:
+            entry["attempts"] += 1
+            if entry["attempts"] >= self.downloader.max_attempts:
+                print ("ERROR: "+entry["product"]+" failed after "+str(entry["attempts"])\
+                       +" attempts: "+str(err))
+                self.set_state(entry, FAILED)
+            else:
+                delay = self.downloader.get_delay(entry["attempts"])
+                print ("WARNING: "+str(err)+", retrying in "+str(int(delay))+" s")
+                self.set_state(entry, entry["state"], time.time()+delay)
+            return
+        if status == DOWNLOADED:
+            self.set_state(entry, DOWNLOADED)
+            return
+        # The download request started the staging of the product
+        if entry["requested_time"] is None:
+            entry["requested_time"] = time.time()
+        self.set_state(entry, REQUESTED if entry["state"] == NEW else STAGING,\
+                       time.time()+self.get_poll_delay(entry))
+
+    def run(self, products=None, on_downloaded=None):
+        """
+        Download products: the ones online are downloaded, the staging of
+        the ones on tape is requested once, then their storage is polled
+        until they are online.
+
+        Args:
+          products: the names of the products to wait for (default: all
+            the products declared)
+          on_downloaded: callable called with the name of each product
+            once downloaded
+
+        Returns:
+          dict product -> state (DOWNLOADED or FAILED)
+        """
+        names = set(self.products if products is None else products)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.downloader.nb_transfers) as executor:
+            while True:
+                now = time.time()
+                transferred = set(entry["product"] for entry in running.values())
+                entries = [self.products[name] for name in names if name not in transferred]
+                due = [entry for entry in entries if entry["state"] in ACTIVE_STATES\
+                       and entry["next_time"] <= now]
+                polled = [entry for entry in due if entry["state"] in (REQUESTED, STAGING)]
+                if polled:
+                    self.poll(polled)
+                ready = [entry for entry in due if entry["state"] in (NEW, ONLINE)]
+                for entry in ready[:self.downloader.nb_transfers-len(running)]:
+                    future = executor.submit(self.downloader.download_product,\
+                                             entry["product"], entry["id"], entry["checksum"])
+                    running[future] = entry
+                # The products ready for a download wait for a transfer slot,
+                # the others for their next poll or attempt
+                waiting = [entry["next_time"] for entry in entries\
+                           if entry["state"] in ACTIVE_STATES and entry not in ready]
+                if not running and not waiting:
+                    break
+                timeout = max(0., min(waiting)-time.time()) if waiting else None
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = running.pop(future)
+                    self.complete(entry, future.result)
+                    if entry["state"] == DOWNLOADED and on_downloaded is not None:
+                        on_downloaded(entry["product"])
+        return dict((name, self.products[name]["state"]) for name in names)
+
+    def step(self, name):
+        """
+        Move a product one step forward, if it is due: poll its storage if
+        it is being staged, then download it if it is online, or request
+        its staging if it is on tape. The staging is requested once, the
+        state is kept in the database: the caller runs step again at the
+        next_time of the product, for instance from another process.
+
+        Args:
+          name: the product
+
+        Returns:
+          the state of the product
+        """
+        entry = self.products[name]
+        if entry["state"] not in ACTIVE_STATES or entry["next_time"] > time.time():
+            return entry
+        if entry["state"] in (REQUESTED, STAGING):
+            self.poll([entry])
+        if entry["state"] in (NEW, ONLINE):
+            self.complete(entry, lambda: self.downloader.download_product(entry["product"],\
+                                                                          entry["id"],\
+                                                                          entry["checksum"]))
+        return entry
+
+    def print_statistics(self):
+        """ Print the number of products in each state"""
+        counts = {}
+        for entry in self.products.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0)+1
+        print ("Staging tracker: "+", ".join(str(count)+" "+state\
+                                             for state, count in sorted(counts.items())))
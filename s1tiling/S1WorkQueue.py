@@ -0,0 +1,222 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+#
+# Authors: Thierry KOLECK (CNES)
+#
+# =========================================================================
+
+""" This module contains the S1WorkQueue class"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+# Number of times a tile is tried before it is marked as failed
+MAX_ATTEMPTS = 3
+
+# Held by the heartbeat threads around their SQLite calls, and taken
+# around each fork of the process, so that no child inherits a SQLite
+# call in progress
+HEARTBEAT_LOCK = threading.Lock()
+os.register_at_fork(before=HEARTBEAT_LOCK.acquire,\
+                    after_in_parent=HEARTBEAT_LOCK.release,\
+                    after_in_child=HEARTBEAT_LOCK.release)
+
+
+class S1WorkQueue(object):
+    """
+    This class distributes the tiles to process between several workers
+    (S1Processor instances, on one or several nodes) through a SQLite
+    database on a shared file system.
+
+    Each worker pulls the next tile when it is done with the previous one,
+    so that the expensive tiles do not hold back the others. The most
+    expensive tiles (most intersecting products) are handed out first. A
+    worker holds a lease on its tile, renewed in the background while it
+    is processed: the tile of a dead worker is handed out again once its
+    lease has expired. A tile whose processing failed is handed out again
+    until it has been tried MAX_ATTEMPTS times.
+
+    The lease is never renewed while the process forks (the jobs of the
+    scheduler), so that the child does not inherit a database connection
+    in the middle of a transaction.
+    """
+    def __init__(self, database, lease_duration):
+        """
+        Args:
+          database: the SQLite file of the queue
+          lease_duration: lease duration in seconds
+        """
+        self.database = database
+        self.lease_duration = lease_duration
+        self.worker = socket.gethostname()+":"+str(os.getpid())
+        self.heartbeat = None
+        self.stop_heartbeat = threading.Event()
+        if os.path.dirname(database) != "" and not os.path.exists(os.path.dirname(database)):
+            os.makedirs(os.path.dirname(database), exist_ok=True)
+        self.connection = self.connect()
+        self.connection.execute("CREATE TABLE IF NOT EXISTS tiles ("\
+                                "tile TEXT PRIMARY KEY, cost INTEGER,"\
+                                " state TEXT, worker TEXT, lease_expiry REAL,"\
+                                " attempts INTEGER, start_time REAL, end_time REAL)")
+        self.connection.commit()
+
+    def connect(self):
+        """ Open a connection to the queue database"""
+        # isolation_level=None: the transactions are handled explicitly
+        return sqlite3.connect(self.database, timeout=60, isolation_level=None)
+
+    def add_tiles(self, tiles):
+        """
+        Add tiles to the queue. The tiles already queued (by another worker)
+        are left unchanged.
+
+        Args:
+          tiles: list of (tile, cost)
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        for tile, cost in tiles:
+            self.connection.execute("INSERT OR IGNORE INTO tiles VALUES"\
+                                    " (?, ?, 'pending', NULL, NULL, 0, NULL, NULL)",\
+                                    (tile, cost))
+        self.connection.execute("COMMIT")
+
+    def acquire(self):
+        """
+        Take the next tile to process: the most expensive pending tile, or
+        a tile whose worker has lost its lease.
+
+        Returns:
+          the tile, or None if there is nothing left to do
+        """
+        now = time.time()
+        row = None
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Tiles of dead workers that were tried too many times are failed
+            self.connection.execute("UPDATE tiles SET state='failed', end_time=?"\
+                                    " WHERE state='running' AND lease_expiry<?"\
+                                    " AND attempts>=?", (now, now, MAX_ATTEMPTS))
+            row = self.connection.execute("SELECT tile FROM tiles WHERE"\
+                                          " state='pending' OR (state='running'"\
+                                          " AND lease_expiry<?)"\
+                                          " ORDER BY cost DESC, tile LIMIT 1",\
+                                          (now,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE tiles SET state='running',"\
+                                        " worker=?, lease_expiry=?,"\
+                                        " attempts=attempts+1, start_time=?"\
+                                        " WHERE tile=?",\
+                                        (self.worker, now+self.lease_duration,\
+                                         now, row[0]))
+        finally:
+            self.connection.execute("COMMIT")
+        if row is None:
+            return None
+        self.start_heartbeat(row[0])
+        return row[0]
+
+    def start_heartbeat(self, tile):
+        """ Renew the lease of a tile in the background"""
+        self.stop_heartbeat.clear()
+
+        def renew():
+            with HEARTBEAT_LOCK:
+                connection = self.connect()
+            while not self.stop_heartbeat.wait(self.lease_duration/3.):
+                with HEARTBEAT_LOCK:
+                    connection.execute("UPDATE tiles SET lease_expiry=? WHERE"\
+                                       " tile=? AND worker=? AND state='running'",\
+                                       (time.time()+self.lease_duration, tile, self.worker))
+            with HEARTBEAT_LOCK:
+                connection.close()
+
+        self.heartbeat = threading.Thread(target=renew, daemon=True)
+        self.heartbeat.start()
+
+    def complete(self, tile, success=True):
+        """
+        Declare that a tile has been processed. A tile whose processing
+        failed is pending again, unless it has been tried MAX_ATTEMPTS
+        times.
+
+        Args:
+          tile: the tile
+          success: whether the processing succeeded
+        """
+        self.stop_heartbeat.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+            self.heartbeat = None
+        if success:
+            self.connection.execute("UPDATE tiles SET state='done', end_time=? WHERE"\
+                                    " tile=? AND worker=?",\
+                                    (time.time(), tile, self.worker))
+        else:
+            self.connection.execute("UPDATE tiles SET state=CASE WHEN attempts>=?"\
+                                    " THEN 'failed' ELSE 'pending' END, worker=NULL,"\
+                                    " lease_expiry=NULL, end_time=? WHERE"\
+                                    " tile=? AND worker=?",\
+                                    (MAX_ATTEMPTS, time.time(), tile, self.worker))
+
+    def get_leased_tiles(self):
+        """ Returns the tiles being processed by the other workers"""
+        return [row[0] for row in self.connection.execute("SELECT tile FROM tiles WHERE"\
+                                                          " state='running' AND worker!=?"\
+                                                          " AND lease_expiry>=?",\
+                                                          (self.worker, time.time()))]
+
+    def get_pending_tiles(self):
+        """
+        Returns the tiles still to be processed, by this worker or by the
+        other ones: the running tiles, then the pending ones in the order
+        they are handed out
+        """
+        return [row[0] for row in self.connection.execute("SELECT tile FROM tiles WHERE"\
+                                                          " state IN ('pending', 'running')"\
+                                                          " ORDER BY state='pending',"\
+                                                          " cost DESC, tile")]
+
+    def tiles(self):
+        """
+        Iterate over the tiles this worker gets from the queue. The
+        caller must call complete() for each tile.
+        """
+        while True:
+            tile = self.acquire()
+            if tile is None:
+                return
+            yield tile
+
+    def get_progress(self):
+        """
+        Returns the number of tiles in each state, and the number of tiles
+        processed by each worker.
+        """
+        states = dict(self.connection.execute("SELECT state, COUNT(*) FROM tiles"\
+                                              " GROUP BY state").fetchall())
+        workers = dict(self.connection.execute("SELECT worker, COUNT(*) FROM tiles"\
+                                               " WHERE state='done' GROUP BY worker").fetchall())
+        return states, workers
+
+    def print_progress(self):
+        """ Print a summary of the queue"""
+        states, workers = self.get_progress()
+        print ("Work queue: "+", ".join(str(states.get(state, 0))+" "+state\
+                                         for state in ["pending", "running", "done", "failed"]))
+        for worker, nb_tiles in sorted(workers.items()):
+            print ("  "+worker+": "+str(nb_tiles)+" tiles")
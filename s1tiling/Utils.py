@@ -20,12 +20,27 @@
 """ This module contains various utility functions"""
 
 import ogr
-from osgeo import osr
+import numpy as np
+from osgeo import osr, gdal
 import xml.etree.ElementTree as ET
+from s1tiling.S1Archive import open_product_file
+
+# Number of pixels to cut on the east and west sides (1000 = 10km)
+CUT_OVERLAP_RANGE = 1000
+# Number of pixels to cut on the north or south side
+CUT_OVERLAP_AZIMUTH = 1600
+# Number of zeros on a probe line above which the north (south) side is cut.
+# The east and west sides are not cut yet when probing, hence the factor 2
+THR_NAN_FOR_CROPPING = CUT_OVERLAP_RANGE*2
+# Distance of the probe lines from the north and south edges
+BORDER_PROBE_LINE = 100
+# Number of lines probed to find the valid lines of an ortho-rectified image
+VALID_PROBE_LINES = 64
 
 
 def get_relative_orbit(manifest):
-    root=ET.parse(manifest)
+    with open_product_file(manifest) as save_file:
+        root=ET.parse(save_file)
     return int(root.find("metadataSection/metadataObject/metadataWrap/xmlData/{http://www.esa.int/safe/sentinel-1.0}orbitReference/{http://www.esa.int/safe/sentinel-1.0}relativeOrbitNumber").text)
 
 def get_origin(manifest):
@@ -37,7 +52,7 @@ def get_origin(manifest):
     Returns:
       the parsed coordinates (or throw an exception if they could not be parsed)
     """
-    with open(manifest, "r") as save_file:
+    with open_product_file(manifest) as save_file:
         for line in save_file:
             if "<gml:coordinates>" in line:
                 coor = line.replace("                <gml:coordinates>", "")\
@@ -94,7 +109,7 @@ def get_orbit_direction(manifest):
       orbits. Throws an exception if manifest can not be parsed.
 
     """
-    with open(manifest, "r") as save_file:
+    with open_product_file(manifest) as save_file:
         for line in save_file:
             if "<s1:pass>" in line:
                 if "DESCENDING" in line:
@@ -157,6 +172,19 @@ def get_polar_from_s1_raster(path_to_raster):
     """
     return path_to_raster.split("/")[-1].split("-")[3]
 
+def get_product_from_s1_raster(path_to_raster):
+    """
+    Small utilty function that parses a s1 raster file path to extract
+    the name of its product (SAFE directory)
+
+    Args:
+      path_to_raster: path to the s1 raster file
+
+    Returns:
+      a string representing the product
+    """
+    return path_to_raster.split("/")[-3].replace(".SAFE", "")
+
 def get_platform_from_s1_raster(path_to_raster):
     """
     Small utilty function that parses a s1 raster file name to extract platform
@@ -167,4 +195,79 @@ def get_platform_from_s1_raster(path_to_raster):
     Returns:
       a string representing the platform
     """
-    return path_to_raster.split("/")[-1].split("-")[0]
\ No newline at end of file
+    return path_to_raster.split("/")[-1].split("-")[0]
+
+def get_border_cut(path_to_raster):
+    """
+    Probe a S1 raster to decide which of its borders must be cut. Only
+    two lines (BORDER_PROBE_LINE pixels away from the north and south
+    edges) are read.
+
+    Args:
+      path_to_raster: path to the s1 raster file (raw or calibrated)
+
+    Returns:
+      a tuple (xsize, ysize, cut_north, cut_south)
+    """
+    raster = gdal.Open(path_to_raster)
+    xsize = raster.RasterXSize
+    ysize = raster.RasterYSize
+    band = raster.GetRasterBand(1)
+    north_line = band.ReadAsArray(0, BORDER_PROBE_LINE, xsize, 1)
+    south_line = band.ReadAsArray(0, ysize-BORDER_PROBE_LINE, xsize, 1)
+    return xsize, ysize, is_border_cut(north_line), is_border_cut(south_line)
+
+def get_valid_lines(band):
+    """
+    Find the lines of an ortho-rectified image holding non-zero pixels.
+    The valid area of an image on a tile (the footprint of the S1 product
+    cut by the tile) is convex, so its lines are contiguous: they are
+    found by probing VALID_PROBE_LINES lines evenly spread, then by
+    bisection between the probes around the first and last valid ones.
+    If no probe line is valid, the valid area is too thin to be found
+    and all the lines are returned.
+
+    Args:
+      band: the raster band (GDAL) of the image
+
+    Returns:
+      a tuple (first valid line, last valid line + 1)
+    """
+    ysize = band.YSize
+
+    def is_valid(line):
+        return np.count_nonzero(band.ReadAsArray(0, line, band.XSize, 1)) > 0
+
+    probes = sorted(set(line*(ysize-1)//(VALID_PROBE_LINES-1) for line in range(VALID_PROBE_LINES)))
+    valid = [rank for rank, line in enumerate(probes) if is_valid(line)]
+    if valid == []:
+        return 0, ysize
+
+    # Bisection between the last invalid line and the first valid one
+    low = probes[valid[0]-1] if valid[0] > 0 else -1
+    high = probes[valid[0]]
+    while high-low > 1:
+        middle = (low+high)//2
+        if is_valid(middle):
+            high = middle
+        else:
+            low = middle
+    first_line = high
+
+    # Bisection between the last valid line and the first invalid one
+    low = probes[valid[-1]]
+    high = probes[valid[-1]+1] if valid[-1] < len(probes)-1 else ysize
+    while high-low > 1:
+        middle = (low+high)//2
+        if is_valid(middle):
+            low = middle
+        else:
+            high = middle
+    return first_line, high
+
+def is_border_cut(probe_line):
+    """
+    Tells whether a border must be cut from its probe line (see
+    get_border_cut)
+    """
+    return np.count_nonzero(probe_line == 0) > THR_NAN_FOR_CROPPING
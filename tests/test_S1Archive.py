@@ -0,0 +1,82 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1Archive module"""
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1Archive import list_archive, get_vsizip_path, open_product_file,\
+    extract_members
+
+SAFE_NAME = "S1A_IW_GRDH_1SDV_20190101T055413_20190101T055438_025000_02C000_AAAA.SAFE"
+MEMBERS = ["manifest.safe", "annotation/s1a-iw-grd-vv.xml", "annotation/s1a-iw-grd-vh.xml",\
+           "measurement/s1a-iw-grd-vv.tiff", "measurement/s1a-iw-grd-vh.tiff",\
+           "preview/quick-look.png"]
+
+
+class TestArchive(unittest.TestCase):
+    """ Products read inside their archives"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = os.path.join(self.directory, SAFE_NAME[:-5]+".zip")
+        with zipfile.ZipFile(self.archive, "w") as zip_ref:
+            for member in MEMBERS:
+                zip_ref.writestr(SAFE_NAME+"/"+member, member)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_in_place(self):
+        safe_name, members = list_archive(self.archive)
+        self.assertEqual(safe_name, SAFE_NAME)
+        self.assertEqual(members, [SAFE_NAME+"/"+member for member in MEMBERS])
+        with open_product_file(get_vsizip_path(self.archive, SAFE_NAME+"/manifest.safe"))\
+             as manifest:
+            self.assertEqual(manifest.read(), "manifest.safe")
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.archive)])
+
+    def test_corrupted(self):
+        with open(self.archive, "r+b") as archive:
+            archive.truncate(100)
+        self.assertEqual(list_archive(self.archive), (None, []))
+
+    def test_extract_members(self):
+        extract_members(self.archive, [SAFE_NAME+"/"+member for member in MEMBERS[:4]],\
+                        self.directory)
+        image = os.path.join(self.directory, SAFE_NAME, "measurement", "s1a-iw-grd-vv.tiff")
+        with open(image, "w") as image_file:
+            image_file.write("processed")
+        # The members already extracted are kept, the others are added
+        extract_members(self.archive, [SAFE_NAME+"/"+member for member in MEMBERS[3:5]],\
+                        self.directory)
+        with open(image) as image_file:
+            self.assertEqual(image_file.read(), "processed")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, SAFE_NAME, "measurement"))),\
+                         ["s1a-iw-grd-vh.tiff", "s1a-iw-grd-vv.tiff"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, SAFE_NAME, "preview")))
+        # No temporary directory is left
+        self.assertEqual(sorted(os.listdir(self.directory)),\
+                         sorted([SAFE_NAME, os.path.basename(self.archive)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1AutoTuning class"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1AutoTuning import S1AutoTuning
+
+
+class TestThreads(unittest.TestCase):
+    """ The threads of a stage follow the parallelism of its jobs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.directory, "trace.jsonl")
+        self.cfg = SimpleNamespace(OTBThreads=0, ram_per_process=0, ram_budget=4096,\
+                                   cpu_budget=0, trace_file=self.trace_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_jobs(self, nb_jobs, nb_threads, parallelism, stage="Orthorectification"):
+        """ Record jobs of a stage that kept parallelism threads busy"""
+        with open(self.trace_file, "a") as trace:
+            for _ in range(nb_jobs):
+                trace.write(json.dumps({"stage": stage, "returncode": 0,\
+                                        "nb_threads": nb_threads, "wall": 10.,\
+                                        "user": 10.*parallelism, "sys": 0.,\
+                                        "max_rss": 1024*1024})+"\n")
+
+    def get_threads(self, stage="Orthorectification"):
+        return S1AutoTuning(self.cfg).read_profiles(self.trace_file)[stage][0]
+
+    def test_saturated_jobs_grow_past_default(self):
+        self.add_jobs(10, 4, 3.9)
+        self.assertEqual(self.get_threads(), 8)
+        self.add_jobs(10, 8, 7.8)
+        # The older jobs still weigh a little
+        self.assertGreater(self.get_threads(), 8)
+
+    def test_io_bound_run_recovers(self):
+        self.add_jobs(10, 4, 1.)
+        self.assertEqual(self.get_threads(), 1)
+        # The next runs keep their single thread busy
+        for threads in [1, 2]:
+            self.add_jobs(10, threads, threads*0.95)
+        self.assertGreater(self.get_threads(), 2)
+
+    def test_bounded_by_given_threads(self):
+        self.add_jobs(10, 4, 2.)
+        self.assertEqual(self.get_threads(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1BorderMask module"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    import numpy as np
+    from osgeo import gdal
+    from s1tiling import S1BorderMask
+    HAVE_GDAL = True
+except ImportError:
+    HAVE_GDAL = False
+
+RADIUS = 3
+
+
+def reference_morphology(mask, radius, erosion):
+    """ Erosion (dilation) by a ball, pixel by pixel"""
+    ysize, xsize = mask.shape
+    result = np.empty(mask.shape, dtype=bool)
+    offsets = [(dy, dx) for dy, half_width in zip(range(-radius, radius+1),\
+                                                  S1BorderMask.get_ball_half_widths(radius))\
+               for dx in range(-half_width, half_width+1)]
+    for y in range(ysize):
+        for x in range(xsize):
+            # Outside the mask: foreground for an erosion, background for a dilation
+            values = [mask[y+dy, x+dx] if 0 <= y+dy < ysize and 0 <= x+dx < xsize else erosion\
+                      for dy, dx in offsets]
+            result[y, x] = all(values) if erosion else any(values)
+    return result
+
+
+@unittest.skipUnless(HAVE_GDAL, "GDAL and numpy are needed")
+class TestBorderMask(unittest.TestCase):
+    """ The opening of the border mask"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        random = np.random.RandomState(0)
+        # A valid area with nodata holes and a jagged border
+        self.image = np.zeros((60, 40), dtype=np.float32)
+        self.image[5:55, 3:35] = random.uniform(1., 2., (50, 32))
+        self.image[random.uniform(size=self.image.shape) < 0.05] = 0
+        self.image[20:24, 30:40] = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ball(self):
+        self.assertEqual(S1BorderMask.get_ball_half_widths(1), [1, 1, 1])
+        self.assertEqual(S1BorderMask.get_ball_half_widths(RADIUS), [1, 2, 3, 3, 3, 2, 1])
+
+    def test_morphology(self):
+        mask = self.image != 0
+        for erosion in [True, False]:
+            self.assertTrue(np.array_equal(S1BorderMask.morphology(mask, RADIUS, erosion),\
+                                           reference_morphology(mask, RADIUS, erosion)))
+
+    def test_blocks(self):
+        ortho_image = os.path.join(self.directory, "ortho.tif")
+        raster = gdal.GetDriverByName("GTiff").Create(ortho_image, 40, 60, 1, gdal.GDT_Float32)
+        raster.GetRasterBand(1).WriteArray(self.image)
+        raster = None
+        mask_image = os.path.join(self.directory, "mask.tif")
+        # One line per block: the halo makes each block exact
+        S1BorderMask.generate_border_mask(ortho_image, mask_image, 0)
+
+        radius = S1BorderMask.MASK_OPENING_RADIUS
+        reference = reference_morphology(reference_morphology(self.image != 0, radius, True),\
+                                         radius, False)
+        self.assertTrue(np.array_equal(gdal.Open(mask_image).ReadAsArray(),\
+                                       reference.astype(np.uint8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
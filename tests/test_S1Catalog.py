@@ -0,0 +1,122 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1Catalog class against the PEPS stub server"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+from s1tiling import S1Catalog as catalog_module
+from s1tiling.S1Catalog import S1Catalog
+from s1tiling.S1Downloader import S1Downloader
+from peps_stub_server import PepsStub, PepsStubHandler, ThreadingHTTPServer
+
+PRODUCTS = ["S1A_IW_GRDH_1SDV_2019010"+str(day)+"T055413_AAAA" for day in range(1, 6)]
+QUERY = "box=1.000000,43.000000,2.000000,44.000000"
+
+
+class TestSearch(unittest.TestCase):
+    """ Cached and paginated catalog searches"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        served = os.path.join(self.directory, "served")
+        os.makedirs(served)
+        for product in PRODUCTS:
+            with open(os.path.join(served, product+".zip"), "wb") as archive:
+                archive.write(product.encode())
+        auth_file = os.path.join(self.directory, "peps.txt")
+        with open(auth_file, "w") as out_file:
+            out_file.write("user@example.com password\n")
+        self.server = ThreadingHTTPServer(("localhost", 0), PepsStubHandler)
+        # The first two products are on tape
+        self.server.stub = PepsStub(served, 0.4, 60., 0., 0.)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.downloader = S1Downloader(auth_file, os.path.join(self.directory, "S1Images"),\
+                                       base_url="http://localhost:"+str(self.server.server_port)\
+                                       +"/resto")
+        self.cache_dir = os.path.join(self.directory, "catalog")
+        os.makedirs(self.cache_dir)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def get_catalog(self, ttl=3600, parameters=(("productType", "GRD"),)):
+        return S1Catalog(self.downloader, parameters, cache_dir=self.cache_dir, ttl=ttl)
+
+    def age_cache(self, seconds):
+        """ Make the cached answers older"""
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            with open(path) as in_file:
+                cached = json.load(in_file)
+            cached["time"] -= seconds
+            with open(path, "w") as out_file:
+                json.dump(cached, out_file)
+
+    def get_products(self, catalog):
+        return [product["product"] for product in catalog.search(QUERY)]
+
+    def test_ttl(self):
+        self.assertEqual(self.get_products(self.get_catalog()), PRODUCTS)
+        self.assertEqual(self.server.stub.searches, 1)
+        # Within the TTL, even by another instance: the cache answers
+        self.age_cache(3000)
+        self.assertEqual(self.get_products(self.get_catalog()), PRODUCTS)
+        self.assertEqual(self.server.stub.searches, 1)
+        # Other parameters are another search
+        self.get_products(self.get_catalog(parameters=(("productType", "SLC"),)))
+        self.assertEqual(self.server.stub.searches, 2)
+        # Expired
+        self.age_cache(1000)
+        self.get_products(self.get_catalog())
+        self.assertEqual(self.server.stub.searches, 3)
+        # No cache
+        self.get_products(self.get_catalog(ttl=0))
+        self.assertEqual(self.server.stub.searches, 4)
+
+    def test_pages(self):
+        max_records = catalog_module.MAX_RECORDS
+        catalog_module.MAX_RECORDS = 2
+        try:
+            self.assertEqual(self.get_products(self.get_catalog()), PRODUCTS)
+        finally:
+            catalog_module.MAX_RECORDS = max_records
+        self.assertEqual(self.server.stub.searches, 3)
+
+    def test_refresh(self):
+        catalog = self.get_catalog()
+        storages = [product["storage"] for product in catalog.search(QUERY)]
+        self.assertEqual(storages, ["tape", "tape", "disk", "disk", "disk"])
+        self.server.stub.request_staging(PRODUCTS[0])
+        self.assertEqual(catalog.refresh([PRODUCTS[0]], QUERY), {PRODUCTS[0]: "staging"})
+        # Only the product asked for is looked up, and the cache is updated
+        self.assertEqual(self.server.stub.lookups, 1)
+        storages = [product["storage"] for product in catalog.search(QUERY)]
+        self.assertEqual(storages, ["staging", "tape", "disk", "disk", "disk"])
+        self.assertEqual(self.server.stub.searches, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
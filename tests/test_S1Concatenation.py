@@ -0,0 +1,82 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the concatenation of the S1Processor module"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    import numpy as np
+    from osgeo import gdal
+    from S1Processor import Sentinel1PreProcess
+    HAVE_GDAL = True
+except ImportError:
+    HAVE_GDAL = False
+
+XSIZE = 50
+YSIZE = 2000
+
+
+@unittest.skipUnless(HAVE_GDAL, "GDAL and numpy are needed")
+class TestConcatenation(unittest.TestCase):
+    """ The concatenation keeps the first non-zero value of the slices"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_slice(self, name, first_line, last_line, x_off=0):
+        """ Write a slice whose lines first_line to last_line are valid"""
+        data = np.zeros((YSIZE, XSIZE), dtype=np.float32)
+        data[first_line:last_line] = self.random.uniform(1., 2., (last_line-first_line, XSIZE))
+        # Nodata pixels within the valid lines
+        data[first_line:last_line, :5] = 0
+        path = os.path.join(self.directory, name)
+        raster = gdal.GetDriverByName("GTiff").Create(path, XSIZE, YSIZE, 1, gdal.GDT_Float32)
+        raster.SetGeoTransform((600000.+10.*x_off, 10., 0., 5000000., 0., -10.))
+        raster.GetRasterBand(1).WriteArray(data)
+        raster = None
+        return path, data
+
+    def test_first_non_zero(self):
+        slices = [self.add_slice("north.tif", 0, 1200),\
+                  self.add_slice("south.tif", 1000, YSIZE),\
+                  # Too thin for the probe lines: read in full
+                  self.add_slice("thin.tif", 1500, 1505, x_off=10),\
+                  self.add_slice("empty.tif", 0, 0)]
+        output = os.path.join(self.directory, "output.tif")
+        chain = SimpleNamespace(cfg=SimpleNamespace(tuning={"Concatenation": (1, 0)}))
+        Sentinel1PreProcess.concatenate_rasters(chain, [([path for path, _ in slices],\
+                                                         output, [])])
+
+        # Reference: the slices merged from the last one to the first one
+        reference = np.zeros((YSIZE, XSIZE+10), dtype=np.float32)
+        for (_, data), x_off in reversed(list(zip(slices, [0, 0, 10, 0]))):
+            window = reference[:, x_off:x_off+XSIZE]
+            window[data != 0] = data[data != 0]
+        self.assertTrue(np.array_equal(gdal.Open(output).ReadAsArray(), reference))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1DEMCache class"""
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1DEMCache import S1DEMCache
+
+SRTM_SIZE = 1024*1024
+
+
+class TestDEMCache(unittest.TestCase):
+    """ Staging of the SRTM tiles and eviction of the store"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.srtm = os.path.join(self.directory, "srtm")
+        os.makedirs(self.srtm)
+        for value, srtm_tile in enumerate(["N00E000.hgt", "N00E001.hgt", "N00E002.hgt"]):
+            self.write(os.path.join(self.srtm, srtm_tile), value)
+        self.cfg = SimpleNamespace(srtm=self.srtm, dem_cache=os.path.join(self.directory, "cache"),\
+                                   dem_cache_quota=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, value):
+        with open(path, "wb") as srtm_file:
+            srtm_file.write(bytes([value])*SRTM_SIZE)
+
+    def get_store(self, cache):
+        return sorted(entry.name for entry in os.scandir(cache.store))
+
+    def test_staging(self):
+        cache = S1DEMCache(self.cfg)
+        staging_dir = cache.stage("33NWB", ["N00E000.hgt", "N00E001.hgt"])
+        self.assertEqual(sorted(os.listdir(staging_dir)), ["N00E000.hgt", "N00E001.hgt"])
+        self.assertEqual(len(self.get_store(cache)), 2)
+        # The staged tiles are links to the store entries
+        stored = os.stat(os.path.join(staging_dir, "N00E000.hgt"))
+        self.assertIn((stored.st_dev, stored.st_ino),\
+                      [(entry.stat().st_dev, entry.stat().st_ino)\
+                       for entry in os.scandir(cache.store)])
+
+        cache.stage("33NWC", ["N00E000.hgt"])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        cache.release("33NWB")
+        self.assertFalse(os.path.exists(staging_dir))
+
+    def test_content_addressed(self):
+        cache = S1DEMCache(self.cfg)
+        cache.stage("33NWB", ["N00E000.hgt"])
+        # The same tile found in another directory shares the store entry
+        other = os.path.join(self.directory, "other")
+        os.makedirs(other)
+        shutil.copy(os.path.join(self.srtm, "N00E000.hgt"), other)
+        other_cache = S1DEMCache(SimpleNamespace(srtm=other, dem_cache=self.cfg.dem_cache,\
+                                                 dem_cache_quota=0))
+        other_cache.stage("33NWC", ["N00E000.hgt"])
+        self.assertEqual(len(self.get_store(cache)), 1)
+
+        # A modified tile is stored again
+        self.write(os.path.join(other, "N00E000.hgt"), 9)
+        other_cache.stage("33NWD", ["N00E000.hgt"])
+        self.assertEqual(len(self.get_store(cache)), 2)
+
+    def test_eviction(self):
+        cache = S1DEMCache(self.cfg)
+        hostname = socket.gethostname().replace("_", "-")
+        process = subprocess.Popen(["true"])
+        process.wait()
+        # Staged by processes that are gone, on this host and on another one
+        for name, srtm_tile in [("33NWB_"+hostname+"_"+str(process.pid), "N00E000.hgt"),\
+                                ("33NWC_otherhost_"+str(process.pid), "N00E001.hgt")]:
+            cache.stage(name, [srtm_tile])
+            os.rename(cache.staged.pop(name), os.path.join(cache.staging, name))
+        cache.quota = SRTM_SIZE
+        cache.stage("33NWD", ["N00E002.hgt"])
+
+        # Only the directory of the local process is removed, with its tile
+        self.assertEqual(sorted(os.listdir(cache.staging)),\
+                         sorted(["33NWC_otherhost_"+str(process.pid),\
+                                 os.path.basename(cache.staged["33NWD"])]))
+        self.assertEqual(len(self.get_store(cache)), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(cache.staging, "33NWC_otherhost_"\
+                                                        +str(process.pid)))), ["N00E001.hgt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
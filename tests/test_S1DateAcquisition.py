@@ -0,0 +1,73 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the extraction of the S1DateAcquisition class"""
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1DateAcquisition import S1DateAcquisition
+
+SAFE_NAME = "S1A_IW_GRDH_1SDV_20190101T055413_20190101T055438_025000_02C000_AAAA.SAFE"
+IMAGE_NAME = "s1a-iw-grd-{}-20190101t055413-20190101t055438-025000-02c000-{}"
+MEMBERS = ["manifest.safe", "preview/quick-look.png"]\
+    +[path.format(IMAGE_NAME.format(pol, number)) for pol, number in [("vh", "002"), ("vv", "001")]\
+      for path in ["annotation/{}.xml", "annotation/calibration/calibration-{}.xml",\
+                   "annotation/calibration/noise-{}.xml", "measurement/{}.tiff"]]
+
+
+class TestExtraction(unittest.TestCase):
+    """ Only the files of the polarisation of an image are extracted"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        archive = os.path.join(self.directory, SAFE_NAME[:-5]+".zip")
+        with zipfile.ZipFile(archive, "w") as zip_ref:
+            for member in MEMBERS:
+                zip_ref.writestr(SAFE_NAME+"/"+member, member)
+        safe_dir = os.path.join(self.directory, SAFE_NAME)
+        self.acquisition = S1DateAcquisition(os.path.join(safe_dir, "manifest.safe"), [], archive)
+        self.acquisition.set_metadata_members([SAFE_NAME+"/"+member for member in MEMBERS\
+                                               if member == "manifest.safe"\
+                                               or member.startswith("annotation/")])
+        self.image = os.path.join(safe_dir, "measurement", IMAGE_NAME.format("vv", "001")+".tiff")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_extract(self):
+        self.assertTrue(self.acquisition.get_manifest().startswith("/vsizip/"))
+        self.assertTrue(self.acquisition.needs_extraction(self.image))
+        self.acquisition.extract(self.image)
+        self.assertFalse(self.acquisition.needs_extraction(self.image))
+        extracted = sorted(os.path.relpath(os.path.join(root, name),\
+                                           os.path.join(self.directory, SAFE_NAME))\
+                           for root, _, files in os.walk(self.directory) for name in files\
+                           if not name.endswith(".zip"))
+        self.assertEqual(extracted, sorted(member for member in MEMBERS\
+                                           if member == "manifest.safe" or "-vv-" in member))
+
+        # The image is removed once used, the archive still holds it
+        self.acquisition.remove_extracted(self.image)
+        self.assertTrue(self.acquisition.needs_extraction(self.image))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1Downloader class against the PEPS stub server"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+from s1tiling.S1Downloader import S1Downloader, DOWNLOADED, FAILED
+from peps_stub_server import PepsStub, PepsStubHandler, ThreadingHTTPServer
+
+PRODUCT = "S1A_IW_GRDH_1SDV_20190101T055413_20190101T055438_025000_02C000_AAAA"
+
+
+class TestDownloads(unittest.TestCase):
+    """ Resumed transfers and checksum verification"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.served = os.path.join(self.directory, "served")
+        os.makedirs(self.served)
+        self.content = os.urandom(300*1024)
+        with open(os.path.join(self.served, PRODUCT+".zip"), "wb") as archive:
+            archive.write(self.content)
+        self.auth_file = os.path.join(self.directory, "peps.txt")
+        with open(self.auth_file, "w") as auth_file:
+            auth_file.write("user@example.com password\n")
+        self.write_dir = os.path.join(self.directory, "S1Images")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def start_server(self, cut_ratio=0.):
+        """ Serve the products on a free port, cutting some transfers"""
+        self.server = ThreadingHTTPServer(("localhost", 0), PepsStubHandler)
+        self.server.stub = PepsStub(self.served, 0., 0., cut_ratio, 0.)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return S1Downloader(self.auth_file, self.write_dir,\
+                            base_url="http://localhost:"+str(self.server.server_port)+"/resto",\
+                            max_attempts=3, backoff=0.01)
+
+    def get_checksum(self):
+        return "md5:"+self.server.stub.checksums[PRODUCT]
+
+    def test_resume_cut_transfer(self):
+        downloader = self.start_server(cut_ratio=1.)
+        self.assertEqual(downloader.download([(PRODUCT, PRODUCT, self.get_checksum())]),\
+                         {PRODUCT: DOWNLOADED})
+        with open(os.path.join(self.write_dir, PRODUCT+".zip"), "rb") as archive:
+            self.assertEqual(archive.read(), self.content)
+        # The second transfer only asked for the missing half
+        self.assertEqual(self.server.stub.downloads, 2)
+        self.assertEqual(downloader.downloaded_bytes, len(self.content))
+
+    def test_resume_partial_file(self):
+        downloader = self.start_server()
+        with open(os.path.join(self.write_dir, "."+PRODUCT+".zip.part"), "wb") as part:
+            part.write(self.content[:1000])
+        self.assertEqual(downloader.download_product(PRODUCT, PRODUCT, self.get_checksum()),\
+                         DOWNLOADED)
+        self.assertEqual(downloader.downloaded_bytes, len(self.content)-1000)
+
+    def test_checksum_failure(self):
+        downloader = self.start_server()
+        self.assertEqual(downloader.download([(PRODUCT, PRODUCT, "md5:"+"0"*32)]),\
+                         {PRODUCT: FAILED})
+        self.assertEqual(self.server.stub.downloads, 3)
+        # Neither the product nor a partial file is kept
+        self.assertEqual(os.listdir(self.write_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the download plan of the S1FileManager class"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    import ogr
+    from s1tiling.S1FileManager import S1FileManager
+    HAVE_OGR = True
+except ImportError:
+    HAVE_OGR = False
+
+# Two neighbouring tiles and a distant one
+TILE_BOXES = {"31TCJ": (0., 0., 1., 1.), "31TDJ": (0.9, 0., 1.9, 1.), "33NWB": (10., 10., 11., 11.)}
+
+
+def get_polygon(box):
+    """ Returns the GeoJSON polygon of a box"""
+    lonmin, latmin, lonmax, latmax = box
+    return {"type": "Polygon", "coordinates": [[[lonmin, latmin], [lonmax, latmin],\
+                                                [lonmax, latmax], [lonmin, latmax],\
+                                                [lonmin, latmin]]]}
+
+
+def get_product(name, box, realtime=False):
+    """ Returns a product as S1Catalog.search does"""
+    return {"product": name, "id": name, "storage": "disk", "realtime": realtime,\
+            "checksum": None, "geometry": get_polygon(box) if box is not None else None}
+
+
+class Catalog(object):
+    """ Answers every search with the same products, and counts them"""
+    def __init__(self, products):
+        self.products = products
+        self.queries = []
+
+    def search(self, query):
+        self.queries.append(query)
+        return self.products
+
+
+@unittest.skipUnless(HAVE_OGR, "OGR is needed")
+class TestDownloadPlan(unittest.TestCase):
+    """ One catalog search for neighbouring tiles, products deduplicated"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalog = Catalog([get_product("west", (0.1, 0.1, 0.5, 0.5)),\
+                                get_product("swath", (-1., -1., 12., 12.)),\
+                                get_product("nrt", (-1., -1., 12., 12.), realtime=True),\
+                                get_product("unknown", None)])
+        self.file_manager = S1FileManager.__new__(S1FileManager)
+        self.file_manager.cfg = SimpleNamespace(raw_directory=self.directory)
+        self.file_manager.download_plan = None
+        self.file_manager.get_catalog = lambda: self.catalog
+        self.file_manager.get_tile_box = lambda tile: TILE_BOXES[tile]
+        self.file_manager.get_mgrs_tile_geometry_by_name = lambda tile:\
+            ogr.CreateGeometryFromJson(json.dumps(get_polygon(TILE_BOXES[tile])))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_plan(self):
+        self.assertEqual(sorted(tiles for _, tiles in self.file_manager.get_query_boxes(\
+            sorted(TILE_BOXES))), [["31TCJ", "31TDJ"], ["33NWB"]])
+
+        plan = self.file_manager.plan_downloads(sorted(TILE_BOXES))
+        self.assertEqual(len(self.catalog.queries), 2)
+        # Found by both searches, kept once with all its tiles
+        self.assertEqual(dict((name, product["tiles"]) for name, product in plan.items()),\
+                         {"west": ["31TCJ"], "swath": ["31TCJ", "31TDJ", "33NWB"],\
+                          "unknown": ["31TCJ", "31TDJ", "33NWB"]})
+        with open(os.path.join(self.directory, "download_manifest.json")) as manifest:
+            self.assertEqual(sorted(json.load(manifest)["products"]), ["swath", "unknown", "west"])
+
+        # The products of a tile come from the plan, without searching again
+        self.assertEqual(sorted(product["product"] for product\
+                                in self.file_manager.get_downloads("31TDJ")),\
+                         ["swath", "unknown"])
+        self.assertEqual(len(self.catalog.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1Inventory class"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1Inventory import S1Inventory
+
+PRODUCT_A = "S1A_IW_GRDH_1SDV_20190101T055413_20190101T055438_025000_02C000_AAAA.SAFE"
+PRODUCT_B = "S1B_IW_GRDH_1SDV_20190102T055413_20190102T055438_014000_01A000_BBBB.SAFE"
+
+
+class CountingInventory(S1Inventory):
+    """ Counts the products listed"""
+    def __init__(self, directory):
+        S1Inventory.__init__(self, directory)
+        self.listed = []
+
+    def list_entry(self, name, fingerprint):
+        self.listed.append(name)
+        return S1Inventory.list_entry(self, name, fingerprint)
+
+
+class TestInventory(unittest.TestCase):
+    """ Index of the products of a directory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.add_image(PRODUCT_A, "vv")
+        self.add_image(PRODUCT_B, "vh")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_image(self, product, polarisation):
+        """ Add a measurement image to a SAFE directory"""
+        measurement = os.path.join(self.directory, product, "measurement")
+        os.makedirs(measurement, exist_ok=True)
+        image = "s1a-iw-grd-"+polarisation+"-20190101t055413-20190101t055438-025000-02c000-001.tiff"
+        open(os.path.join(measurement, image), "w").close()
+
+    def get_names(self, products):
+        return [product["safe_name"] for product in products]
+
+    def test_indexes(self):
+        inventory = S1Inventory(self.directory)
+        self.assertEqual(self.get_names(inventory.scan()), [PRODUCT_A, PRODUCT_B])
+        self.assertEqual(self.get_names(inventory.get_products(["vv"])), [PRODUCT_A])
+        self.assertEqual(self.get_names(inventory.get_products(["vv", "vh"])),\
+                         [PRODUCT_A, PRODUCT_B])
+        self.assertEqual(self.get_names(inventory.get_products(date="20190102")), [PRODUCT_B])
+        # Absolute orbit 25000 of S1A is the relative orbit (25000-73)%175+1
+        self.assertEqual(self.get_names(inventory.get_products(orbit=78)), [PRODUCT_A])
+        self.assertEqual(inventory.get_products(["vv"], date="20190102"), [])
+
+    def test_rescan_invalidation(self):
+        inventory = CountingInventory(self.directory)
+        inventory.scan()
+        self.assertEqual(sorted(inventory.listed), [PRODUCT_A, PRODUCT_B])
+
+        # Nothing changed: the index file is enough
+        inventory = CountingInventory(self.directory)
+        inventory.scan()
+        self.assertEqual(inventory.listed, [])
+
+        # A new image in a product: only this product is listed again
+        self.add_image(PRODUCT_B, "vv")
+        inventory.scan()
+        self.assertEqual(inventory.listed, [PRODUCT_B])
+        self.assertEqual(self.get_names(inventory.get_products(["vv"])), [PRODUCT_A, PRODUCT_B])
+
+        # A removed product leaves the indexes
+        shutil.rmtree(os.path.join(self.directory, PRODUCT_A))
+        self.assertEqual(self.get_names(inventory.scan()), [PRODUCT_B])
+        self.assertEqual(inventory.get_products(date="20190101"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1JobScheduler class"""
+
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1JobScheduler import S1JobScheduler, S1Job
+
+
+def get_cfg(nb_procs=1, nb_downloads=2, ram_budget=1024):
+    """ Returns the configuration parameters the scheduler uses"""
+    return SimpleNamespace(nb_procs=nb_procs, nb_extractions=1, nb_downloads=nb_downloads,\
+                           cpu_budget=4, ram_budget=ram_budget, trace_file=None,\
+                           stdoutfile=None, stderrfile=None)
+
+
+class TestDownloadPool(unittest.TestCase):
+    """ The downloads run besides the processing jobs"""
+
+    def test_download_and_processing_overlap(self):
+        scheduler = S1JobScheduler(get_cfg(nb_procs=1, nb_downloads=2, ram_budget=1024))
+        downloads = [S1Job(func=lambda: time.sleep(1.), stage="Download",\
+                           nb_threads=0, ram=0, fork=True) for _ in range(2)]
+        # Uses the whole RAM budget and the only processing slot
+        processing = S1Job(func=lambda: time.sleep(0.2), stage="Calibration",\
+                           nb_threads=1, ram=1024, fork=True)
+        failed = scheduler.run(downloads+[processing])
+        self.assertEqual(failed, [])
+        for download in downloads:
+            self.assertLess(processing.start_time, download.end_time)
+            self.assertLess(download.start_time, processing.end_time)
+
+    def test_download_pool_limit(self):
+        scheduler = S1JobScheduler(get_cfg(nb_procs=4, nb_downloads=1))
+        downloads = [S1Job(func=lambda: time.sleep(0.2), stage="Download",\
+                           nb_threads=0, ram=0, fork=True) for _ in range(2)]
+        scheduler.run(downloads)
+        first, second = sorted(downloads, key=lambda job: job.start_time)
+        self.assertGreaterEqual(second.start_time, first.end_time)
+
+    def test_processing_admitted_before_queued_downloads(self):
+        scheduler = S1JobScheduler(get_cfg(nb_procs=1, nb_downloads=1))
+        running = S1Job(func=lambda: time.sleep(0.3), stage="Download",\
+                        nb_threads=0, ram=0, fork=True)
+        queued = S1Job(func=lambda: time.sleep(0.1), stage="Download",\
+                       nb_threads=0, ram=0, fork=True)
+        processing = S1Job(func=lambda: time.sleep(0.1), stage="Calibration",\
+                           nb_threads=1, ram=0, fork=True)
+        scheduler.run([running, queued, processing])
+        self.assertLess(processing.start_time, queued.start_time)
+
+
+
+class TestDelayedJobs(unittest.TestCase):
+    """ A job delayed until its next poll does not hold a slot"""
+
+    def test_delayed_job_waits_without_slot(self):
+        scheduler = S1JobScheduler(get_cfg(nb_procs=1, nb_downloads=1))
+        delayed = S1Job(func=lambda: None, stage="Download", nb_threads=0, ram=0,\
+                        fork=True, not_before=time.time()+0.5)
+        other = S1Job(func=lambda: time.sleep(0.1), stage="Download",\
+                      nb_threads=0, ram=0, fork=True)
+        failed = scheduler.run([delayed, other])
+        self.assertEqual(failed, [])
+        self.assertLess(other.end_time, delayed.start_time)
+        self.assertGreaterEqual(delayed.start_time, delayed.not_before)
+
+    def test_resubmitted_until_done(self):
+        scheduler = S1JobScheduler(get_cfg(nb_procs=1, nb_downloads=1))
+        polls = []
+
+        def poll():
+            polls.append(time.time())
+            if len(polls) < 3:
+                scheduler.submit([S1Job(func=lambda: None, stage="Download",\
+                                        nb_threads=0, ram=0, fork=True, on_success=poll,\
+                                        not_before=time.time()+0.1)])
+
+        failed = scheduler.run([S1Job(func=lambda: None, stage="Download", nb_threads=0,\
+                                      ram=0, fork=True, on_success=poll)])
+        self.assertEqual(failed, [])
+        self.assertEqual(len(polls), 3)
+        self.assertGreaterEqual(polls[2]-polls[0], 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the border cutting of the S1OTBPipeline module"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    import numpy as np
+    import otbApplication
+    from osgeo import gdal
+    from s1tiling import Utils, S1OTBPipeline
+    from S1Processor import Sentinel1PreProcess
+    HAVE_OTB = True
+except ImportError:
+    HAVE_OTB = False
+
+XSIZE = 3000
+YSIZE = 4000
+
+
+@unittest.skipUnless(HAVE_OTB, "OTB, GDAL and numpy are needed")
+class TestBorderCut(unittest.TestCase):
+    """ Both engines cut the borders of the calibrated image the same way"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # A raw image without any zero: its borders are never cut
+        self.image = os.path.join(self.directory, "s1a-iw-grd-vv-20190101t055413.tiff")
+        raw = gdal.GetDriverByName("GTiff").Create(self.image, XSIZE, YSIZE, 1, gdal.GDT_Float32)
+        raw.GetRasterBand(1).WriteArray(np.ones((YSIZE, XSIZE), dtype=np.float32))
+        raw = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def calibrate(self):
+        """
+        Returns an in-memory application standing for the calibration,
+        whose north border is set to 0
+        """
+        calibration = otbApplication.Registry.CreateApplication("BandMath")
+        calibration.SetParameterStringList("il", [self.image])
+        calibration.SetParameterString("exp", "idxY<"+str(2*Utils.BORDER_PROBE_LINE)\
+                                       +" ? 0 : im1b1")
+        calibration.Execute()
+        return calibration
+
+    def test_same_cut_as_cli(self):
+        self.assertFalse(Utils.get_border_cut(self.image)[2])
+
+        # cli engine: the calibrated image is written, then cut
+        calibration = self.calibrate()
+        calibration.SetParameterString("out", self.image.replace(".tiff", "_calOk.tiff"))
+        calibration.ExecuteAndWriteOutput()
+        chain = SimpleNamespace(cfg=SimpleNamespace(tuning={"Cutting": (1, 64)}))
+        Sentinel1PreProcess.cut_image(chain, self.image)
+        cli_cut = gdal.Open(self.image.replace(".tiff", "_OrthoReady.tiff")).ReadAsArray()
+
+        # python engine: the calibrated image is cut in memory
+        calibration = self.calibrate()
+        self.assertEqual(S1OTBPipeline.get_border_cut(calibration),\
+                         (XSIZE, YSIZE, True, False))
+        cut = S1OTBPipeline.cut_borders(calibration, 64)
+        cut.SetParameterString("out", os.path.join(self.directory, "cut.tiff"))
+        cut.ExecuteAndWriteOutput()
+        pipeline_cut = gdal.Open(os.path.join(self.directory, "cut.tiff")).ReadAsArray()
+
+        self.assertTrue(np.array_equal(cli_cut, pipeline_cut))
+        self.assertEqual(np.count_nonzero(cli_cut[:Utils.CUT_OVERLAP_AZIMUTH]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1ProcessingState class"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1ProcessingState import S1ProcessingState, NB_SAMPLES, SAMPLE_SIZE
+
+
+class TestSteps(unittest.TestCase):
+    """ A step is done until its output or its inputs change"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cfg = SimpleNamespace(state_database=os.path.join(self.directory, "state.sqlite"),\
+                                   calibration_type="sigma", removethermalnoise=True,\
+                                   out_spatial_res=10., grid_spacing=40., GeoidFile="egm96.grd",\
+                                   Window_radius=2)
+        self.image = self.write("image.tiff", b"\x01"*(4*NB_SAMPLES*SAMPLE_SIZE))
+        self.output = self.write("image_calOk.tiff", b"\x02"*1000)
+        self.state = S1ProcessingState(self.cfg)
+        self.state.record("product", "vv", "", "calibration", self.output, [self.image])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as output:
+            output.write(content)
+        return path
+
+    def rewrite(self, path, offset, content):
+        """ Change a file in place, keeping its size and modification time"""
+        stat = os.stat(path)
+        with open(path, "r+b") as output:
+            output.seek(offset)
+            output.write(content)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def is_done(self):
+        return self.state.is_done("product", "vv", "", "calibration")
+
+    def test_changed_input(self):
+        self.assertTrue(self.is_done())
+        # A new product of the same size is copied over the raw image
+        self.rewrite(self.image, 0, b"\x03"*SAMPLE_SIZE)
+        self.assertFalse(self.is_done())
+
+    def test_changed_output(self):
+        self.rewrite(self.output, 500, b"\x00")
+        self.assertFalse(self.is_done())
+
+    def test_removed_input(self):
+        # Intermediate images are removed once used
+        os.remove(self.image)
+        self.assertTrue(self.is_done())
+
+    def test_changed_configuration(self):
+        self.cfg.calibration_type = "gamma"
+        self.assertFalse(self.is_done())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1ProductCache class"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1ProductCache import S1ProductCache
+
+RASTER_SIZE = 1024*1024
+
+
+class TestCache(unittest.TestCase):
+    """ The cut rasters are kept while a pending tile needs them"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.images = [os.path.join(self.directory, name+".tiff") for name in ["a", "b", "c"]]
+        # The cut raster of a was produced by a previous run
+        self.cut(self.images[0])
+        state = SimpleNamespace(get_outputs=lambda tile, stage:\
+                                [self.images[0].replace(".tiff", "_OrthoReady.tiff")])
+        self.cache = S1ProductCache(SimpleNamespace(product_cache_quota=2), state)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cut(self, image):
+        """ Write the cut raster of an image"""
+        with open(image.replace(".tiff", "_OrthoReady.tiff"), "wb") as image_ok:
+            image_ok.write(b"\x00"*RASTER_SIZE)
+
+    def get_cached(self):
+        return [image for image in self.images\
+                if os.path.exists(image.replace(".tiff", "_OrthoReady.tiff"))]
+
+    def test_consumers(self):
+        self.cache.set_consumers("33NWB", self.images[:2])
+        self.cache.set_consumers("33NWC", self.images[1:])
+        self.assertTrue(self.cache.use(self.images[0]))
+        for image in self.images[1:]:
+            self.assertFalse(self.cache.use(image))
+            self.cut(image)
+            self.cache.add(image)
+        # Over the quota, but all the rasters are still needed
+        self.assertEqual(self.get_cached(), self.images)
+
+        self.cache.release("33NWB")
+        # Only a is not needed anymore
+        self.assertEqual(self.get_cached(), self.images[1:])
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.evictions), (1, 2, 1))
+
+    def test_lru(self):
+        for image in self.images[1:]:
+            self.cut(image)
+            self.cache.add(image)
+        # The least recently used raster is evicted first
+        self.assertEqual(self.get_cached(), self.images[1:])
+        self.assertTrue(self.cache.use(self.images[1]))
+        self.cut(self.images[0])
+        self.cache.add(self.images[0])
+        self.assertEqual(self.get_cached(), self.images[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1ProductStore class"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1ProductStore import S1ProductStore
+
+PRODUCT_SIZE = 1024*1024
+
+
+class TestEviction(unittest.TestCase):
+    """ Order in which the products are removed under the quota"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.products = {}
+        # The unused products A and B were last used in this order
+        for last_use, name in enumerate(["A", "B", "C", "D", "E", "F"]):
+            product = os.path.join(self.directory, name+".SAFE")
+            os.makedirs(os.path.join(product, "measurement"))
+            with open(os.path.join(product, "measurement", "image.tiff"), "wb") as image:
+                image.write(b"\x00"*PRODUCT_SIZE)
+            os.utime(product, (1000+last_use, 1000+last_use))
+            self.products[name] = product
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_store(self, quota, can_download):
+        store = S1ProductStore(SimpleNamespace(raw_directory=self.directory,\
+                                               product_store_quota=quota,\
+                                               pepsdownload=can_download))
+        # C is needed after D, E by the current tile, F by another worker
+        for tile, name in [("T1", "E"), ("T2", "D"), ("T3", "C"), ("T4", "F")]:
+            store.set_consumers(tile, [(SimpleNamespace(get_safe_dir=lambda name=name:\
+                                                        self.products[name]), None)])
+        store.set_pending_tiles(["T1", "T2", "T3"])
+        store.set_leased_tiles(["T4"])
+        return store
+
+    def get_left(self):
+        return sorted(name for name, product in self.products.items() if os.path.exists(product))
+
+    def test_least_future_use(self):
+        store = self.get_store(3, True)
+        self.assertTrue(store.evict("T1"))
+        # The unused products first, least recently used first, then the
+        # product needed the latest
+        self.assertEqual(self.get_left(), ["D", "E", "F"])
+        self.assertEqual(store.evictions, 3)
+
+    def test_products_needed_are_kept(self):
+        store = self.get_store(1, False)
+        store.evict("T1")
+        # The needed products cannot be downloaded again
+        self.assertEqual(self.get_left(), ["C", "D", "E", "F"])
+
+    def test_lru(self):
+        store = self.get_store(5, True)
+        store.use([(SimpleNamespace(get_safe_dir=lambda: self.products["A"]), None)])
+        store.evict("T1")
+        self.assertEqual(self.get_left(), ["A", "C", "D", "E", "F"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1StagingTracker class against the PEPS stub server"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+from s1tiling.S1Catalog import S1Catalog
+from s1tiling.S1Downloader import S1Downloader, DOWNLOADED
+from s1tiling.S1StagingTracker import S1StagingTracker, REQUESTED
+from peps_stub_server import PepsStub, PepsStubHandler, ThreadingHTTPServer
+
+PRODUCTS = ["S1A_IW_GRDH_1SDV_2019010"+str(day)+"T055413_AAAA" for day in range(1, 4)]
+QUERY = "box=1.000000,43.000000,2.000000,44.000000"
+
+
+class CountingStub(PepsStub):
+    """ Counts the staging requests"""
+    def __init__(self, *args):
+        PepsStub.__init__(self, *args)
+        self.staging_requests = []
+
+    def request_staging(self, product):
+        self.staging_requests.append(product)
+        PepsStub.request_staging(self, product)
+
+
+class TestRestart(unittest.TestCase):
+    """ The staging of a product is requested once, across runs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        served = os.path.join(self.directory, "served")
+        os.makedirs(served)
+        for product in PRODUCTS:
+            with open(os.path.join(served, product+".zip"), "wb") as archive:
+                archive.write(product.encode())
+        self.auth_file = os.path.join(self.directory, "peps.txt")
+        with open(self.auth_file, "w") as out_file:
+            out_file.write("user@example.com password\n")
+        self.server = ThreadingHTTPServer(("localhost", 0), PepsStubHandler)
+        # The first two products are on tape, staged in 0.5 s
+        self.server.stub = CountingStub(served, 0.67, 0.5, 0., 0.)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.database = os.path.join(self.directory, "staging.sqlite")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def get_tracker(self):
+        """ A new run: new downloader, catalog and tracker"""
+        downloader = S1Downloader(self.auth_file, os.path.join(self.directory, "S1Images"),\
+                                  base_url="http://localhost:"+str(self.server.server_port)\
+                                  +"/resto")
+        catalog = S1Catalog(downloader, [])
+        tracker = S1StagingTracker(self.database, downloader, catalog,\
+                                   staging_poll=0.05, max_staging_poll=0.2)
+        tracker.add(catalog.search(QUERY))
+        return tracker
+
+    def test_restart(self):
+        tracker = self.get_tracker()
+        states = [tracker.step(product)["state"] for product in PRODUCTS]
+        self.assertEqual(states, [REQUESTED, REQUESTED, DOWNLOADED])
+        self.assertEqual(sorted(self.server.stub.staging_requests), PRODUCTS[:2])
+        requested_times = [tracker.products[product]["requested_time"] for product in PRODUCTS]
+        tracker.connection.close()
+
+        # The run is interrupted, and started again while the products
+        # are still being staged: their states are read from the database
+        tracker = self.get_tracker()
+        self.assertEqual([tracker.products[product]["state"] for product in PRODUCTS[:2]],\
+                         [REQUESTED, REQUESTED])
+        self.assertEqual([tracker.products[product]["requested_time"] for product in PRODUCTS],\
+                         requested_times)
+        self.assertEqual(tracker.run(), dict((product, DOWNLOADED) for product in PRODUCTS))
+        self.assertEqual(sorted(self.server.stub.staging_requests), PRODUCTS[:2])
+        self.assertEqual(self.server.stub.downloads, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
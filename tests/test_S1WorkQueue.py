@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+# =========================================================================
+#   Program:   S1Processor
+#
+#   Copyright (c) CESBIO. All rights reserved.
+#
+#   See LICENSE for details.
+#
+#   This software is distributed WITHOUT ANY WARRANTY; without even
+#   the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the above copyright notices for more information.
+#
+# =========================================================================
+
+""" Tests of the S1WorkQueue class"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from s1tiling.S1WorkQueue import S1WorkQueue, MAX_ATTEMPTS
+
+
+class TestRetry(unittest.TestCase):
+    """ A failed tile is tried again up to MAX_ATTEMPTS times"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = S1WorkQueue(os.path.join(self.directory, "queue.sqlite"), 60)
+        self.queue.add_tiles([("33NWB", 2), ("33NWC", 1)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_failed_tile_is_retried(self):
+        tiles = []
+        for tile in self.queue.tiles():
+            tiles.append(tile)
+            self.queue.complete(tile, success=tile == "33NWC")
+        self.assertEqual(tiles, ["33NWB"]*MAX_ATTEMPTS+["33NWC"])
+        states, _ = self.queue.get_progress()
+        self.assertEqual(states, {"failed": 1, "done": 1})
+
+    def test_pending_tiles(self):
+        self.assertEqual(self.queue.get_pending_tiles(), ["33NWB", "33NWC"])
+        # Another worker processes the first tile
+        other = S1WorkQueue(self.queue.database, 60)
+        tile = other.acquire()
+        self.assertEqual(self.queue.get_pending_tiles(), ["33NWB", "33NWC"])
+        other.complete(tile)
+        self.assertEqual(self.queue.get_pending_tiles(), ["33NWC"])
+
+    def test_fork_during_heartbeat(self):
+        # The lease is renewed every 10 ms while the process forks
+        queue = S1WorkQueue(os.path.join(self.directory, "queue.sqlite"), 0.03)
+        tile = queue.acquire()
+        for _ in range(50):
+            pid = os.fork()
+            if pid == 0:
+                # The child uses a connection of its own
+                connection = queue.connect()
+                connection.execute("SELECT COUNT(*) FROM tiles").fetchone()
+                os._exit(0)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(status, 0)
+        queue.complete(tile)
+        self.assertEqual(queue.get_progress()[0], {"done": 1, "pending": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()